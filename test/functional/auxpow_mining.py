@@ -15,8 +15,10 @@ from test_framework.util import (
 
 from test_framework.auxpow import reverseHex
 from test_framework.auxpow_testing import (
+  batchResults,
   computeAuxpow,
   getCoinbaseAddr,
+  mineAuxpowBlocks,
   mineAuxpowBlockWithMethods,
 )
 from test_framework.messages import (
@@ -44,6 +46,9 @@ class AuxpowMiningTest (BitcoinTestFramework):
     # Test with createauxblock/submitauxblock.
     self.test_create_submit_auxblock ()
 
+    # Test batched mining of many blocks.
+    self.test_mine_auxpow_blocks ()
+
   def test_common (self, create, submit):
     # Verify data that can be found in another way.
     auxblock = create()
@@ -168,5 +173,32 @@ class AuxpowMiningTest (BitcoinTestFramework):
     auxblock2 = self.nodes[0].createauxblock(self.nodes[0].getnewaddress ())
     assert auxblock1['hash'] != auxblock2['hash']
 
+  def test_mine_auxpow_blocks (self):
+    """
+    Test mineAuxpowBlocks, which sends each submitauxblock in one batch
+    with the next createauxblock, over RPC and through bvault-cli.
+    """
+
+    nodes = [self.nodes[0]]
+    if self.is_cli_compiled ():
+      nodes.append (self.nodes[0].cli)
+
+    for node in nodes:
+      height = self.nodes[0].getblockcount ()
+      (hashes, rate) = mineAuxpowBlocks (node, 10)
+      assert rate > 0
+      assert_equal (hashes, [self.nodes[0].getblockhash (h)
+                             for h in range (height + 1, height + 11)])
+
+      # All blocks pay to the same address and reach the other node.
+      self.sync_all ()
+      addrs = set (getCoinbaseAddr (self.nodes[1], h) for h in hashes)
+      assert_equal (len (addrs), 1)
+
+      # Errors in a batch are raised by batchResults.
+      responses = node.batch ([node.createauxblock.get_request ("this_an_invalid_address")])
+      assert_raises_rpc_error (-5, "Invalid coinbase payout address",
+                               batchResults, responses)
+
 if __name__ == '__main__':
   AuxpowMiningTest ().main ()
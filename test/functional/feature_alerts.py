@@ -57,11 +57,7 @@ class AlertsTest(BitcoinTestFramework):
 
     def reset_blockchain(self):
         self.stop_nodes(wait=1)
-        for i in range(self.num_nodes):
-            datadir = get_datadir_path(self.options.tmpdir, i)
-            if os.path.exists(datadir):
-                shutil.rmtree(datadir)
-                os.mkdir(datadir)
+        self.wipe_datadirs()
 
         self.nodes = []
         self.setup_chain()
@@ -69,6 +65,11 @@ class AlertsTest(BitcoinTestFramework):
         self.setup_network()
         self.sync_all()
 
+    def reset_blockchain_with_funded_alert_address(self):
+        """Reset to a chain of 200 blocks mined by node1 to its alert address self.alert_addr1."""
+        self.alert_addr1 = self.reset_chain_with_funded_address(
+            'funded_alert_address', lambda node: node.getnewvaultalertaddress(self.alert_recovery_pubkey))
+
     def reset_node(self, i):
         self.stop_node(i, wait=1)
         datadir = get_datadir_path(self.options.tmpdir, i)
@@ -85,7 +86,7 @@ class AlertsTest(BitcoinTestFramework):
         self.COINBASE_MATURITY = 100
         self.COINBASE_AMOUNT = Decimal(175)
 
-        self.reset_blockchain()
+        self.reset_blockchain_with_funded_alert_address()
         self.log.info("Test alert tx change is by default sent back to the sender")
         self.test_alert_tx_change_is_by_default_sent_back_to_the_sender()
 
@@ -113,15 +114,15 @@ class AlertsTest(BitcoinTestFramework):
         self.log.info("Test standard signrawtransactionwithwallet flow")
         self.test_signrawtransactionwithwallet()
 
-        self.reset_blockchain()
+        self.reset_blockchain_with_funded_alert_address()
         self.log.info("Test standard signalerttransaction flow")
         self.test_signalerttransaction()
 
-        self.reset_blockchain()
+        self.reset_blockchain_with_funded_alert_address()
         self.log.info("Test signalerttransaction when recovery key imported")
         self.test_signalerttransaction_when_recovery_key_imported()
 
-        self.reset_blockchain()
+        self.reset_blockchain_with_funded_alert_address()
         self.log.info("Test signalerttransaction when no key available")
         self.test_signalerttransaction_when_no_key()
 
@@ -157,11 +158,11 @@ class AlertsTest(BitcoinTestFramework):
         self.log.info("Test import alert address privkey")
         self.test_import_alert_address_privkey()
 
-        self.reset_blockchain()
+        self.reset_blockchain_with_funded_alert_address()
         self.log.info("Test signrawtransactionwithwallet should reject alert transaction")
         self.test_signrawtransactionwithwallet_should_reject_alert_transaction()
 
-        self.reset_blockchain()
+        self.reset_blockchain_with_funded_alert_address()
         self.log.info("Test sign atx with recovery key")
         self.test_sign_atx_with_recovery_key()
 
@@ -169,7 +170,7 @@ class AlertsTest(BitcoinTestFramework):
         self.log.info("Test tx from normal address to alert address")
         self.test_tx_from_normal_addr_to_alert_addr()
 
-        self.reset_blockchain()
+        self.reset_blockchain_with_funded_alert_address()
         self.log.info("Test atx from alert address to normal address")
         self.test_atx_from_alert_addr_to_normal_addr()
 
@@ -181,11 +182,11 @@ class AlertsTest(BitcoinTestFramework):
         self.log.info("Test tx from normal address to normal address")
         self.test_tx_from_normal_addr_to_normal_addr()
 
-        self.reset_blockchain()
+        self.reset_blockchain_with_funded_alert_address()
         self.log.info("Test atx becomes tx after 144 blocks")
         self.test_atx_becomes_tx()
 
-        self.reset_blockchain()
+        self.reset_blockchain_with_funded_alert_address()
         self.log.info("Test block without confirmed atx is rejected")
         self.test_block_without_confirmed_atx_is_rejected()
 
@@ -229,7 +230,7 @@ class AlertsTest(BitcoinTestFramework):
         self.log.info("Test standard recovery transaction flow")
         self.test_recovery_tx_flow()
 
-        self.reset_blockchain()
+        self.reset_blockchain_with_funded_alert_address()
         self.log.info("Test recovery transaction flow for two alerts")
         self.test_recovery_tx_flow_for_two_alerts()
 
@@ -237,15 +238,15 @@ class AlertsTest(BitcoinTestFramework):
         self.log.info("Test recovery transaction when alert is confirmed at the same height")
         self.test_recovery_tx_when_alert_is_confirmed_at_the_same_height()
 
-        self.reset_blockchain()
+        self.reset_blockchain_with_funded_alert_address()
         self.log.info("Test recovery tx is rejected when alert inputs are missing")
         self.test_recovery_tx_is_rejected_when_alert_inputs_are_missing()
 
-        self.reset_blockchain()
+        self.reset_blockchain_with_funded_alert_address()
         self.log.info("Test recovery tx is rejected when inputs are non alert")
         self.test_recovery_tx_is_rejected_when_inputs_are_non_alert()
 
-        self.reset_blockchain()
+        self.reset_blockchain_with_funded_alert_address()
         self.log.info("Test recovery tx is rejected when using the same inputs as other")
         self.test_recovery_tx_is_rejected_when_using_same_inputs_as_other()
 
@@ -253,16 +254,13 @@ class AlertsTest(BitcoinTestFramework):
         self.log.info("Test recovery tx is rejected when gets invalidated by chain")
         self.test_recovery_tx_is_rejected_when_recovers_alert_from_mempool()
 
-        self.reset_blockchain()
+        self.reset_blockchain_with_funded_alert_address()
         self.log.info("Test getrawtransaction returns information about unconfirmed atx")
         self.test_getrawtransaction_returns_information_about_unconfirmed_atx()
 
     def test_alert_tx_change_is_by_default_sent_back_to_the_sender(self):
         addr0 = self.nodes[0].getnewaddress()
-        alert_addr1 = self.nodes[1].getnewvaultalertaddress(self.alert_recovery_pubkey)
-
-        # mine some coins to alert_addr1
-        self.nodes[1].generatetoaddress(200, alert_addr1['address'])
+        alert_addr1 = self.alert_addr1
 
         # create atx
         amount = 10
@@ -588,10 +586,7 @@ class AlertsTest(BitcoinTestFramework):
 
     def test_atx_from_alert_addr_to_normal_addr(self):
         addr0 = self.nodes[0].getnewaddress()
-        alert_addr1 = self.nodes[1].getnewvaultalertaddress(self.alert_recovery_pubkey)
-
-        # mine some coins to alert_addr1
-        self.nodes[1].generatetoaddress(200, alert_addr1['address'])
+        alert_addr1 = self.alert_addr1
 
         # send atx from alert_addr1 to addr0 and generate block with this atx
         atxid = self.nodes[1].sendalerttoaddress(addr0, 10)
@@ -659,10 +654,7 @@ class AlertsTest(BitcoinTestFramework):
 
     def test_atx_becomes_tx(self):
         addr0 = self.nodes[0].getnewaddress()
-        alert_addr1 = self.nodes[1].getnewvaultalertaddress(self.alert_recovery_pubkey)
-
-        # mine some coins to alert_addr1
-        self.nodes[1].generatetoaddress(200, alert_addr1['address'])
+        alert_addr1 = self.alert_addr1
 
         # send atx from alert_addr1 to addr0 and generate block with this atx
         atxid = self.nodes[1].sendalerttoaddress(addr0, 10)
@@ -685,10 +677,7 @@ class AlertsTest(BitcoinTestFramework):
 
     def test_block_without_confirmed_atx_is_rejected(self):
         addr0 = self.nodes[0].getnewaddress()
-        alert_addr1 = self.nodes[1].getnewvaultalertaddress(self.alert_recovery_pubkey)
-
-        # mine some coins to alert_addr1
-        self.nodes[1].generatetoaddress(200, alert_addr1['address'])
+        alert_addr1 = self.alert_addr1
 
         # send atx from alert_addr1 to addr0 and generate block with this atx
         atxid = self.nodes[1].sendalerttoaddress(addr0, 10)
@@ -738,12 +727,9 @@ class AlertsTest(BitcoinTestFramework):
 
     def test_signalerttransaction_when_no_key(self):
         addr0 = self.nodes[0].getnewaddress()
-        alert_addr1 = self.nodes[1].getnewvaultalertaddress(self.alert_recovery_pubkey)
+        alert_addr1 = self.alert_addr1
         info = self.nodes[1].getaddressinfo(alert_addr1['address'])
 
-        # mine some coins to alert_addr1
-        self.nodes[1].generatetoaddress(200, alert_addr1['address'])
-
         # find vout to spend
         txtospendhash = self.nodes[1].getblockbyheight(10)['tx'][0]
         txtospend = self.nodes[1].getrawtransaction(txtospendhash, True)
@@ -759,10 +745,7 @@ class AlertsTest(BitcoinTestFramework):
 
     def test_signalerttransaction_when_recovery_key_imported(self):
         addr0 = self.nodes[0].getnewaddress()
-        alert_addr1 = self.nodes[1].getnewvaultalertaddress(self.alert_recovery_pubkey)
-
-        # mine some coins to alert_addr1
-        self.nodes[1].generatetoaddress(200, alert_addr1['address'])
+        alert_addr1 = self.alert_addr1
 
         # import key
         self.nodes[1].importprivkey(self.alert_recovery_privkey)
@@ -787,10 +770,7 @@ class AlertsTest(BitcoinTestFramework):
 
     def test_signalerttransaction(self):
         addr0 = self.nodes[0].getnewaddress()
-        alert_addr1 = self.nodes[1].getnewvaultalertaddress(self.alert_recovery_pubkey)
-
-        # mine some coins to alert_addr1
-        self.nodes[1].generatetoaddress(200, alert_addr1['address'])
+        alert_addr1 = self.alert_addr1
 
         # find vout to spend
         txtospendhash = self.nodes[1].getblockbyheight(10)['tx'][0]
@@ -833,12 +813,9 @@ class AlertsTest(BitcoinTestFramework):
 
     def test_signrawtransactionwithwallet_should_reject_alert_transaction(self):
         addr0 = self.nodes[0].getnewaddress()
-        alert_addr1 = self.nodes[1].getnewvaultalertaddress(self.alert_recovery_pubkey)
+        alert_addr1 = self.alert_addr1
         info = self.nodes[1].getaddressinfo(alert_addr1['address'])
 
-        # mine some coins to alert_addr1
-        self.nodes[1].generatetoaddress(200, alert_addr1['address'])
-
         # find vout to spend
         txtospendhash = self.nodes[1].getblockbyheight(10)['tx'][0]
         txtospend = self.nodes[1].getrawtransaction(txtospendhash, True)
@@ -862,10 +839,8 @@ class AlertsTest(BitcoinTestFramework):
     def test_sign_atx_with_recovery_key(self):
         addr0 = self.nodes[0].getnewaddress()
 
-        # mine some coins to alert_addr1
-        alert_addr1 = self.nodes[1].getnewvaultalertaddress(self.alert_recovery_pubkey)
+        alert_addr1 = self.alert_addr1
         info = self.nodes[1].getaddressinfo(alert_addr1['address'])
-        self.nodes[1].generatetoaddress(200, alert_addr1['address'])
 
         # find vout to spend
         txtospendhash = self.nodes[1].getblockbyheight(10)['tx'][0]
@@ -1243,9 +1218,7 @@ class AlertsTest(BitcoinTestFramework):
     def test_recovery_tx_flow_for_two_alerts(self):
         addr0 = self.nodes[0].getnewaddress()
 
-        # mine some coins to alert_addr1
-        alert_addr1 = self.nodes[1].getnewvaultalertaddress(self.alert_recovery_pubkey)
-        self.nodes[1].generatetoaddress(200, alert_addr1['address'])
+        alert_addr1 = self.alert_addr1
 
         # create, sign and mine 1st atx from alert_addr1 to addr0
         txtospendhash = self.nodes[1].getblockbyheight(10)['tx'][0]
@@ -1327,9 +1300,7 @@ class AlertsTest(BitcoinTestFramework):
     def test_recovery_tx_is_rejected_when_alert_inputs_are_missing(self):
         addr0 = self.nodes[0].getnewaddress()
 
-        # mine some coins to alert_addr1
-        alert_addr1 = self.nodes[1].getnewvaultalertaddress(self.alert_recovery_pubkey)
-        self.nodes[1].generatetoaddress(200, alert_addr1['address'])
+        alert_addr1 = self.alert_addr1
 
         # create, sign and mine 1st atx from alert_addr1 to addr0
         txtospendhash = self.nodes[1].getblockbyheight(10)['tx'][0]
@@ -1376,9 +1347,7 @@ class AlertsTest(BitcoinTestFramework):
     def test_recovery_tx_is_rejected_when_inputs_are_non_alert(self):
         addr0 = self.nodes[0].getnewaddress()
 
-        # mine some coins to alert_addr1
-        alert_addr1 = self.nodes[1].getnewvaultalertaddress(self.alert_recovery_pubkey)
-        self.nodes[1].generatetoaddress(200, alert_addr1['address'])
+        alert_addr1 = self.alert_addr1
 
         # create, sign and mine 1st atx from alert_addr1 to addr0
         txtospendhash = self.nodes[1].getblockbyheight(10)['tx'][0]
@@ -1411,9 +1380,7 @@ class AlertsTest(BitcoinTestFramework):
     def test_recovery_tx_is_rejected_when_using_same_inputs_as_other(self):
         addr0 = self.nodes[0].getnewaddress()
 
-        # mine some coins to alert_addr1
-        alert_addr1 = self.nodes[1].getnewvaultalertaddress(self.alert_recovery_pubkey)
-        self.nodes[1].generatetoaddress(200, alert_addr1['address'])
+        alert_addr1 = self.alert_addr1
 
         # create, sign and mine 1st atx from alert_addr1 to addr0
         txtospendhash = self.nodes[1].getblockbyheight(10)['tx'][0]
@@ -1487,10 +1454,7 @@ class AlertsTest(BitcoinTestFramework):
 
     def test_getrawtransaction_returns_information_about_unconfirmed_atx(self):
         addr0 = self.nodes[0].getnewaddress()
-        alert_addr1 = self.nodes[1].getnewvaultalertaddress(self.alert_recovery_pubkey)
-
-        # mine some coins to alert_addr1
-        self.nodes[1].generatetoaddress(200, alert_addr1['address'])
+        alert_addr1 = self.alert_addr1
 
         # create atx
         atxid = self.nodes[1].sendalerttoaddress(addr0, 10)
@@ -12,12 +12,18 @@ from test_framework.authproxy import JSONRPCException
 from test_framework.util import get_datadir_path, hex_str_to_bytes
 from test_framework.address import key_to_p2pkh
 
-def introduce_and_reset_blockchain(func):
-    def func_wrapper(self):
-        self.reset_blockchain()
-        self.log.info(func.__name__.replace('_',' '))
-        return func(self)
-    return func_wrapper
+def introduce_and_reset(reset):
+    """Decorate a sub-test to call reset(self) and log the sub-test's name before it runs."""
+    def decorator(func):
+        def func_wrapper(self):
+            reset(self)
+            self.log.info(func.__name__.replace('_',' '))
+            return func(self)
+        return func_wrapper
+    return decorator
+
+introduce_and_reset_blockchain = introduce_and_reset(lambda self: self.reset_blockchain())
+introduce_and_reset_blockchain_with_funded_instant_address = introduce_and_reset(lambda self: self.reset_blockchain_with_funded_instant_address())
 
 class AlertsInstantTest(BitcoinTestFramework):
     def set_test_params(self):
@@ -54,11 +60,7 @@ class AlertsInstantTest(BitcoinTestFramework):
 
     def reset_blockchain(self):
         self.stop_nodes(wait=1)
-        for i in range(self.num_nodes):
-            datadir = get_datadir_path(self.options.tmpdir, i)
-            if os.path.exists(datadir):
-                shutil.rmtree(datadir)
-                os.mkdir(datadir)
+        self.wipe_datadirs()
 
         self.nodes = []
         self.setup_chain()
@@ -66,6 +68,12 @@ class AlertsInstantTest(BitcoinTestFramework):
         self.setup_network()
         self.sync_all()
 
+    def reset_blockchain_with_funded_instant_address(self):
+        """Reset to a chain of 200 blocks mined by node1 to its instant address self.alert_addr1."""
+        self.alert_addr1 = self.reset_chain_with_funded_address(
+            'funded_instant_address',
+            lambda node: node.getnewvaultinstantaddress(self.alert_instant_pubkey, self.alert_recovery_pubkey))
+
     def reset_node(self, i):
         self.stop_node(i, wait=1)
         datadir = get_datadir_path(self.options.tmpdir, i)
@@ -99,7 +107,7 @@ class AlertsInstantTest(BitcoinTestFramework):
 
         self.test_alert_tx_change_is_by_default_sent_back_to_the_sender_with_tx_replaceable_no()
 
-        self.reset_blockchain()
+        self.reset_blockchain_with_funded_instant_address()
         self.log.info("Test alert tx change is by default sent back to the sender")
         self.test_alert_tx_change_is_by_default_sent_back_to_the_sender()
 
@@ -399,13 +407,10 @@ class AlertsInstantTest(BitcoinTestFramework):
         assert alert_addr1['address'] == change_vout['scriptPubKey']['addresses'][0]
         assert cnt == 0
 
-    @introduce_and_reset_blockchain
+    @introduce_and_reset_blockchain_with_funded_instant_address
     def test_alert_tx_change_is_by_default_sent_back_to_the_sender_with_tx_replaceable_no(self):
         addr0 = self.nodes[0].getnewaddress()
-        alert_addr1 = self.nodes[1].getnewvaultinstantaddress(self.alert_instant_pubkey, self.alert_recovery_pubkey)
-
-        # mine some coins to alert_addr1
-        self.nodes[1].generatetoaddress(200, alert_addr1['address'])
+        alert_addr1 = self.alert_addr1
 
         # create atx
         amount = 10
@@ -425,13 +430,10 @@ class AlertsInstantTest(BitcoinTestFramework):
         assert alert_addr1['address'] == change_vout['scriptPubKey']['addresses'][0]
         assert cnt == 0
 
-    @introduce_and_reset_blockchain
+    @introduce_and_reset_blockchain_with_funded_instant_address
     def test_alert_tx_change_is_by_default_sent_back_to_the_sender_with_tx_replaceable_yes(self):
         addr0 = self.nodes[0].getnewaddress()
-        alert_addr1 = self.nodes[1].getnewvaultinstantaddress(self.alert_instant_pubkey, self.alert_recovery_pubkey)
-
-        # mine some coins to alert_addr1
-        self.nodes[1].generatetoaddress(200, alert_addr1['address'])
+        alert_addr1 = self.alert_addr1
 
         # create atx
         amount = 10
@@ -451,13 +453,10 @@ class AlertsInstantTest(BitcoinTestFramework):
         assert alert_addr1['address'] == change_vout['scriptPubKey']['addresses'][0]
         assert cnt == 0
 
-    @introduce_and_reset_blockchain
+    @introduce_and_reset_blockchain_with_funded_instant_address
     def test_alert_tx_change_is_by_default_sent_back_to_the_sender_with_tx_conf_target_range_only(self):
         addr0 = self.nodes[0].getnewaddress()
-        alert_addr1 = self.nodes[1].getnewvaultinstantaddress(self.alert_instant_pubkey, self.alert_recovery_pubkey)
-
-        # mine some coins to alert_addr1
-        self.nodes[1].generatetoaddress(200, alert_addr1['address'])
+        alert_addr1 = self.alert_addr1
 
         conf_targets = [0, 1, 10, 1009, "lubie placki", 1008]
         # create atx
@@ -479,13 +478,9 @@ class AlertsInstantTest(BitcoinTestFramework):
         assert alert_addr1['address'] == change_vout['scriptPubKey']['addresses'][0]
         assert cnt == 0
 
-    @introduce_and_reset_blockchain
+    @introduce_and_reset_blockchain_with_funded_instant_address
     def test_alert_tx_change_is_by_default_sent_back_to_the_sender_with_tx_estimate_mode_check_only(self):
         addr0 = self.nodes[0].getnewaddress()
-        alert_addr1 = self.nodes[1].getnewvaultinstantaddress(self.alert_instant_pubkey, self.alert_recovery_pubkey)
-
-        # mine some coins to alert_addr1
-        self.nodes[1].generatetoaddress(200, alert_addr1['address'])
         estimate_mode = [ "UNSET", "ECONOMICAL", "CONSERVATIVE", "WRONG_OPTION" ]
         # create atx
         amount = 10
@@ -500,10 +495,7 @@ class AlertsInstantTest(BitcoinTestFramework):
 
     def test_alert_tx_change_is_by_default_sent_back_to_the_sender(self):
         addr0 = self.nodes[0].getnewaddress()
-        alert_addr1 = self.nodes[1].getnewvaultinstantaddress(self.alert_instant_pubkey, self.alert_recovery_pubkey)
-
-        # mine some coins to alert_addr1
-        self.nodes[1].generatetoaddress(200, alert_addr1['address'])
+        alert_addr1 = self.alert_addr1
 
         # create atx
         amount = 10
@@ -45,11 +45,7 @@ class VaultReorgTest(BitcoinTestFramework):
 
     def reset_blockchain(self):
         self.stop_nodes(wait=1)
-        for i in range(self.num_nodes):
-            datadir = get_datadir_path(self.options.tmpdir, i)
-            if os.path.exists(datadir):
-                shutil.rmtree(datadir)
-                os.mkdir(datadir)
+        self.wipe_datadirs()
 
         self.nodes = []
         self.setup_chain()
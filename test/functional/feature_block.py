@@ -110,7 +110,7 @@ class FullBlockTest(BitcoinTestFramework):
         for i in range(NUM_BUFFER_BLOCKS_TO_GENERATE):
             blocks.append(self.next_block("maturitybuffer.{}".format(i)))
             self.save_spendable_output()
-        self.sync_blocks(blocks)
+        self.nodes[0].p2p.send_blocks_bulk(blocks, self.nodes[0])
 
         # collect spendable outputs now to avoid cluttering the code later on
         out = []
@@ -1232,7 +1232,7 @@ class FullBlockTest(BitcoinTestFramework):
             self.save_spendable_output()
             spend = self.get_spendable_output()
 
-        self.sync_blocks(blocks, True, timeout=480)
+        self.nodes[0].p2p.send_blocks_bulk(blocks, self.nodes[0], timeout=480)
         chain1_tip = i
 
         # now create alt chain of same length
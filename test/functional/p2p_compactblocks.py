@@ -12,7 +12,7 @@ import random
 
 from test_framework.blocktools import create_block, create_coinbase, add_witness_commitment
 from test_framework.messages import BlockTransactions, BlockTransactionsRequest, calculate_shortid, CBlock, CBlockHeader, CInv, COutPoint, CTransaction, CTxIn, CTxInWitness, CTxOut, FromHex, HeaderAndShortIDs, msg_block, msg_blocktxn, msg_cmpctblock, msg_getblocktxn, msg_getdata, msg_getheaders, msg_headers, msg_inv, msg_sendcmpct, msg_sendheaders, msg_tx, msg_witness_block, msg_witness_blocktxn, MSG_WITNESS_FLAG, NODE_NETWORK, NODE_WITNESS, P2PHeaderAndShortIDs, PrefilledTransaction, ser_uint256, ToHex
-from test_framework.mininode import mininode_lock, P2PInterface
+from test_framework.mininode import mininode_lock, P2PDataStore, P2PInterface
 from test_framework.script import CScript, OP_TRUE, OP_DROP
 from test_framework.test_framework import BitcoinTestFramework
 from test_framework.util import assert_equal, get_bip9_status, satoshi_round, sync_blocks, wait_until
@@ -791,6 +791,51 @@ class CompactBlocksTest(BitcoinTestFramework):
         stalling_peer.send_and_ping(msg)
         assert_equal(int(node.getbestblockhash(), 16), block.sha256)
 
+    # Test that P2PDataStore rebuilds the compact blocks the node announces,
+    # first with all transactions in its store, then with none of them, so that
+    # it has to fetch them with getblocktxn.
+    def test_p2p_data_store_reconstruction(self, node):
+        peer = node.add_p2p_connection(P2PDataStore())
+        # The node announces blocks with cmpctblock only to peers that have
+        # the header of the parent
+        getheaders = msg_getheaders()
+        getheaders.locator.vHave = [int(node.getbestblockhash(), 16)]
+        peer.send_and_ping(getheaders)
+        peer.request_compact_blocks(version=2)
+        peer.sync_with_ping()
+
+        utxo = self.utxos.pop(0)
+        block = self.build_block_with_transactions(node, utxo, 5)
+        with mininode_lock:
+            for tx in block.vtx[1:]:
+                peer.tx_store[tx.sha256] = tx
+        node.submitblock(ToHex(block))
+        reconstructed = peer.wait_for_reconstructed_block(block.sha256)
+        assert_equal(reconstructed.serialize(), block.serialize())
+        with mininode_lock:
+            stats = dict(peer.compact_block_stats)
+        assert_equal(stats["blocks"], 1)
+        assert_equal(stats["prefilled"], 1)
+        assert_equal(stats["from_store"], 5)
+        assert_equal(stats.get("missing", 0), 0)
+        assert_equal(stats["reconstructed"], 1)
+
+        utxo = [block.vtx[-1].sha256, 0, block.vtx[-1].vout[0].nValue]
+        block = self.build_block_with_transactions(node, utxo, 5)
+        node.submitblock(ToHex(block))
+        reconstructed = peer.wait_for_reconstructed_block(block.sha256)
+        assert_equal(reconstructed.serialize(), block.serialize())
+        with mininode_lock:
+            stats = dict(peer.compact_block_stats)
+        assert_equal(stats["blocks"], 2)
+        assert_equal(stats["from_store"], 5)
+        assert_equal(stats["missing"], 5)
+        assert_equal(stats["reconstructed"], 2)
+        assert_equal(stats.get("failed", 0), 0)
+
+        self.utxos.append([block.vtx[-1].sha256, 0, block.vtx[-1].vout[0].nValue])
+        peer.peer_disconnect()
+
     def run_test(self):
         # Setup the p2p connections
         self.test_node = self.nodes[0].add_p2p_connection(TestP2PConn())
@@ -917,6 +962,9 @@ class CompactBlocksTest(BitcoinTestFramework):
         self.log.info("Testing invalid index in cmpctblock message...")
         self.test_invalid_cmpctblock_message()
 
+        self.log.info("Testing compact block reconstruction in P2PDataStore...")
+        self.test_p2p_data_store_reconstruction(self.nodes[1])
+
 
 if __name__ == '__main__':
     CompactBlocksTest().main()
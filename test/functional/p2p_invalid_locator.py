@@ -8,6 +8,7 @@
 from test_framework.messages import msg_getheaders, msg_getblocks, MAX_LOCATOR_SZ
 from test_framework.mininode import P2PInterface
 from test_framework.test_framework import BitcoinTestFramework
+from test_framework.util import assert_equal
 
 
 class InvalidLocatorTest(BitcoinTestFramework):
@@ -38,6 +39,29 @@ class InvalidLocatorTest(BitcoinTestFramework):
             else:
                 node.p2p.wait_for_block(int(node.getbestblockhash(), 16))
 
+        self.log.info('Test getheaders responses on a connection that queues its messages')
+        node.disconnect_p2ps()
+        peer = node.add_p2p_connection(P2PInterface(queue_messages=True, queue_commands=["headers"]))
+        peer.sync_with_ping()
+        msg = msg_getheaders()
+        msg.locator.vHave = [int(node.getblockhash(block_count - 10), 16)]
+        peer.send_message(msg)
+        peer.sync_with_ping()
+        # received before wait_for_message(), kept as headers is in queue_commands
+        headers = peer.wait_for_message("headers").headers
+        assert_equal(len(headers), 10)
+        assert_equal(headers[-1].rehash(), int(node.getbestblockhash(), 16))
+        msg.locator.vHave = [int(node.getblockhash(block_count - 1), 16)]
+        peer.send_message(msg)
+        headers = peer.wait_for_message("headers", lambda m: len(m.headers) == 1).headers
+        assert_equal(headers[0].rehash(), int(node.getbestblockhash(), 16))
+        peer.sync_with_ping()
+        with peer.dispatch_lock:
+            # each message is returned once, and other commands are not queued
+            assert_equal(len(peer.message_queues["headers"]), 0)
+            assert peer.message_count["sendcmpct"] > 0
+            assert_equal(set(peer.message_queues), {"headers", "pong"})
+
 
 if __name__ == '__main__':
     InvalidLocatorTest().main()
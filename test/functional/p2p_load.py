@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019 The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Test the P2P load generator against a node.
+
+Node 1 mines the chain and creates regular and alert transactions that it
+doesn't relay. The load generator then sends them to node 0, along with inv,
+getdata and getheaders messages, from 20 peers at low rates for a few seconds.
+Every message kind must get pongs back and the report must format."""
+
+from test_framework.messages import CTransaction, FromHex
+from test_framework.p2p_load import P2PLoadGenerator
+from test_framework.test_framework import BitcoinTestFramework
+from test_framework.util import (
+    assert_equal,
+    disconnect_nodes,
+    wait_until,
+)
+
+NUM_PEERS = 20
+DURATION = 3
+RATES = {"tx": 5, "atx": 3, "inv": 5, "getdata": 10, "getheaders": 10}
+
+
+class P2PLoadTest(BitcoinTestFramework):
+    def set_test_params(self):
+        self.setup_clean_chain = True
+        self.num_nodes = 2
+
+    def skip_test_if_missing_module(self):
+        self.skip_if_no_wallet()
+
+    def run_test(self):
+        node, wallet_node = self.nodes
+        alert_recovery_pubkey = "02ecec100acb89f3049285ae01e7f03fb469e6b54d44b0f3c8240b1958e893cb8c"
+
+        self.log.info("Mine mature coins to an alert and a regular address")
+        alert_addr = wallet_node.getnewvaultalertaddress(alert_recovery_pubkey)['address']
+        wallet_node.generatetoaddress(20, alert_addr)
+        wallet_node.generatetoaddress(60, wallet_node.getnewaddress())
+        wallet_node.generatetoaddress(100, wallet_node.getnewaddress())
+        self.sync_all()
+        disconnect_nodes(self.nodes[0], 1)
+        disconnect_nodes(self.nodes[1], 0)
+
+        self.log.info("Create the transactions for the load on node 1 only")
+        count = {kind: RATES[kind] * DURATION for kind in ("tx", "atx", "inv")}
+        txids = [wallet_node.sendtoaddress(node.getnewaddress(), 1) for _ in range(count["tx"] + count["inv"])]
+        atxids = [wallet_node.sendalerttoaddress(node.getnewaddress(), 1) for _ in range(count["atx"])]
+        txs = [FromHex(CTransaction(), wallet_node.getrawtransaction(txid)) for txid in txids]
+        atxs = [FromHex(CTransaction(), wallet_node.getrawtransaction(atxid)) for atxid in atxids]
+        assert_equal(node.getmempoolinfo()['size'], 0)
+
+        self.log.info("Send the load to node 0 from {} peers".format(NUM_PEERS))
+        load = P2PLoadGenerator(node, txs=txs[:count["tx"]], atxs=atxs, invs=txs[count["tx"]:])
+        load.connect(NUM_PEERS)
+        report = load.run(DURATION, RATES)
+        summary = load.summary(report)
+        for line in summary:
+            self.log.info(line)
+
+        assert_equal(report["peers"], NUM_PEERS)
+        assert_equal(sorted(report["latencies"]), sorted(RATES))
+        for kind in RATES:
+            assert report["latencies"][kind], "no pongs for {}".format(kind)
+            assert any(line.startswith(kind + " ") for line in summary)
+
+        self.log.info("Check that node 0 accepted the relayed and the announced transactions")
+        sent = txids[:len(report["latencies"]["tx"])] + txids[count["tx"]:count["tx"] + len(report["latencies"]["inv"])]
+        wait_until(lambda: set(sent) <= set(node.getrawmempool()), timeout=60)
+
+
+if __name__ == '__main__':
+    P2PLoadTest().main()
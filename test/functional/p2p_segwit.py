@@ -67,6 +67,7 @@ from test_framework.script import (
     SIGHASH_ANYONECANPAY,
     SIGHASH_NONE,
     SIGHASH_SINGLE,
+    SegwitVersion1SigHashCache,
     SegwitVersion1SignatureHash,
     SignatureHash,
     hash160,
@@ -101,9 +102,9 @@ def get_p2pkh_script(pubkeyhash):
     """Get the script associated with a P2PKH."""
     return CScript([CScriptOp(OP_DUP), CScriptOp(OP_HASH160), pubkeyhash, CScriptOp(OP_EQUALVERIFY), CScriptOp(OP_CHECKSIG)])
 
-def sign_p2pk_witness_input(script, tx_to, in_idx, hashtype, value, key):
+def sign_p2pk_witness_input(script, tx_to, in_idx, hashtype, value, key, sighash_cache=None):
     """Add signature for a P2PK witness program."""
-    tx_hash = SegwitVersion1SignatureHash(script, tx_to, in_idx, hashtype, value)
+    tx_hash = SegwitVersion1SignatureHash(script, tx_to, in_idx, hashtype, value, sighash_cache)
     signature = key.sign(tx_hash) + chr(hashtype).encode('latin-1')
     tx_to.wit.vtxinwit[in_idx].scriptWitness.stack = [signature, script]
     tx_to.rehash()
@@ -1677,13 +1678,14 @@ class SegWitTest(BitcoinTestFramework):
             split_value = total_value // num_outputs
             for i in range(num_outputs):
                 tx.vout.append(CTxOut(split_value, script_pubkey))
+            sighash_cache = SegwitVersion1SigHashCache(tx)
             for i in range(num_inputs):
                 # Now try to sign each input, using a random hashtype.
                 anyonecanpay = 0
                 if random.randint(0, 1):
                     anyonecanpay = SIGHASH_ANYONECANPAY
                 hashtype = random.randint(1, 3) | anyonecanpay
-                sign_p2pk_witness_input(witness_program, tx, i, hashtype, temp_utxos[i].nValue, key)
+                sign_p2pk_witness_input(witness_program, tx, i, hashtype, temp_utxos[i].nValue, key, sighash_cache)
                 if (hashtype == SIGHASH_SINGLE and i >= num_outputs):
                     used_sighash_single_out_of_bounds = True
             tx.rehash()
@@ -8,20 +8,23 @@
 # difficulty) or inspecting the information for verification.
 
 import binascii
+import time
 
 from test_framework import auxpow
+from test_framework.authproxy import JSONRPCException
 from test_framework.messages import (
+    solve_header,
     uint256_from_compact
 )
 
-def computeAuxpow (block, target, ok):
+def computeAuxpow (block, target, ok, processes=1):
   """
   Build an auxpow object (serialised as hex string) that solves
   (ok = True) or doesn't solve (ok = False) the block.
   """
 
   (tx, header) = auxpow.constructAuxpow (block)
-  (header, _) = mineBlock (header, target, ok)
+  (header, _) = mineBlock (header, target, ok, processes)
   return auxpow.finishAuxpow (tx, header)
 
 def mineAuxpowBlock (node):
@@ -36,19 +39,66 @@ def mineAuxpowBlock (node):
 
   return mineAuxpowBlockWithMethods (create, node.submitauxblock)
 
-def mineAuxpowBlockWithMethods (create, submit):
+def mineAuxpowBlockWithMethods (create, submit, processes=1):
   """
   Mine an auxpow block, using the given methods for creation and submission.
   """
 
   auxblock = create ()
   target = b"%064x" % uint256_from_compact(int(auxblock['bits'], 16))
-  apow = computeAuxpow (auxblock['hash'], target, True)
+  apow = computeAuxpow (auxblock['hash'], target, True, processes)
   res = submit (auxblock['hash'], apow)
   assert res
 
   return auxblock['hash']
 
+def mineAuxpowBlocks (node, n, processes=1):
+  """
+  Mine n auxpow blocks on the given RPC connection, all paying to the
+  same address.  The createauxblock for the next block can't be fetched
+  before the current one is submitted, since the node only builds on its
+  tip.  But the node runs the calls of a JSON-RPC batch in order, so each
+  submitauxblock is sent in one batch with the following createauxblock,
+  and mining a block costs a single round trip besides solving it.
+
+  Returns the block hashes and the rate in blocks per second.
+  """
+
+  start = time.time ()
+  addr = node.getnewaddress ()
+  auxblock = node.createauxblock (addr)
+  hashes = []
+  for i in range (n):
+    target = b"%064x" % uint256_from_compact(int(auxblock['bits'], 16))
+    apow = computeAuxpow (auxblock['hash'], target, True, processes)
+    calls = [node.submitauxblock.get_request (auxblock['hash'], apow)]
+    if i + 1 < n:
+      calls.append (node.createauxblock.get_request (addr))
+    results = batchResults (node.batch (calls))
+    assert results[0]
+    hashes.append (auxblock['hash'])
+    if i + 1 < n:
+      auxblock = results[1]
+
+  return (hashes, n / (time.time () - start))
+
+def batchResults (responses):
+  """
+  Return the results of a batch of RPC calls (made over RPC or the CLI),
+  raising the first error.  The node answers batches in order.
+  """
+
+  results = []
+  for r in responses:
+    error = r.get ('error')
+    if error is not None:
+      if isinstance (error, JSONRPCException):
+        raise error
+      raise JSONRPCException (error)
+    results.append (r['result'])
+
+  return results
+
 def getCoinbaseAddr (node, blockHash):
     """
     Extract the coinbase tx' payout address for the given block.
@@ -66,21 +116,16 @@ def getCoinbaseAddr (node, blockHash):
     assert len (addr) == 1
     return addr[0]
 
-def mineBlock (header, target, ok):
+def mineBlock (header, target, ok, processes=1):
   """
   Given a block header, update the nonce until it is ok (or not)
-  for the given target.
+  for the given target.  The header and target are hex strings, and
+  so are the returned header and block hash.
   """
   data = bytearray (binascii.unhexlify (header))
+  nonce = solve_header (data, int (target, 16), ok, processes=processes)
+  data[76:80] = nonce.to_bytes (4, "little")
 
-  while True:
-    assert data[79] < 255
-    data[79] += 1
-    
-    hexData = binascii.hexlify (data)
-
-    blockhash = auxpow.doubleHashHex (hexData)
-    if (ok and blockhash < target) or ((not ok) and blockhash > target):
-      break
-
+  hexData = binascii.hexlify (data)
+  blockhash = auxpow.doubleHashHex (hexData)
   return (hexData, blockhash)
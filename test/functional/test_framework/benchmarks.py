@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019 The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Micro-benchmarks for the pure-Python hot paths of the test framework.
+
+Run from test/functional:
+
+    python3 -m test_framework.benchmarks [-n REPEAT] [benchmark ...]
+
+Each benchmark prints the best and median wall time over REPEAT runs."""
+import argparse
+import gc
+import random
+import time
+
+from .messages import (
+    ByteReader,
+    CAuxPow,
+    CBlock,
+    CInv,
+    COutPoint,
+    CTransaction,
+    CTxIn,
+    CTxInWitness,
+    CTxOut,
+    MSG_TX,
+    msg_inv,
+    VERSION_AUXPOW,
+)
+from .mininode import MAGIC_BYTES, P2PConnection
+from .siphash import numpy, siphash256, siphash256_batch
+from .script import (
+    CScript,
+    OP_CHECKSIG,
+    SIGHASH_ALL,
+    SegwitVersion1SigHashCache,
+    SegwitVersion1SignatureHash,
+    SignatureHash,
+)
+
+
+def rand_bytes(rnd, n):
+    return rnd.getrandbits(8 * n).to_bytes(n, "little")
+
+
+def make_tx(rnd, witness):
+    tx = CTransaction()
+    tx.nVersion = 2
+    for _ in range(rnd.randint(1, 4)):
+        tx.vin.append(CTxIn(COutPoint(rnd.getrandbits(256), rnd.randint(0, 10)), rand_bytes(rnd, 107), 0xffffffff))
+    for _ in range(rnd.randint(1, 4)):
+        tx.vout.append(CTxOut(rnd.randint(0, 10 ** 15), rand_bytes(rnd, 23)))
+    if witness:
+        tx.wit.vtxinwit = [CTxInWitness() for _ in tx.vin]
+        for inwit in tx.wit.vtxinwit:
+            inwit.scriptWitness.stack = [rand_bytes(rnd, 72), rand_bytes(rnd, 33)]
+    return tx
+
+
+def make_block(n_tx=3000, n_atx=500, seed=1):
+    """Build an auxpow block with n_tx transactions and n_atx alert transactions, half of them with witnesses"""
+    rnd = random.Random(seed)
+    block = CBlock()
+    block.hashPrevBlock = rnd.getrandbits(256)
+    block.nTime = 1560000000
+    block.nBits = 0x207fffff
+    block.vtx = [make_tx(rnd, i % 2 == 1) for i in range(n_tx)]
+    block.vatx = [make_tx(rnd, i % 2 == 1) for i in range(n_atx)]
+    block.mark_auxpow()
+    block.auxpow = CAuxPow()
+    block.auxpow.vin = [CTxIn(COutPoint(0, 0xffffffff), rand_bytes(rnd, 40), 0xffffffff)]
+    block.auxpow.vout = [CTxOut(0, rand_bytes(rnd, 25))]
+    block.auxpow.vMerkleBranch = [rnd.getrandbits(256) for _ in range(12)]
+    return block
+
+
+def bench_deserialize_block(repeat):
+    raw = make_block().serialize(with_witness=True)
+    times = timed(lambda: CBlock().deserialize(ByteReader(raw)), repeat)
+    return "deserialize %d kB block" % (len(raw) // 1000), times
+
+
+class FramingSink(P2PConnection):
+    """A P2PConnection without a socket, fed with data_received()"""
+    def __init__(self):
+        super().__init__()
+        self.dstaddr = "127.0.0.1"
+        self.dstport = 0
+        self.magic_bytes = MAGIC_BYTES["regtest"]
+        self.recvbuf = bytearray()
+        self.recvbuf_offset = 0
+        self.received = 0
+
+    def on_message(self, message):
+        self.received += 1
+
+
+def bench_p2p_framing(repeat):
+    rnd = random.Random(1)
+    sink = FramingSink()
+    messages = [msg_inv([CInv(MSG_TX, rnd.getrandbits(256)) for _ in range(10)]) for _ in range(5000)]
+    stream = b"".join(sink.build_message(m) for m in messages)
+    # asyncio reads up to 256 kB from the socket at a time
+    chunks = [stream[i:i + 262144] for i in range(0, len(stream), 262144)]
+
+    def receive():
+        for chunk in chunks:
+            sink.data_received(chunk)
+    times = timed(receive, repeat)
+    assert sink.received == repeat * len(messages)
+    return "frame %d msgs, %.1f MB/s" % (len(messages), len(stream) / times[len(times) // 2] / 1e6), times
+
+
+def bench_serialize_block(repeat):
+    block = make_block()
+    times = timed(lambda: block.serialize(with_witness=True), repeat)
+    return "serialize %d kB block" % (block.serialized_size(with_witness=True) // 1000), times
+
+
+def bench_merkle_roots(repeat):
+    block = make_block()
+    for tx in block.vtx:
+        tx.rehash()
+    times = timed(lambda: (block.calc_merkle_root(), block.calc_witness_merkle_root()), repeat)
+    return "merkle + witness roots of %d txs" % len(block.vtx), times
+
+
+def bench_update_merkle_root(repeat):
+    block = make_block()
+    block.calc_merkle_root()
+    rnd = random.Random(2)
+    extra = [make_tx(rnd, False) for _ in range(repeat)]
+    for tx in extra:
+        tx.rehash()
+
+    def add_tx():
+        block.vtx.append(extra.pop())
+        block.calc_merkle_root()
+    return "merkle root after adding a tx to %d" % len(block.vtx), timed(add_tx, repeat)
+
+
+def bench_solve_block(repeat):
+    block = make_block(1, 0)
+    block.nVersion &= ~VERSION_AUXPOW
+    block.nBits = 0x1f00ffff
+    block.hashMerkleRoot = block.calc_merkle_root()
+
+    def solve():
+        block.nNonce = 0
+        block.solve()
+    times = timed(solve, repeat)
+    return "solve header, nonce %d" % block.nNonce, times
+
+
+def bench_signature_hash(repeat):
+    rnd = random.Random(1)
+    tx = make_tx(rnd, False)
+    tx.vin = [CTxIn(COutPoint(rnd.getrandbits(256), 0), b"", 0xffffffff) for _ in range(200)]
+    script = CScript([rand_bytes(rnd, 33), OP_CHECKSIG])
+    times = timed(lambda: [SignatureHash(script, tx, i, SIGHASH_ALL) for i in range(len(tx.vin))], repeat)
+    return "legacy sighash of all %d inputs" % len(tx.vin), times
+
+
+def bench_segwit_signature_hash(repeat):
+    rnd = random.Random(1)
+    tx = make_tx(rnd, False)
+    tx.vin = [CTxIn(COutPoint(rnd.getrandbits(256), 0), b"", 0xffffffff) for _ in range(200)]
+    script = CScript([rand_bytes(rnd, 33), OP_CHECKSIG])
+
+    def sign_all():
+        cache = SegwitVersion1SigHashCache(tx)
+        for i in range(len(tx.vin)):
+            SegwitVersion1SignatureHash(script, tx, i, SIGHASH_ALL, 1000, cache)
+    return "segwit v0 sighash of all %d inputs" % len(tx.vin), timed(sign_all, repeat)
+
+
+def bench_short_ids(repeat):
+    rnd = random.Random(1)
+    k0, k1 = rnd.getrandbits(64), rnd.getrandbits(64)
+    hashes = [rnd.getrandbits(256) for _ in range(5000)]
+    # cross-check the batched (NumPy, if installed) path against the scalar one
+    assert siphash256_batch(k0, k1, hashes) == [siphash256(k0, k1, h) for h in hashes]
+    times = timed(lambda: siphash256_batch(k0, k1, hashes), repeat)
+    return "%d short ids (%s)" % (len(hashes), "numpy" if numpy is not None else "scalar"), times
+
+
+BENCHMARKS = {
+    "deserialize_block": bench_deserialize_block,
+    "merkle_roots": bench_merkle_roots,
+    "p2p_framing": bench_p2p_framing,
+    "segwit_signature_hash": bench_segwit_signature_hash,
+    "serialize_block": bench_serialize_block,
+    "short_ids": bench_short_ids,
+    "signature_hash": bench_signature_hash,
+    "solve_block": bench_solve_block,
+    "update_merkle_root": bench_update_merkle_root,
+}
+
+
+def timed(fn, repeat):
+    times = []
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - start)
+    finally:
+        gc.enable()
+    return sorted(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", dest="repeat", type=int, default=20, help="runs per benchmark (default: %(default)s)")
+    parser.add_argument("benchmarks", nargs="*", help="benchmarks to run, out of %s (default: all)" % ", ".join(sorted(BENCHMARKS)))
+    args = parser.parse_args()
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error("unknown benchmarks: %s" % ", ".join(sorted(unknown)))
+
+    for name in args.benchmarks or sorted(BENCHMARKS):
+        what, times = BENCHMARKS[name](args.repeat)
+        print("%-22s %-40s best %8.2f ms  median %8.2f ms" % (name, what, times[0] * 1000, times[len(times) // 2] * 1000))
+
+
+if __name__ == '__main__':
+    main()
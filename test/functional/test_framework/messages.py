@@ -19,15 +19,17 @@ Classes use __slots__ to ensure extraneous attributes aren't accidentally added
 by tests, compromising their intended effect.
 """
 from codecs import encode
+from collections import defaultdict
 import copy
+import functools
 import hashlib
-from io import BytesIO
+import multiprocessing
 import random
 import socket
 import struct
 import time
 
-from test_framework.siphash import siphash256
+from test_framework.siphash import siphash256, siphash256_batch
 from test_framework.util import hex_str_to_bytes, bytes_to_hex_str, assert_equal
 
 MIN_VERSION_SUPPORTED = 60001
@@ -77,37 +79,107 @@ def ser_compact_size(l):
         r = struct.pack("<BQ", 255, l)
     return r
 
+def compact_size_len(n):
+    if n < 253:
+        return 1
+    elif n < 0x10000:
+        return 3
+    elif n < 0x100000000:
+        return 5
+    return 9
+
+_UINT8 = struct.Struct("<B")
+_INT8 = struct.Struct("<b")
+_BOOL = struct.Struct("<?")
+_UINT16 = struct.Struct("<H")
+_UINT16_BE = struct.Struct(">H")
+_INT32 = struct.Struct("<i")
+_UINT32 = struct.Struct("<I")
+_INT64 = struct.Struct("<q")
+_UINT64 = struct.Struct("<Q")
+_HEADER = struct.Struct("<i32s32sIII")
+_UINT256_MASK = (1 << 256) - 1
+
+class ByteReader:
+    """Read cursor over a bytes-like object, used by all deserialize() methods.
+
+    Fixed-size fields are decoded in place with struct.unpack_from and
+    int.from_bytes, so only variable-length data (scripts, strings) is copied
+    out of the buffer. read() and tell() behave like their BytesIO counterparts."""
+    __slots__ = ("buf", "pos")
+
+    def __init__(self, data):
+        self.buf = memoryview(data).cast("B")
+        self.pos = 0
+
+    def read(self, n=-1):
+        start = self.pos
+        self.pos = len(self.buf) if n < 0 else min(start + n, len(self.buf))
+        return self.buf[start:self.pos].tobytes()
+
+    def tell(self):
+        return self.pos
+
+    def unpack(self, fmt):
+        """Read a single value described by a one-field struct.Struct"""
+        value = fmt.unpack_from(self.buf, self.pos)[0]
+        self.pos += fmt.size
+        return value
+
+    def read_uint(self, n):
+        """Read an n-byte little-endian unsigned integer"""
+        start = self.pos
+        self.pos += n
+        if self.pos > len(self.buf):
+            raise struct.error("unpack requires a buffer of %d bytes" % n)
+        return int.from_bytes(self.buf[start:self.pos], "little")
+
+def deser_method(deserialize):
+    """Let a deserialize(f) written against ByteReader also take a file-like
+    object such as BytesIO; the file is left positioned after the object."""
+    @functools.wraps(deserialize)
+    def wrapper(self, f, *args, **kwargs):
+        if f.__class__ is ByteReader:
+            return deserialize(self, f, *args, **kwargs)
+        start = f.tell()
+        reader = ByteReader(f.read())
+        try:
+            return deserialize(self, reader, *args, **kwargs)
+        finally:
+            f.seek(start + reader.pos)
+    return wrapper
+
 def deser_compact_size(f):
-    nit = struct.unpack("<B", f.read(1))[0]
+    nit = _UINT8.unpack_from(f.buf, f.pos)[0]
+    f.pos += 1
     if nit == 253:
-        nit = struct.unpack("<H", f.read(2))[0]
+        nit = f.unpack(_UINT16)
     elif nit == 254:
-        nit = struct.unpack("<I", f.read(4))[0]
+        nit = f.unpack(_UINT32)
     elif nit == 255:
-        nit = struct.unpack("<Q", f.read(8))[0]
+        nit = f.unpack(_UINT64)
     return nit
 
 def deser_string(f):
-    nit = deser_compact_size(f)
-    return f.read(nit)
+    nit = _UINT8.unpack_from(f.buf, f.pos)[0]
+    if nit < 253:
+        f.pos += 1
+    else:
+        nit = deser_compact_size(f)
+    start = f.pos
+    s = f.buf[start:start + nit].tobytes()
+    f.pos = start + len(s)
+    return s
 
 def ser_string(s):
     return ser_compact_size(len(s)) + s
 
 def deser_uint256(f):
-    r = 0
-    for i in range(8):
-        t = struct.unpack("<I", f.read(4))[0]
-        r += t << (i * 32)
-    return r
+    return f.read_uint(32)
 
 
 def ser_uint256(u):
-    rs = b""
-    for i in range(8):
-        rs += struct.pack("<I", u & 0xFFFFFFFF)
-        u >>= 32
-    return rs
+    return (u & _UINT256_MASK).to_bytes(32, "little")
 
 
 def uint256_from_str(s):
@@ -124,12 +196,57 @@ def uint256_from_compact(c):
     return v
 
 
+# Nonces are tried in chunks of this size, each handed to a worker process
+# when solve_header uses several
+NONCE_CHUNK_SIZE = 1 << 16
+
+def grind_nonces(args):
+    """Return the first nonce in [start, end) that makes the 80-byte header hash
+    to at most target (ok) or to more than target (not ok), or None."""
+    header, target, ok, start, end = args
+    # Only the last 16 bytes of the header depend on the nonce, so hash the
+    # first 64 bytes once and copy that SHA256 state for each try
+    midstate = hashlib.sha256(header[:64])
+    tail = bytearray(header[64:80])
+    target = min(target, _UINT256_MASK).to_bytes(32, "big")
+    for nonce in range(start, end):
+        _UINT32.pack_into(tail, 12, nonce)
+        h = midstate.copy()
+        h.update(tail)
+        # compare the hash as a big-endian number
+        if (hashlib.sha256(h.digest()).digest()[::-1] <= target) == ok:
+            return nonce
+    return None
+
+def solve_header(header, target, ok=True, nonce=0, processes=1):
+    """Return the first nonce, from nonce on, that solves (ok) or doesn't solve
+    (not ok) the 80-byte serialized header for target.
+
+    With processes > 1 the nonce space is split between a pool of processes,
+    which only pays off for targets much harder than regtest's."""
+    header = bytes(header[:80])
+    chunks = ((header, target, ok, start, min(start + NONCE_CHUNK_SIZE, 1 << 32))
+              for start in range(nonce, 1 << 32, NONCE_CHUNK_SIZE))
+    if processes > 1:
+        with multiprocessing.Pool(processes) as pool:
+            for result in pool.imap(grind_nonces, chunks):
+                if result is not None:
+                    return result
+    else:
+        for result in map(grind_nonces, chunks):
+            if result is not None:
+                return result
+    raise ValueError("no nonce from %d on solves the header" % nonce)
+
+
 def deser_vector(f, c):
     nit = deser_compact_size(f)
+    # f is a ByteReader already, skip the deser_method wrapper
+    deserialize = c.deserialize.__wrapped__
     r = []
     for i in range(nit):
         t = c()
-        t.deserialize(f)
+        deserialize(t, f)
         r.append(t)
     return r
 
@@ -138,29 +255,40 @@ def deser_vector(f, c):
 # entries in the vector (we use this for serializing the vector of transactions
 # for a witness block).
 def ser_vector(l, ser_function_name=None):
-    r = ser_compact_size(len(l))
+    r = bytearray(ser_compact_size(len(l)))
     for i in l:
         if ser_function_name:
             r += getattr(i, ser_function_name)()
         else:
             r += i.serialize()
-    return r
+    return bytes(r)
+
+
+# Append a vector of transactions to the bytearray w. Subclasses of
+# CTransaction may override the bytes serializers (see p2p_segwit.py), so only
+# plain transactions are written in place.
+def ser_tx_vector_into(w, txs, with_witness):
+    w += ser_compact_size(len(txs))
+    for tx in txs:
+        if tx.__class__ is CTransaction:
+            tx.serialize_into(w, with_witness)
+        elif with_witness:
+            w += tx.serialize_with_witness()
+        else:
+            w += tx.serialize_without_witness()
+
+
+def tx_vector_size(txs, with_witness):
+    return compact_size_len(len(txs)) + sum(tx.serialized_size(with_witness) for tx in txs)
 
 
 def deser_uint256_vector(f):
     nit = deser_compact_size(f)
-    r = []
-    for i in range(nit):
-        t = deser_uint256(f)
-        r.append(t)
-    return r
+    return [f.read_uint(32) for i in range(nit)]
 
 
 def ser_uint256_vector(l):
-    r = ser_compact_size(len(l))
-    for i in l:
-        r += ser_uint256(i)
-    return r
+    return ser_compact_size(len(l)) + b"".join(ser_uint256(i) for i in l)
 
 
 def deser_string_vector(f):
@@ -173,15 +301,20 @@ def deser_string_vector(f):
 
 
 def ser_string_vector(l):
-    r = ser_compact_size(len(l))
+    r = bytearray(ser_compact_size(len(l)))
     for sv in l:
-        r += ser_string(sv)
-    return r
+        r += ser_compact_size(len(sv))
+        r += sv
+    return bytes(r)
+
+
+def string_vector_size(v):
+    return compact_size_len(len(v)) + sum(compact_size_len(len(sv)) + len(sv) for sv in v)
 
 
 # Deserialize from a hex string representation (eg from RPC)
 def FromHex(obj, hex_string):
-    obj.deserialize(BytesIO(hex_str_to_bytes(hex_string)))
+    obj.deserialize(ByteReader(hex_str_to_bytes(hex_string)))
     return obj
 
 # Convert a binary-serializable object to hex (eg for submission via RPC)
@@ -201,13 +334,14 @@ class CAddress:
         self.ip = "0.0.0.0"
         self.port = 0
 
+    @deser_method
     def deserialize(self, f, with_time=True):
         if with_time:
-            self.time = struct.unpack("<i", f.read(4))[0]
-        self.nServices = struct.unpack("<Q", f.read(8))[0]
+            self.time = f.unpack(_INT32)
+        self.nServices = f.unpack(_UINT64)
         self.pchReserved = f.read(12)
         self.ip = socket.inet_ntoa(f.read(4))
-        self.port = struct.unpack(">H", f.read(2))[0]
+        self.port = f.unpack(_UINT16_BE)
 
     def serialize(self, with_time=True):
         r = b""
@@ -240,8 +374,9 @@ class CInv:
         self.type = t
         self.hash = h
 
+    @deser_method
     def deserialize(self, f):
-        self.type = struct.unpack("<i", f.read(4))[0]
+        self.type = f.unpack(_INT32)
         self.hash = deser_uint256(f)
 
     def serialize(self):
@@ -262,8 +397,9 @@ class CBlockLocator:
         self.nVersion = MY_VERSION
         self.vHave = []
 
+    @deser_method
     def deserialize(self, f):
-        self.nVersion = struct.unpack("<i", f.read(4))[0]
+        self.nVersion = f.unpack(_INT32)
         self.vHave = deser_uint256_vector(f)
 
     def serialize(self):
@@ -284,15 +420,20 @@ class COutPoint:
         self.hash = hash
         self.n = n
 
+    @deser_method
     def deserialize(self, f):
         self.hash = deser_uint256(f)
-        self.n = struct.unpack("<I", f.read(4))[0]
+        self.n = f.unpack(_UINT32)
 
     def serialize(self):
-        r = b""
-        r += ser_uint256(self.hash)
-        r += struct.pack("<I", self.n)
-        return r
+        return ser_uint256(self.hash) + _UINT32.pack(self.n)
+
+    def serialize_into(self, w):
+        w += ser_uint256(self.hash)
+        w += _UINT32.pack(self.n)
+
+    def serialized_size(self):
+        return 36
 
     def __repr__(self):
         return "COutPoint(hash=%064x n=%i)" % (self.hash, self.n)
@@ -309,18 +450,29 @@ class CTxIn:
         self.scriptSig = scriptSig
         self.nSequence = nSequence
 
+    @deser_method
     def deserialize(self, f):
-        self.prevout = COutPoint()
-        self.prevout.deserialize(f)
+        # unpacking n first also checks that the whole outpoint is in the buffer
+        buf, pos = f.buf, f.pos
+        n = _UINT32.unpack_from(buf, pos + 32)[0]
+        self.prevout = COutPoint(int.from_bytes(buf[pos:pos + 32], "little"), n)
+        f.pos = pos + 36
         self.scriptSig = deser_string(f)
-        self.nSequence = struct.unpack("<I", f.read(4))[0]
+        self.nSequence = f.unpack(_UINT32)
 
     def serialize(self):
-        r = b""
-        r += self.prevout.serialize()
-        r += ser_string(self.scriptSig)
-        r += struct.pack("<I", self.nSequence)
-        return r
+        w = bytearray()
+        self.serialize_into(w)
+        return bytes(w)
+
+    def serialize_into(self, w):
+        self.prevout.serialize_into(w)
+        w += ser_compact_size(len(self.scriptSig))
+        w += self.scriptSig
+        w += _UINT32.pack(self.nSequence)
+
+    def serialized_size(self):
+        return 40 + compact_size_len(len(self.scriptSig)) + len(self.scriptSig)
 
     def __repr__(self):
         return "CTxIn(prevout=%s scriptSig=%s nSequence=%i)" \
@@ -335,15 +487,23 @@ class CTxOut:
         self.nValue = nValue
         self.scriptPubKey = scriptPubKey
 
+    @deser_method
     def deserialize(self, f):
-        self.nValue = struct.unpack("<q", f.read(8))[0]
+        self.nValue = f.unpack(_INT64)
         self.scriptPubKey = deser_string(f)
 
     def serialize(self):
-        r = b""
-        r += struct.pack("<q", self.nValue)
-        r += ser_string(self.scriptPubKey)
-        return r
+        w = bytearray()
+        self.serialize_into(w)
+        return bytes(w)
+
+    def serialize_into(self, w):
+        w += _INT64.pack(self.nValue)
+        w += ser_compact_size(len(self.scriptPubKey))
+        w += self.scriptPubKey
+
+    def serialized_size(self):
+        return 8 + compact_size_len(len(self.scriptPubKey)) + len(self.scriptPubKey)
 
     def __repr__(self):
         return "CTxOut(nValue=%i.%08i scriptPubKey=%s)" \
@@ -374,12 +534,23 @@ class CTxInWitness:
     def __init__(self):
         self.scriptWitness = CScriptWitness()
 
+    @deser_method
     def deserialize(self, f):
         self.scriptWitness.stack = deser_string_vector(f)
 
     def serialize(self):
         return ser_string_vector(self.scriptWitness.stack)
 
+    def serialize_into(self, w):
+        stack = self.scriptWitness.stack
+        w += ser_compact_size(len(stack))
+        for sv in stack:
+            w += ser_compact_size(len(sv))
+            w += sv
+
+    def serialized_size(self):
+        return string_vector_size(self.scriptWitness.stack)
+
     def __repr__(self):
         return repr(self.scriptWitness)
 
@@ -393,18 +564,25 @@ class CTxWitness:
     def __init__(self):
         self.vtxinwit = []
 
+    @deser_method
     def deserialize(self, f):
-        for i in range(len(self.vtxinwit)):
-            self.vtxinwit[i].deserialize(f)
+        for x in self.vtxinwit:
+            x.scriptWitness.stack = deser_string_vector(f)
 
     def serialize(self):
-        r = b""
+        w = bytearray()
+        self.serialize_into(w)
+        return bytes(w)
+
+    def serialize_into(self, w):
         # This is different than the usual vector serialization --
         # we omit the length of the vector, which is required to be
         # the same length as the transaction's vin vector.
         for x in self.vtxinwit:
-            r += x.serialize()
-        return r
+            x.serialize_into(w)
+
+    def serialized_size(self):
+        return sum(x.serialized_size() for x in self.vtxinwit)
 
     def __repr__(self):
         return "CTxWitness(%s)" % \
@@ -419,7 +597,7 @@ class CTxWitness:
 
 class CTransaction:
     __slots__ = ("hash", "nLockTime", "nVersion", "sha256", "vin", "vout",
-                 "wit")
+                 "wit", "_stripped")
 
     def __init__(self, tx=None):
         if tx is None:
@@ -430,6 +608,7 @@ class CTransaction:
             self.nLockTime = 0
             self.sha256 = None
             self.hash = None
+            self._stripped = None
         else:
             self.nVersion = tx.nVersion
             self.vin = copy.deepcopy(tx.vin)
@@ -437,14 +616,16 @@ class CTransaction:
             self.nLockTime = tx.nLockTime
             self.sha256 = tx.sha256
             self.hash = tx.hash
+            self._stripped = tx._stripped
             self.wit = copy.deepcopy(tx.wit)
 
+    @deser_method
     def deserialize(self, f):
-        self.nVersion = struct.unpack("<i", f.read(4))[0]
+        self.nVersion = f.unpack(_INT32)
         self.vin = deser_vector(f, CTxIn)
         flags = 0
         if len(self.vin) == 0:
-            flags = struct.unpack("<B", f.read(1))[0]
+            flags = f.unpack(_UINT8)
             # Not sure why flags can't be zero, but this
             # matches the implementation in bvaultd
             if (flags != 0):
@@ -457,47 +638,87 @@ class CTransaction:
             self.wit.deserialize(f)
         else:
             self.wit = CTxWitness()
-        self.nLockTime = struct.unpack("<I", f.read(4))[0]
+        self.nLockTime = f.unpack(_UINT32)
         self.sha256 = None
         self.hash = None
-
+        self._stripped = None
+
+    # Cheap copy that shares the inputs, outputs and input witnesses with this
+    # transaction, where CTransaction(tx) deep-copies them. Adding, removing
+    # or replacing entries only affects the copy; replace an entry (e.g. with
+    # copy.copy(tx.vin[i])) before changing it in place.
+    def clone(self):
+        tx = CTransaction()
+        tx.nVersion = self.nVersion
+        tx.vin = list(self.vin)
+        tx.vout = list(self.vout)
+        tx.wit.vtxinwit = list(self.wit.vtxinwit)
+        tx.nLockTime = self.nLockTime
+        tx.sha256 = self.sha256
+        tx.hash = self.hash
+        tx._stripped = self._stripped
+        return tx
+
+    # The transaction only, CAuxPow.serialize_into appends its own fields
     def serialize_without_witness(self):
-        r = b""
-        r += struct.pack("<i", self.nVersion)
-        r += ser_vector(self.vin)
-        r += ser_vector(self.vout)
-        r += struct.pack("<I", self.nLockTime)
-        return r
+        w = bytearray()
+        CTransaction.serialize_into(self, w, with_witness=False)
+        return bytes(w)
 
     # Only serialize with witness when explicitly called for
     def serialize_with_witness(self):
+        w = bytearray()
+        CTransaction.serialize_into(self, w, with_witness=True)
+        return bytes(w)
+
+    # Append the serialization to the bytearray w, so that a whole block is
+    # written into a single buffer.
+    def serialize_into(self, w, with_witness=True):
         flags = 0
-        if not self.wit.is_null():
+        if with_witness and not self.wit.is_null():
             flags |= 1
-        r = b""
-        r += struct.pack("<i", self.nVersion)
+        w += _INT32.pack(self.nVersion)
         if flags:
-            dummy = []
-            r += ser_vector(dummy)
-            r += struct.pack("<B", flags)
-        r += ser_vector(self.vin)
-        r += ser_vector(self.vout)
+            # empty vin vector as the marker
+            w += b"\x00"
+            w += _UINT8.pack(flags)
+        w += ser_compact_size(len(self.vin))
+        for txin in self.vin:
+            txin.serialize_into(w)
+        w += ser_compact_size(len(self.vout))
+        for txout in self.vout:
+            txout.serialize_into(w)
         if flags & 1:
-            if (len(self.wit.vtxinwit) != len(self.vin)):
-                # vtxinwit must have the same length as vin
-                self.wit.vtxinwit = self.wit.vtxinwit[:len(self.vin)]
-                for i in range(len(self.wit.vtxinwit), len(self.vin)):
-                    self.wit.vtxinwit.append(CTxInWitness())
-            r += self.wit.serialize()
-        r += struct.pack("<I", self.nLockTime)
-        return r
+            self.pad_witness()
+            self.wit.serialize_into(w)
+        w += _UINT32.pack(self.nLockTime)
+
+    def pad_witness(self):
+        if (len(self.wit.vtxinwit) != len(self.vin)):
+            # vtxinwit must have the same length as vin
+            self.wit.vtxinwit = self.wit.vtxinwit[:len(self.vin)]
+            for i in range(len(self.wit.vtxinwit), len(self.vin)):
+                self.wit.vtxinwit.append(CTxInWitness())
+
+    # Size of the serialization, without building it. Unlike
+    # serialize_with_witness this leaves vtxinwit untouched, and counts it as
+    # if it were padded or truncated to the length of vin.
+    def serialized_size(self, with_witness=True):
+        size = 8 + compact_size_len(len(self.vin)) + compact_size_len(len(self.vout))
+        size += sum(txin.serialized_size() for txin in self.vin)
+        size += sum(txout.serialized_size() for txout in self.vout)
+        if with_witness and not self.wit.is_null():
+            vtxinwit = self.wit.vtxinwit[:len(self.vin)]
+            size += 2 + sum(x.serialized_size() for x in vtxinwit) + len(self.vin) - len(vtxinwit)
+        return size
 
     # Regular serialization is with witness -- must explicitly
     # call serialize_without_witness to exclude witness data.
     def serialize(self):
         return self.serialize_with_witness()
 
-    # Recalculate the txid (transaction hash without witness)
+    # Recalculate the txid (transaction hash without witness). Must be called
+    # after changing nVersion, vin, vout or nLockTime.
     def rehash(self):
         self.sha256 = None
         self.calc_sha256()
@@ -505,14 +726,34 @@ class CTransaction:
 
     # We will only cache the serialization without witness in
     # self.sha256 and self.hash -- those are expected to be the txid.
+    # The wtxid is not cached, as tests edit witnesses in place, but it
+    # reuses the cached serialization and only serializes the witness.
+    # Subclasses that override serialize_with_witness (see p2p_segwit.py) are
+    # hashed from their own serialization.
     def calc_sha256(self, with_witness=False):
-        if with_witness:
-            # Don't cache the result, just return it
-            return uint256_from_str(hash256(self.serialize_with_witness()))
-
         if self.sha256 is None:
-            self.sha256 = uint256_from_str(hash256(self.serialize_without_witness()))
-        self.hash = encode(hash256(self.serialize_without_witness())[::-1], 'hex_codec').decode('ascii')
+            self._stripped = self.serialize_without_witness()
+            h = hash256(self._stripped)
+            self.sha256 = uint256_from_str(h)
+            self.hash = encode(h[::-1], 'hex_codec').decode('ascii')
+
+        if with_witness:
+            stripped = self._stripped
+            if stripped is None or type(self).serialize_with_witness is not CTransaction.serialize_with_witness:
+                return uint256_from_str(hash256(self.serialize_with_witness()))
+            if self.wit.is_null():
+                return self.sha256
+            w = bytearray(stripped[:4])
+            w += b"\x00\x01"
+            w += stripped[4:-4]
+            # Pad or truncate the witness to the length of vin as
+            # serialize_with_witness does, without changing self.wit
+            vtxinwit = self.wit.vtxinwit[:len(self.vin)]
+            for x in vtxinwit:
+                x.serialize_into(w)
+            w += b"\x00" * (len(self.vin) - len(vtxinwit))
+            w += stripped[-4:]
+            return uint256_from_str(hash256(w))
 
     def is_valid(self):
         self.calc_sha256()
@@ -537,25 +778,36 @@ class CAuxPow(CTransaction):
         self.nChainIndex = 0
         self.parentBlock = CBlockHeader()
 
+    @deser_method
     def deserialize(self, f):
         super(CAuxPow, self).deserialize(f)
         self.hashBlock = deser_uint256(f)
         self.vMerkleBranch = deser_uint256_vector(f)
-        self.nIndex = struct.unpack("<I", f.read(4))[0]
+        self.nIndex = f.unpack(_UINT32)
         self.vChainMerkleBranch = deser_uint256_vector(f)
-        self.nChainIndex = struct.unpack("<I", f.read(4))[0]
+        self.nChainIndex = f.unpack(_UINT32)
         self.parentBlock.deserialize(f)
 
     def serialize(self):
-        r = b""
-        r += super(CAuxPow, self).serialize()
-        r += ser_uint256(self.hashBlock)
-        r += ser_uint256_vector(self.vMerkleBranch)
-        r += struct.pack("<I", self.nIndex)
-        r += ser_uint256_vector(self.vChainMerkleBranch)
-        r += struct.pack("<I", self.nChainIndex)
-        r += self.parentBlock.serialize()
-        return r
+        w = bytearray()
+        self.serialize_into(w)
+        return bytes(w)
+
+    def serialize_into(self, w, with_witness=True):
+        # The merge-mined coinbase is always written with its witness
+        super(CAuxPow, self).serialize_into(w)
+        w += ser_uint256(self.hashBlock)
+        w += ser_uint256_vector(self.vMerkleBranch)
+        w += _UINT32.pack(self.nIndex)
+        w += ser_uint256_vector(self.vChainMerkleBranch)
+        w += _UINT32.pack(self.nChainIndex)
+        self.parentBlock.serialize_into(w)
+
+    def serialized_size(self, with_witness=True):
+        return (super(CAuxPow, self).serialized_size() + 32
+                + compact_size_len(len(self.vMerkleBranch)) + 32 * len(self.vMerkleBranch) + 4
+                + compact_size_len(len(self.vChainMerkleBranch)) + 32 * len(self.vChainMerkleBranch) + 4
+                + self.parentBlock.serialized_size())
 
 class CBlockHeader:
     __slots__ = ("hash", "hashMerkleRoot", "hashPrevBlock", "nBits", "nNonce",
@@ -601,30 +853,36 @@ class CBlockHeader:
     def is_auxpow(self):
         return (self.nVersion & VERSION_AUXPOW) > 0
 
+    @deser_method
     def deserialize(self, f):
-        self.nVersion = struct.unpack("<i", f.read(4))[0]
+        self.nVersion = f.unpack(_INT32)
         self.hashPrevBlock = deser_uint256(f)
         self.hashMerkleRoot = deser_uint256(f)
-        self.nTime = struct.unpack("<I", f.read(4))[0]
-        self.nBits = struct.unpack("<I", f.read(4))[0]
-        self.nNonce = struct.unpack("<I", f.read(4))[0]
+        self.nTime = f.unpack(_UINT32)
+        self.nBits = f.unpack(_UINT32)
+        self.nNonce = f.unpack(_UINT32)
         if self.is_auxpow():
             self.auxpow = CAuxPow()
             self.auxpow.deserialize(f)
         self.sha256 = None
         self.hash = None
 
+    # The header only, CBlock.serialize_into appends the transactions
     def serialize(self):
-        r = b""
-        r += struct.pack("<i", self.nVersion)
-        r += ser_uint256(self.hashPrevBlock)
-        r += ser_uint256(self.hashMerkleRoot)
-        r += struct.pack("<I", self.nTime)
-        r += struct.pack("<I", self.nBits)
-        r += struct.pack("<I", self.nNonce)
+        w = bytearray()
+        CBlockHeader.serialize_into(self, w)
+        return bytes(w)
+
+    def serialize_into(self, w):
+        w += _HEADER.pack(self.nVersion, ser_uint256(self.hashPrevBlock), ser_uint256(self.hashMerkleRoot),
+                          self.nTime, self.nBits, self.nNonce)
         if self.is_auxpow():
-            r += self.auxpow.serialize()
-        return r
+            self.auxpow.serialize_into(w)
+
+    def serialized_size(self):
+        if self.is_auxpow():
+            return 80 + self.auxpow.serialized_size()
+        return 80
 
     def calc_sha256(self):
         if self.sha256 is None:
@@ -651,29 +909,153 @@ class CBlockHeader:
 BLOCK_HEADER_SIZE = len(CBlockHeader().serialize())
 assert_equal(BLOCK_HEADER_SIZE, 80)
 
+# A merkle tree that keeps all its levels, so that appending or replacing a
+# leaf only rehashes the path up to the root. Leaves, the root and branch
+# entries are uint256 ints, like txids and CAuxPow.vMerkleBranch.
+class MerkleTree:
+    __slots__ = ("levels",)
+
+    def __init__(self, hashes = ()):
+        self.levels = [[ser_uint256(h) for h in hashes]]
+        self.rebuild()
+
+    def __len__(self):
+        return len(self.levels[0])
+
+    def rebuild(self):
+        del self.levels[1:]
+        level = self.levels[0]
+        while len(level) > 1:
+            level = [hash256(level[i] + level[min(i + 1, len(level) - 1)]) for i in range(0, len(level), 2)]
+            self.levels.append(level)
+
+    # Rehash the ancestors of leaf index, after it was appended or replaced
+    def update_path(self, index):
+        height = 0
+        while len(self.levels[height]) > 1:
+            level = self.levels[height]
+            left = index & ~1
+            node = hash256(level[left] + level[min(left + 1, len(level) - 1)])
+            index >>= 1
+            if height + 1 == len(self.levels):
+                self.levels.append([])
+            parent = self.levels[height + 1]
+            if index == len(parent):
+                parent.append(node)
+            else:
+                parent[index] = node
+            height += 1
+
+    def append(self, h):
+        self.levels[0].append(ser_uint256(h))
+        self.update_path(len(self.levels[0]) - 1)
+
+    def replace(self, index, h):
+        self.levels[0][index] = ser_uint256(h)
+        self.update_path(index)
+
+    # Make the leaves equal to hashes, rehashing only what changed
+    def update(self, hashes):
+        leaves = [ser_uint256(h) for h in hashes]
+        old = self.levels[0]
+        if len(leaves) < len(old):
+            self.levels[0] = leaves
+            self.rebuild()
+            return
+        changed = [i for i in range(len(old)) if old[i] != leaves[i]]
+        if (len(changed) + len(leaves) - len(old)) * len(self.levels) > len(leaves):
+            self.levels[0] = leaves
+            self.rebuild()
+            return
+        for i in changed:
+            old[i] = leaves[i]
+            self.update_path(i)
+        for i in range(len(old), len(leaves)):
+            old.append(leaves[i])
+            self.update_path(i)
+
+    def root(self):
+        if not self.levels[0]:
+            return 0
+        return uint256_from_str(self.levels[-1][0])
+
+    # The hashes needed to get from leaf index to the root, as in
+    # CAuxPow.vMerkleBranch and vChainMerkleBranch
+    def branch(self, index):
+        branch = []
+        for level in self.levels[:-1]:
+            branch.append(uint256_from_str(level[min(index ^ 1, len(level) - 1)]))
+            index >>= 1
+        return branch
+
+    # The root a branch leads to, like CAuxPow::CheckMerkleBranch
+    @staticmethod
+    def root_from_branch(h, branch, index):
+        node = ser_uint256(h)
+        for other in branch:
+            if index & 1:
+                node = hash256(ser_uint256(other) + node)
+            else:
+                node = hash256(node + ser_uint256(other))
+            index >>= 1
+        return uint256_from_str(node)
+
+    # A CPartialMerkleTree proving the leaves for which matches is True, built
+    # the way CPartialMerkleTree's constructor in src/merkleblock.cpp does
+    def partial_merkle_tree(self, matches):
+        assert len(matches) == len(self)
+        tree = CPartialMerkleTree()
+        tree.nTransactions = len(self)
+
+        def traverse_and_build(height, pos):
+            parent_of_match = any(matches[pos << height:(pos + 1) << height])
+            tree.vBits.append(parent_of_match)
+            if height == 0 or not parent_of_match:
+                tree.vHash.append(uint256_from_str(self.levels[height][pos]))
+            else:
+                traverse_and_build(height - 1, pos * 2)
+                if pos * 2 + 1 < len(self.levels[height - 1]):
+                    traverse_and_build(height - 1, pos * 2 + 1)
+
+        if matches:
+            traverse_and_build(len(self.levels) - 1, 0)
+        return tree
+
+    def __repr__(self):
+        return "MerkleTree(leaves=%d, root=%064x)" % (len(self), self.root())
+
+
 class CBlock(CBlockHeader):
-    __slots__ = ("vtx", "vatx",)
+    # The merkle trees are only a cache, kept in sync with vtx by
+    # calc_merkle_root and calc_witness_merkle_root
+    __slots__ = ("vtx", "vatx", "_merkle_tree", "_witness_merkle_tree")
 
     def __init__(self, header=None):
         super(CBlock, self).__init__(header)
         self.vtx = []
         self.vatx = []
+        self._merkle_tree = None
+        self._witness_merkle_tree = None
 
+    @deser_method
     def deserialize(self, f):
         super(CBlock, self).deserialize(f)
         self.vtx = deser_vector(f, CTransaction)
         self.vatx = deser_vector(f, CTransaction)
 
     def serialize(self, with_witness=False):
-        r = b""
-        r += super(CBlock, self).serialize()
-        if with_witness:
-            r += ser_vector(self.vtx, "serialize_with_witness")
-            r += ser_vector(self.vatx, "serialize_with_witness")
-        else:
-            r += ser_vector(self.vtx, "serialize_without_witness")
-            r += ser_vector(self.vatx, "serialize_without_witness")
-        return r
+        w = bytearray()
+        self.serialize_into(w, with_witness)
+        return bytes(w)
+
+    def serialize_into(self, w, with_witness=False):
+        super(CBlock, self).serialize_into(w)
+        ser_tx_vector_into(w, self.vtx, with_witness)
+        ser_tx_vector_into(w, self.vatx, with_witness)
+
+    def serialized_size(self, with_witness=False):
+        return (super(CBlock, self).serialized_size() + tx_vector_size(self.vtx, with_witness)
+                + tx_vector_size(self.vatx, with_witness))
 
     # Calculate the merkle root given a vector of transaction hashes
     @classmethod
@@ -687,22 +1069,77 @@ class CBlock(CBlockHeader):
         return uint256_from_str(hashes[0])
 
     def calc_merkle_root(self):
+        return self.get_merkle_tree().root()
+
+    def calc_witness_merkle_root(self):
+        return self.get_witness_merkle_tree().root()
+
+    def get_merkle_tree(self):
         hashes = []
         for tx in self.vtx:
             tx.calc_sha256()
-            hashes.append(ser_uint256(tx.sha256))
-        return self.get_merkle_root(hashes)
+            hashes.append(tx.sha256)
+        if self._merkle_tree is None:
+            self._merkle_tree = MerkleTree(hashes)
+        else:
+            self._merkle_tree.update(hashes)
+        return self._merkle_tree
 
-    def calc_witness_merkle_root(self):
+    def get_witness_merkle_tree(self):
         # For witness root purposes, the hash of the
         # coinbase, with witness, is defined to be 0...0
-        hashes = [ser_uint256(0)]
+        hashes = [0]
 
         for tx in self.vtx[1:]:
             # Calculate the hashes with witness data
-            hashes.append(ser_uint256(tx.calc_sha256(True)))
+            hashes.append(tx.calc_sha256(True))
 
-        return self.get_merkle_root(hashes)
+        if self._witness_merkle_tree is None:
+            self._witness_merkle_tree = MerkleTree(hashes)
+        else:
+            self._witness_merkle_tree.update(hashes)
+        return self._witness_merkle_tree
+
+    def calc_alert_merkle_root(self):
+        hashes = []
+        for tx in self.vatx:
+            tx.calc_sha256()
+            hashes.append(tx.sha256)
+        return MerkleTree(hashes).root()
+
+    # The coinbase commits to the merkle root of vatx in the second push of
+    # its scriptSig, after the height (GetCoinbaseAlertMerkleRoot in
+    # validation.cpp). Returns 0 if there is no such commitment.
+    def get_coinbase_alert_merkle_root(self):
+        if not self.vtx or not self.vtx[0].vin:
+            return 0
+        script = self.vtx[0].vin[0].scriptSig
+        data = None
+        i = 0
+        for _ in range(2):
+            if i >= len(script):
+                return 0
+            opcode = script[i]
+            i += 1
+            if opcode > 0x4e:
+                data = None
+                continue
+            if opcode == 0x4c:
+                size = script[i]
+                i += 1
+            elif opcode == 0x4d:
+                size = _UINT16.unpack_from(script, i)[0]
+                i += 2
+            elif opcode == 0x4e:
+                size = _UINT32.unpack_from(script, i)[0]
+                i += 4
+            else:
+                size = opcode
+            data = script[i:i + size]
+            i += size
+        if data is None or len(data) != 32:
+            return 0
+        return uint256_from_str(data)
 
     def is_valid(self):
         self.calc_sha256()
@@ -721,12 +1158,12 @@ class CBlock(CBlockHeader):
             return False
         return True
 
-    def solve(self):
-        self.rehash()
+    def solve(self, processes=1):
+        header = _HEADER.pack(self.nVersion, ser_uint256(self.hashPrevBlock), ser_uint256(self.hashMerkleRoot),
+                              self.nTime, self.nBits, self.nNonce)
         target = uint256_from_compact(self.nBits)
-        while self.sha256 > target:
-            self.nNonce += 1
-            self.rehash()
+        self.nNonce = solve_header(header, target, nonce=self.nNonce, processes=processes)
+        self.rehash()
 
     def __repr__(self):
         return "CBlock(nVersion=%i hashPrevBlock=%064x hashMerkleRoot=%064x nTime=%s nBits=%08x nNonce=%08x vtx=%s)" \
@@ -741,6 +1178,7 @@ class PrefilledTransaction:
         self.index = index
         self.tx = tx
 
+    @deser_method
     def deserialize(self, f):
         self.index = deser_compact_size(f)
         self.tx = CTransaction()
@@ -755,6 +1193,9 @@ class PrefilledTransaction:
             r += self.tx.serialize_without_witness()
         return r
 
+    def serialized_size(self, with_witness=True):
+        return compact_size_len(self.index) + self.tx.serialized_size(with_witness)
+
     def serialize_without_witness(self):
         return self.serialize(with_witness=False)
 
@@ -766,9 +1207,12 @@ class PrefilledTransaction:
 
 
 # This is what we send on the wire, in a cmpctblock message.
+# The alert transactions (vatx) of the block follow the regular ones, with
+# their own shortids and prefilled transactions.
 class P2PHeaderAndShortIDs:
-    __slots__ = ("header", "nonce", "prefilled_txn", "prefilled_txn_length",
-                 "shortids", "shortids_length")
+    __slots__ = ("header", "nonce", "prefilled_atxn", "prefilled_atxn_length",
+                 "prefilled_txn", "prefilled_txn_length", "shortatxids",
+                 "shortatxids_length", "shortids", "shortids_length")
 
     def __init__(self):
         self.header = CBlockHeader()
@@ -777,35 +1221,44 @@ class P2PHeaderAndShortIDs:
         self.shortids = []
         self.prefilled_txn_length = 0
         self.prefilled_txn = []
+        self.shortatxids_length = 0
+        self.shortatxids = []
+        self.prefilled_atxn_length = 0
+        self.prefilled_atxn = []
 
+    @deser_method
     def deserialize(self, f):
         self.header.deserialize(f)
-        self.nonce = struct.unpack("<Q", f.read(8))[0]
+        self.nonce = f.unpack(_UINT64)
         self.shortids_length = deser_compact_size(f)
         for i in range(self.shortids_length):
-            # shortids are defined to be 6 bytes in the spec, so append
-            # two zero bytes and read it in as an 8-byte number
-            self.shortids.append(struct.unpack("<Q", f.read(6) + b'\x00\x00')[0])
+            # shortids are defined to be 6 bytes in the spec
+            self.shortids.append(f.read_uint(6))
         self.prefilled_txn = deser_vector(f, PrefilledTransaction)
         self.prefilled_txn_length = len(self.prefilled_txn)
+        self.shortatxids_length = deser_compact_size(f)
+        for i in range(self.shortatxids_length):
+            self.shortatxids.append(f.read_uint(6))
+        self.prefilled_atxn = deser_vector(f, PrefilledTransaction)
+        self.prefilled_atxn_length = len(self.prefilled_atxn)
 
     # When using version 2 compact blocks, we must serialize with_witness.
     def serialize(self, with_witness=False):
-        r = b""
-        r += self.header.serialize()
-        r += struct.pack("<Q", self.nonce)
-        r += ser_compact_size(self.shortids_length)
-        for x in self.shortids:
-            # We only want the first 6 bytes
-            r += struct.pack("<Q", x)[0:6]
-        if with_witness:
-            r += ser_vector(self.prefilled_txn, "serialize_with_witness")
-        else:
-            r += ser_vector(self.prefilled_txn, "serialize_without_witness")
-        return r
+        ser_function_name = "serialize_with_witness" if with_witness else "serialize_without_witness"
+        w = bytearray()
+        self.header.serialize_into(w)
+        w += _UINT64.pack(self.nonce)
+        w += ser_compact_size(self.shortids_length)
+        # shortids are defined to be 6 bytes in the spec
+        w += b"".join(x.to_bytes(6, "little") for x in self.shortids)
+        w += ser_vector(self.prefilled_txn, ser_function_name)
+        w += ser_compact_size(self.shortatxids_length)
+        w += b"".join(x.to_bytes(6, "little") for x in self.shortatxids)
+        w += ser_vector(self.prefilled_atxn, ser_function_name)
+        return bytes(w)
 
     def __repr__(self):
-        return "P2PHeaderAndShortIDs(header=%s, nonce=%d, shortids_length=%d, shortids=%s, prefilled_txn_length=%d, prefilledtxn=%s" % (repr(self.header), self.nonce, self.shortids_length, repr(self.shortids), self.prefilled_txn_length, repr(self.prefilled_txn))
+        return "P2PHeaderAndShortIDs(header=%s, nonce=%d, shortids_length=%d, shortids=%s, prefilled_txn_length=%d, prefilledtxn=%s, shortatxids_length=%d, shortatxids=%s, prefilled_atxn_length=%d, prefilledatxn=%s" % (repr(self.header), self.nonce, self.shortids_length, repr(self.shortids), self.prefilled_txn_length, repr(self.prefilled_txn), self.shortatxids_length, repr(self.shortatxids), self.prefilled_atxn_length, repr(self.prefilled_atxn))
 
 
 # P2P version of the above that will use witness serialization (for compact
@@ -821,17 +1274,24 @@ def calculate_shortid(k0, k1, tx_hash):
     expected_shortid &= 0x0000ffffffffffff
     return expected_shortid
 
+# Same as calculate_shortid, for all transaction hashes of a block at once
+def calculate_shortids(k0, k1, tx_hashes):
+    return [h & 0x0000ffffffffffff for h in siphash256_batch(k0, k1, tx_hashes)]
+
 
 # This version gets rid of the array lengths, and reinterprets the differential
 # encoding into indices that can be used for lookup.
 class HeaderAndShortIDs:
-    __slots__ = ("header", "nonce", "prefilled_txn", "shortids", "use_witness")
+    __slots__ = ("header", "nonce", "prefilled_atxn", "prefilled_txn", "shortatxids",
+                 "shortids", "use_witness")
 
     def __init__(self, p2pheaders_and_shortids = None):
         self.header = CBlockHeader()
         self.nonce = 0
         self.shortids = []
         self.prefilled_txn = []
+        self.shortatxids = []
+        self.prefilled_atxn = []
         self.use_witness = False
 
         if p2pheaders_and_shortids is not None:
@@ -842,6 +1302,11 @@ class HeaderAndShortIDs:
             for x in p2pheaders_and_shortids.prefilled_txn:
                 self.prefilled_txn.append(PrefilledTransaction(x.index + last_index + 1, x.tx))
                 last_index = self.prefilled_txn[-1].index
+            self.shortatxids = p2pheaders_and_shortids.shortatxids
+            last_index = -1
+            for x in p2pheaders_and_shortids.prefilled_atxn:
+                self.prefilled_atxn.append(PrefilledTransaction(x.index + last_index + 1, x.tx))
+                last_index = self.prefilled_atxn[-1].index
 
     def to_p2p(self):
         if self.use_witness:
@@ -858,6 +1323,14 @@ class HeaderAndShortIDs:
         for x in self.prefilled_txn:
             ret.prefilled_txn.append(PrefilledTransaction(x.index - last_index - 1, x.tx))
             last_index = x.index
+        ret.shortatxids_length = len(self.shortatxids)
+        ret.shortatxids = self.shortatxids
+        ret.prefilled_atxn_length = len(self.prefilled_atxn)
+        ret.prefilled_atxn = []
+        last_index = -1
+        for x in self.prefilled_atxn:
+            ret.prefilled_atxn.append(PrefilledTransaction(x.index - last_index - 1, x.tx))
+            last_index = x.index
         return ret
 
     def get_siphash_keys(self):
@@ -869,36 +1342,134 @@ class HeaderAndShortIDs:
         return [ key0, key1 ]
 
     # Version 2 compact blocks use wtxid in shortids (rather than txid)
-    def initialize_from_block(self, block, nonce=0, prefill_list = [0], use_witness = False):
+    def initialize_from_block(self, block, nonce=0, prefill_list = [0], use_witness = False, aprefill_list = []):
         self.header = CBlockHeader(block)
         self.nonce = nonce
         self.prefilled_txn = [ PrefilledTransaction(i, block.vtx[i]) for i in prefill_list ]
-        self.shortids = []
+        self.prefilled_atxn = [ PrefilledTransaction(i, block.vatx[i]) for i in aprefill_list ]
         self.use_witness = use_witness
         [k0, k1] = self.get_siphash_keys()
-        for i in range(len(block.vtx)):
+        self.shortids = calculate_shortids(k0, k1, self.get_tx_hashes(block.vtx, prefill_list))
+        self.shortatxids = calculate_shortids(k0, k1, self.get_tx_hashes(block.vatx, aprefill_list))
+
+    # The hashes the shortids are computed from, for the txs not prefilled
+    def get_tx_hashes(self, txs, prefill_list = []):
+        tx_hashes = []
+        for i in range(len(txs)):
             if i not in prefill_list:
-                tx_hash = block.vtx[i].sha256
-                if use_witness:
-                    tx_hash = block.vtx[i].calc_sha256(with_witness=True)
-                self.shortids.append(calculate_shortid(k0, k1, tx_hash))
+                txs[i].calc_sha256()
+                tx_hash = txs[i].sha256
+                if self.use_witness:
+                    tx_hash = txs[i].calc_sha256(with_witness=True)
+                tx_hashes.append(tx_hash)
+        return tx_hashes
 
     def __repr__(self):
-        return "HeaderAndShortIDs(header=%s, nonce=%d, shortids=%s, prefilledtxn=%s" % (repr(self.header), self.nonce, repr(self.shortids), repr(self.prefilled_txn))
+        return "HeaderAndShortIDs(header=%s, nonce=%d, shortids=%s, prefilledtxn=%s, shortatxids=%s, prefilledatxn=%s" % (repr(self.header), self.nonce, repr(self.shortids), repr(self.prefilled_txn), repr(self.shortatxids), repr(self.prefilled_atxn))
+
+
+# Rebuilds a block announced in a cmpctblock from its prefilled transactions
+# and the transactions we already have, like PartiallyDownloadedBlock in
+# src/blockencodings.h. Transactions that can't be matched are left as None
+# and have to be fetched with getblocktxn.
+class PartiallyDownloadedBlock:
+    __slots__ = ("atxn_available", "collisions", "from_store", "header", "prefilled",
+                 "txn_available")
+
+    def __init__(self, header_and_shortids, store_txs = ()):
+        self.header = header_and_shortids.header
+        self.prefilled = 0
+        self.from_store = 0
+        self.collisions = 0
+
+        # Index our transactions by the shortid they would have in this block.
+        # If two of them share a shortid we can't tell which one the block
+        # has, so such a shortid is never matched.
+        [k0, k1] = header_and_shortids.get_siphash_keys()
+        store_txs = list(store_txs)
+        store_shortids = calculate_shortids(k0, k1, header_and_shortids.get_tx_hashes(store_txs))
+        store_by_shortid = {}
+        for shortid, tx in zip(store_shortids, store_txs):
+            store_by_shortid[shortid] = None if shortid in store_by_shortid else tx
+
+        self.txn_available = self.init_data(header_and_shortids.prefilled_txn,
+                                            header_and_shortids.shortids, store_by_shortid)
+        self.atxn_available = self.init_data(header_and_shortids.prefilled_atxn,
+                                             header_and_shortids.shortatxids, store_by_shortid)
+
+    def init_data(self, prefilled_txn, shortids, store_by_shortid):
+        txn_available = [None] * (len(prefilled_txn) + len(shortids))
+        for x in prefilled_txn:
+            if x.index >= len(txn_available) or txn_available[x.index] is not None:
+                raise ValueError("invalid prefilled transaction index %d" % x.index)
+            txn_available[x.index] = x.tx
+            self.prefilled += 1
+
+        # The shortids fill the slots left over by the prefilled transactions
+        shortid_count = defaultdict(int)
+        for shortid in shortids:
+            shortid_count[shortid] += 1
+        slots = [i for i, tx in enumerate(txn_available) if tx is None]
+        for i, shortid in zip(slots, shortids):
+            if shortid not in store_by_shortid:
+                continue
+            tx = store_by_shortid[shortid]
+            if tx is None or shortid_count[shortid] > 1:
+                # Several of our transactions or several of the block's share
+                # this shortid
+                self.collisions += 1
+                continue
+            txn_available[i] = tx
+            self.from_store += 1
+        return txn_available
+
+    def missing_indexes(self):
+        return [i for i, tx in enumerate(self.txn_available) if tx is None]
+
+    def missing_aindexes(self):
+        return [i for i, tx in enumerate(self.atxn_available) if tx is None]
+
+    def is_complete(self):
+        return None not in self.txn_available and None not in self.atxn_available
+
+    # Fill in the missing transactions, in the order they were requested, and
+    # return the block. The caller should check its merkle root: a shortid can
+    # match the wrong transaction of ours.
+    def fill_block(self, transactions = (), atransactions = ()):
+        missing, amissing = self.missing_indexes(), self.missing_aindexes()
+        if len(transactions) != len(missing) or len(atransactions) != len(amissing):
+            raise ValueError("got %d/%d transactions, expected %d/%d" % (len(transactions), len(atransactions), len(missing), len(amissing)))
+        block = CBlock(self.header)
+        block.vtx = list(self.txn_available)
+        block.vatx = list(self.atxn_available)
+        for i, tx in zip(missing, transactions):
+            block.vtx[i] = tx
+        for i, tx in zip(amissing, atransactions):
+            block.vatx[i] = tx
+        return block
 
+    def __repr__(self):
+        return "PartiallyDownloadedBlock(header=%s, prefilled=%d, from_store=%d, collisions=%d, missing=%s, amissing=%s)" % (repr(self.header), self.prefilled, self.from_store, self.collisions, repr(self.missing_indexes()), repr(self.missing_aindexes()))
 
+
+# indexes are into the block's vtx, aindexes into its vatx
 class BlockTransactionsRequest:
-    __slots__ = ("blockhash", "indexes")
+    __slots__ = ("aindexes", "blockhash", "indexes")
 
-    def __init__(self, blockhash=0, indexes = None):
+    def __init__(self, blockhash=0, indexes = None, aindexes = None):
         self.blockhash = blockhash
         self.indexes = indexes if indexes is not None else []
+        self.aindexes = aindexes if aindexes is not None else []
 
+    @deser_method
     def deserialize(self, f):
         self.blockhash = deser_uint256(f)
         indexes_length = deser_compact_size(f)
         for i in range(indexes_length):
             self.indexes.append(deser_compact_size(f))
+        aindexes_length = deser_compact_size(f)
+        for i in range(aindexes_length):
+            self.aindexes.append(deser_compact_size(f))
 
     def serialize(self):
         r = b""
@@ -906,50 +1477,67 @@ class BlockTransactionsRequest:
         r += ser_compact_size(len(self.indexes))
         for x in self.indexes:
             r += ser_compact_size(x)
+        r += ser_compact_size(len(self.aindexes))
+        for x in self.aindexes:
+            r += ser_compact_size(x)
         return r
 
     # helper to set the differentially encoded indexes from absolute ones
-    def from_absolute(self, absolute_indexes):
-        self.indexes = []
+    def from_absolute(self, absolute_indexes, absolute_aindexes = None):
+        self.indexes = self.differential_encode(absolute_indexes)
+        if absolute_aindexes is not None:
+            self.aindexes = self.differential_encode(absolute_aindexes)
+
+    def to_absolute(self):
+        return self.differential_decode(self.indexes)
+
+    def to_absolute_aindexes(self):
+        return self.differential_decode(self.aindexes)
+
+    @staticmethod
+    def differential_encode(absolute_indexes):
+        indexes = []
         last_index = -1
         for x in absolute_indexes:
-            self.indexes.append(x-last_index-1)
+            indexes.append(x-last_index-1)
             last_index = x
+        return indexes
 
-    def to_absolute(self):
+    @staticmethod
+    def differential_decode(indexes):
         absolute_indexes = []
         last_index = -1
-        for x in self.indexes:
+        for x in indexes:
             absolute_indexes.append(x+last_index+1)
             last_index = absolute_indexes[-1]
         return absolute_indexes
 
     def __repr__(self):
-        return "BlockTransactionsRequest(hash=%064x indexes=%s)" % (self.blockhash, repr(self.indexes))
+        return "BlockTransactionsRequest(hash=%064x indexes=%s aindexes=%s)" % (self.blockhash, repr(self.indexes), repr(self.aindexes))
 
 
 class BlockTransactions:
-    __slots__ = ("blockhash", "transactions")
+    __slots__ = ("atransactions", "blockhash", "transactions")
 
-    def __init__(self, blockhash=0, transactions = None):
+    def __init__(self, blockhash=0, transactions = None, atransactions = None):
         self.blockhash = blockhash
         self.transactions = transactions if transactions is not None else []
+        self.atransactions = atransactions if atransactions is not None else []
 
+    @deser_method
     def deserialize(self, f):
         self.blockhash = deser_uint256(f)
         self.transactions = deser_vector(f, CTransaction)
+        self.atransactions = deser_vector(f, CTransaction)
 
     def serialize(self, with_witness=True):
-        r = b""
-        r += ser_uint256(self.blockhash)
-        if with_witness:
-            r += ser_vector(self.transactions, "serialize_with_witness")
-        else:
-            r += ser_vector(self.transactions, "serialize_without_witness")
-        return r
+        w = bytearray(ser_uint256(self.blockhash))
+        ser_tx_vector_into(w, self.transactions, with_witness)
+        ser_tx_vector_into(w, self.atransactions, with_witness)
+        return bytes(w)
 
     def __repr__(self):
-        return "BlockTransactions(hash=%064x transactions=%s)" % (self.blockhash, repr(self.transactions))
+        return "BlockTransactions(hash=%064x transactions=%s atransactions=%s)" % (self.blockhash, repr(self.transactions), repr(self.atransactions))
 
 
 class CPartialMerkleTree:
@@ -960,8 +1548,9 @@ class CPartialMerkleTree:
         self.vHash = []
         self.vBits = []
 
+    @deser_method
     def deserialize(self, f):
-        self.nTransactions = struct.unpack("<i", f.read(4))[0]
+        self.nTransactions = f.unpack(_INT32)
         self.vHash = deser_uint256_vector(f)
         vBytes = deser_string(f)
         self.vBits = []
@@ -989,6 +1578,7 @@ class CMerkleBlock:
         self.header = CBlockHeader()
         self.txn = CPartialMerkleTree()
 
+    @deser_method
     def deserialize(self, f):
         self.header.deserialize(f)
         self.txn.deserialize(f)
@@ -1020,24 +1610,25 @@ class msg_version:
         self.nStartingHeight = -1
         self.nRelay = MY_RELAY
 
+    @deser_method
     def deserialize(self, f):
-        self.nVersion = struct.unpack("<i", f.read(4))[0]
-        self.nServices = struct.unpack("<Q", f.read(8))[0]
-        self.nTime = struct.unpack("<q", f.read(8))[0]
+        self.nVersion = f.unpack(_INT32)
+        self.nServices = f.unpack(_UINT64)
+        self.nTime = f.unpack(_INT64)
         self.addrTo = CAddress()
         self.addrTo.deserialize(f, False)
 
         self.addrFrom = CAddress()
         self.addrFrom.deserialize(f, False)
-        self.nNonce = struct.unpack("<Q", f.read(8))[0]
+        self.nNonce = f.unpack(_UINT64)
         self.strSubVer = deser_string(f)
 
-        self.nStartingHeight = struct.unpack("<i", f.read(4))[0]
+        self.nStartingHeight = f.unpack(_INT32)
 
         if self.nVersion >= 70001:
             # Relay field is optional for version 70001 onwards
             try:
-                self.nRelay = struct.unpack("<b", f.read(1))[0]
+                self.nRelay = f.unpack(_INT8)
             except:
                 self.nRelay = 0
         else:
@@ -1070,6 +1661,7 @@ class msg_verack:
     def __init__(self):
         pass
 
+    @deser_method
     def deserialize(self, f):
         pass
 
@@ -1087,6 +1679,7 @@ class msg_addr:
     def __init__(self):
         self.addrs = []
 
+    @deser_method
     def deserialize(self, f):
         self.addrs = deser_vector(f, CAddress)
 
@@ -1107,6 +1700,7 @@ class msg_inv:
         else:
             self.inv = inv
 
+    @deser_method
     def deserialize(self, f):
         self.inv = deser_vector(f, CInv)
 
@@ -1124,6 +1718,7 @@ class msg_getdata:
     def __init__(self, inv=None):
         self.inv = inv if inv is not None else []
 
+    @deser_method
     def deserialize(self, f):
         self.inv = deser_vector(f, CInv)
 
@@ -1142,6 +1737,7 @@ class msg_getblocks:
         self.locator = CBlockLocator()
         self.hashstop = 0
 
+    @deser_method
     def deserialize(self, f):
         self.locator = CBlockLocator()
         self.locator.deserialize(f)
@@ -1165,6 +1761,7 @@ class msg_tx:
     def __init__(self, tx=CTransaction()):
         self.tx = tx
 
+    @deser_method
     def deserialize(self, f):
         self.tx.deserialize(f)
 
@@ -1192,6 +1789,7 @@ class msg_block:
         else:
             self.block = block
 
+    @deser_method
     def deserialize(self, f):
         self.block.deserialize(f)
 
@@ -1232,6 +1830,7 @@ class msg_getaddr:
     def __init__(self):
         pass
 
+    @deser_method
     def deserialize(self, f):
         pass
 
@@ -1249,8 +1848,9 @@ class msg_ping:
     def __init__(self, nonce=0):
         self.nonce = nonce
 
+    @deser_method
     def deserialize(self, f):
-        self.nonce = struct.unpack("<Q", f.read(8))[0]
+        self.nonce = f.unpack(_UINT64)
 
     def serialize(self):
         r = b""
@@ -1268,8 +1868,9 @@ class msg_pong:
     def __init__(self, nonce=0):
         self.nonce = nonce
 
+    @deser_method
     def deserialize(self, f):
-        self.nonce = struct.unpack("<Q", f.read(8))[0]
+        self.nonce = f.unpack(_UINT64)
 
     def serialize(self):
         r = b""
@@ -1287,6 +1888,7 @@ class msg_mempool:
     def __init__(self):
         pass
 
+    @deser_method
     def deserialize(self, f):
         pass
 
@@ -1304,6 +1906,7 @@ class msg_notfound:
     def __init__(self, vec=None):
         self.vec = vec or []
 
+    @deser_method
     def deserialize(self, f):
         self.vec = deser_vector(f, CInv)
 
@@ -1321,6 +1924,7 @@ class msg_sendheaders:
     def __init__(self):
         pass
 
+    @deser_method
     def deserialize(self, f):
         pass
 
@@ -1343,6 +1947,7 @@ class msg_getheaders:
         self.locator = CBlockLocator()
         self.hashstop = 0
 
+    @deser_method
     def deserialize(self, f):
         self.locator = CBlockLocator()
         self.locator.deserialize(f)
@@ -1368,6 +1973,7 @@ class msg_headers:
     def __init__(self, headers=None):
         self.headers = headers if headers is not None else []
 
+    @deser_method
     def deserialize(self, f):
         # comment in bvaultd indicates these should be deserialized as blocks
         blocks = deser_vector(f, CBlock)
@@ -1393,9 +1999,10 @@ class msg_reject:
         self.reason = b""
         self.data = 0
 
+    @deser_method
     def deserialize(self, f):
         self.message = deser_string(f)
-        self.code = struct.unpack("<B", f.read(1))[0]
+        self.code = f.unpack(_UINT8)
         self.reason = deser_string(f)
         if (self.code != self.REJECT_MALFORMED and
                 (self.message == b"block" or self.message == b"tx")):
@@ -1422,8 +2029,9 @@ class msg_feefilter:
     def __init__(self, feerate=0):
         self.feerate = feerate
 
+    @deser_method
     def deserialize(self, f):
-        self.feerate = struct.unpack("<Q", f.read(8))[0]
+        self.feerate = f.unpack(_UINT64)
 
     def serialize(self):
         r = b""
@@ -1442,9 +2050,10 @@ class msg_sendcmpct:
         self.announce = False
         self.version = 1
 
+    @deser_method
     def deserialize(self, f):
-        self.announce = struct.unpack("<?", f.read(1))[0]
-        self.version = struct.unpack("<Q", f.read(8))[0]
+        self.announce = f.unpack(_BOOL)
+        self.version = f.unpack(_UINT64)
 
     def serialize(self):
         r = b""
@@ -1463,6 +2072,7 @@ class msg_cmpctblock:
     def __init__(self, header_and_shortids = None):
         self.header_and_shortids = header_and_shortids
 
+    @deser_method
     def deserialize(self, f):
         self.header_and_shortids = P2PHeaderAndShortIDs()
         self.header_and_shortids.deserialize(f)
@@ -1483,6 +2093,7 @@ class msg_getblocktxn:
     def __init__(self):
         self.block_txn_request = None
 
+    @deser_method
     def deserialize(self, f):
         self.block_txn_request = BlockTransactionsRequest()
         self.block_txn_request.deserialize(f)
@@ -1503,6 +2114,7 @@ class msg_blocktxn:
     def __init__(self):
         self.block_transactions = BlockTransactions()
 
+    @deser_method
     def deserialize(self, f):
         self.block_transactions.deserialize(f)
 
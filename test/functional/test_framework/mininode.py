@@ -14,15 +14,20 @@ P2PInterface: A high-level interface object for communicating to a node over P2P
 P2PDataStore: A p2p interface class that keeps a store of transactions and blocks
               and can respond correctly to getdata and getheaders messages"""
 import asyncio
-from collections import defaultdict
-from io import BytesIO
+from collections import defaultdict, deque
 import logging
 import struct
 import sys
 import threading
+import time
 
 from test_framework.messages import (
+    BlockTransactionsRequest,
+    ByteReader,
+    CBlock,
     CBlockHeader,
+    CInv,
+    HeaderAndShortIDs,
     MIN_VERSION_SUPPORTED,
     msg_addr,
     msg_block,
@@ -49,14 +54,21 @@ from test_framework.messages import (
     MSG_TYPE_MASK,
     msg_verack,
     msg_version,
+    MSG_WITNESS_FLAG,
     NODE_NETWORK,
     NODE_WITNESS,
+    PartiallyDownloadedBlock,
+    ser_compact_size,
     sha256,
 )
 from test_framework.util import wait_until
 
 logger = logging.getLogger("TestFramework.mininode")
 
+# Messages of each type a connection with queue_messages keeps for
+# wait_for_message() by default, older ones are dropped
+MAX_QUEUED_MESSAGES = 100
+
 MESSAGEMAP = {
     b"addr": msg_addr,
     b"block": msg_block,
@@ -117,7 +129,8 @@ class P2PConnection(asyncio.Protocol):
         self.dstport = dstport
         # The initial message to send after the connection was made:
         self.on_connection_send_msg = None
-        self.recvbuf = b""
+        self.recvbuf = bytearray()
+        self.recvbuf_offset = 0
         self.magic_bytes = MAGIC_BYTES[net]
         logger.debug('Connecting to Bitcoin Node: %s:%d' % (self.dstaddr, self.dstport))
 
@@ -149,7 +162,8 @@ class P2PConnection(asyncio.Protocol):
         else:
             logger.debug("Closed connection to: %s:%d" % (self.dstaddr, self.dstport))
         self._transport = None
-        self.recvbuf = b""
+        self.recvbuf = bytearray()
+        self.recvbuf_offset = 0
         self.on_close()
 
     # Socket read methods
@@ -165,33 +179,44 @@ class P2PConnection(asyncio.Protocol):
 
         This method reads data from the buffer in a loop. It deserializes,
         parses and verifies the P2P header, then passes the P2P payload to
-        the on_message callback for processing."""
+        the on_message callback for processing.
+
+        Messages are parsed in place: recvbuf_offset is the start of the first
+        unread message, and the consumed bytes are only dropped from recvbuf
+        once no more complete messages are left, so that streaming many
+        messages doesn't copy the rest of the buffer after each one."""
         try:
-            while True:
-                if len(self.recvbuf) < 4:
-                    return
-                if self.recvbuf[:4] != self.magic_bytes:
-                    raise ValueError("got garbage %s" % repr(self.recvbuf))
-                if len(self.recvbuf) < 4 + 12 + 4 + 4:
-                    return
-                command = self.recvbuf[4:4+12].split(b"\x00", 1)[0]
-                msglen = struct.unpack("<i", self.recvbuf[4+12:4+12+4])[0]
-                checksum = self.recvbuf[4+12+4:4+12+4+4]
-                if len(self.recvbuf) < 4 + 12 + 4 + 4 + msglen:
-                    return
-                msg = self.recvbuf[4+12+4+4:4+12+4+4+msglen]
-                th = sha256(msg)
-                h = sha256(th)
-                if checksum != h[:4]:
-                    raise ValueError("got bad checksum " + repr(self.recvbuf))
-                self.recvbuf = self.recvbuf[4+12+4+4+msglen:]
-                if command not in MESSAGEMAP:
-                    raise ValueError("Received unknown command from %s:%d: '%s' %s" % (self.dstaddr, self.dstport, command, repr(msg)))
-                f = BytesIO(msg)
-                t = MESSAGEMAP[command]()
-                t.deserialize(f)
-                self._log_message("receive", t)
-                self.on_message(t)
+            # All views of recvbuf must be released before it is resized
+            with memoryview(self.recvbuf) as buf:
+                while True:
+                    pos = self.recvbuf_offset
+                    available = len(buf) - pos
+                    if available < 4:
+                        break
+                    if buf[pos:pos+4] != self.magic_bytes:
+                        raise ValueError("got garbage %s" % repr(buf[pos:].tobytes()))
+                    if available < 4 + 12 + 4 + 4:
+                        break
+                    command = buf[pos+4:pos+4+12].tobytes().split(b"\x00", 1)[0]
+                    msglen = struct.unpack_from("<i", buf, pos+4+12)[0]
+                    checksum = buf[pos+4+12+4:pos+4+12+4+4].tobytes()
+                    if available < 4 + 12 + 4 + 4 + msglen:
+                        break
+                    with buf[pos+4+12+4+4:pos+4+12+4+4+msglen] as msg:
+                        th = sha256(msg)
+                        h = sha256(th)
+                        if checksum != h[:4]:
+                            raise ValueError("got bad checksum " + repr(buf[pos:].tobytes()))
+                        self.recvbuf_offset = pos + 4 + 12 + 4 + 4 + msglen
+                        if command not in MESSAGEMAP:
+                            raise ValueError("Received unknown command from %s:%d: '%s' %s" % (self.dstaddr, self.dstport, command, repr(msg.tobytes())))
+                        t = MESSAGEMAP[command]()
+                        t.deserialize(ByteReader(msg))
+                    self._log_message("receive", t)
+                    self.on_message(t)
+            if self.recvbuf_offset:
+                del self.recvbuf[:self.recvbuf_offset]
+                self.recvbuf_offset = 0
         except Exception as e:
             logger.exception('Error reading message:', repr(e))
             raise
@@ -202,12 +227,13 @@ class P2PConnection(asyncio.Protocol):
 
     # Socket write methods
 
-    def send_message(self, message):
+    def send_message(self, message, payload=None):
         """Send a P2P message over the socket.
 
         This method takes a P2P payload, builds the P2P header and adds
-        the message to the send buffer to be sent over the socket."""
-        tmsg = self.build_message(message)
+        the message to the send buffer to be sent over the socket. payload is
+        message.serialize(), for callers that already have it."""
+        tmsg = self.build_message(message, payload)
         self._log_message("send", message)
         return self.send_raw_message(tmsg)
 
@@ -228,10 +254,10 @@ class P2PConnection(asyncio.Protocol):
 
     # Class utility methods
 
-    def build_message(self, message):
+    def build_message(self, message, payload=None):
         """Build a serialized P2P message"""
         command = message.command
-        data = message.serialize()
+        data = message.serialize() if payload is None else payload
         tmsg = self.magic_bytes
         tmsg += command
         tmsg += b"\x00" * (12 - len(command))
@@ -244,6 +270,9 @@ class P2PConnection(asyncio.Protocol):
 
     def _log_message(self, direction, msg):
         """Logs a message being sent or received over the connection."""
+        # repr() of a large message is expensive, skip it unless it's logged
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
         if direction == "send":
             log_message = "Send message to "
         elif direction == "receive":
@@ -262,8 +291,19 @@ class P2PInterface(P2PConnection):
     node over P2P.
 
     Individual testcases should subclass this and override the on_* methods
-    if they want to alter message handling behaviour."""
-    def __init__(self):
+    if they want to alter message handling behaviour.
+
+    Messages are delivered holding mininode_lock, which the test logic takes to
+    access the state of any connection. With queue_messages set, a connection
+    delivers its messages holding its own dispatch_lock instead, so that busy
+    connections don't contend for mininode_lock, and keeps the messages it
+    receives for wait_for_message(). Test logic then synchronizes with the
+    connection through dispatch_lock or wait_for_message().
+
+    Only the messages of commands that wait_for_message() has been called for
+    are kept, up to max_queued_messages of each. Pass queue_commands to also
+    keep the ones received before the first call."""
+    def __init__(self, *, queue_messages=False, queue_commands=(), max_queued_messages=MAX_QUEUED_MESSAGES):
         super().__init__()
 
         # Track number of messages of each type received and the most recent
@@ -271,6 +311,14 @@ class P2PInterface(P2PConnection):
         self.message_count = defaultdict(int)
         self.last_message = {}
 
+        self.queue_messages = queue_messages
+        self.dispatch_lock = threading.Condition() if queue_messages else mininode_lock
+        # commands whose messages are queued, pong for sync_with_ping()
+        self.queued_commands = {"pong"} | set(queue_commands)
+        # key is command, value is the messages received and not yet returned
+        # by wait_for_message(), oldest first
+        self.message_queues = defaultdict(lambda: deque(maxlen=max_queued_messages))
+
         # A count of the number of ping messages we've sent to the node
         self.ping_counter = 1
 
@@ -299,12 +347,15 @@ class P2PInterface(P2PConnection):
 
         We keep a count of how many of each message type has been received
         and the most recent message of each type."""
-        with mininode_lock:
+        with self.dispatch_lock:
             try:
                 command = message.command.decode('ascii')
                 self.message_count[command] += 1
                 self.last_message[command] = message
                 getattr(self, 'on_' + command)(message)
+                if self.queue_messages and command in self.queued_commands:
+                    self.message_queues[command].append(message)
+                    self.dispatch_lock.notify_all()
             except:
                 print("ERROR delivering %s (%s)" % (repr(message), sys.exc_info()[0]))
                 raise
@@ -360,13 +411,35 @@ class P2PInterface(P2PConnection):
 
     def wait_for_disconnect(self, timeout=60):
         test_function = lambda: not self.is_connected
-        wait_until(test_function, timeout=timeout, lock=mininode_lock)
+        wait_until(test_function, timeout=timeout, lock=self.dispatch_lock)
 
     # Message receiving helper methods
 
+    def wait_for_message(self, command, predicate=None, timeout=60):
+        """Wait for a message of type command, for which predicate is true if given, and return it.
+
+        Only for connections with queue_messages. Messages received before the
+        first call for a command count too if it is in queue_commands, and each
+        message is only returned once. Wakes up as soon as the message arrives
+        rather than polling."""
+        assert self.queue_messages, "wait_for_message() needs queue_messages"
+        time_end = time.time() + timeout
+        with self.dispatch_lock:
+            self.queued_commands.add(command)
+            while True:
+                queue = self.message_queues[command]
+                for i, message in enumerate(queue):
+                    if predicate is None or predicate(message):
+                        del queue[i]
+                        return message
+                remaining = time_end - time.time()
+                if remaining <= 0:
+                    raise AssertionError("No {} message received after {} seconds".format(command, timeout))
+                self.dispatch_lock.wait(remaining)
+
     def wait_for_block(self, blockhash, timeout=60):
         test_function = lambda: self.last_message.get("block") and self.last_message["block"].block.rehash() == blockhash
-        wait_until(test_function, timeout=timeout, lock=mininode_lock)
+        wait_until(test_function, timeout=timeout, lock=self.dispatch_lock)
 
     def wait_for_header(self, blockhash, timeout=60):
         def test_function():
@@ -375,7 +448,7 @@ class P2PInterface(P2PConnection):
                 return False
             return last_headers.headers[0].rehash() == blockhash
 
-        wait_until(test_function, timeout=timeout, lock=mininode_lock)
+        wait_until(test_function, timeout=timeout, lock=self.dispatch_lock)
 
     def wait_for_getdata(self, timeout=60):
         """Waits for a getdata message.
@@ -385,7 +458,7 @@ class P2PInterface(P2PConnection):
         immediately with success. TODO: change this method to take a hash value and only
         return true if the correct block/tx has been requested."""
         test_function = lambda: self.last_message.get("getdata")
-        wait_until(test_function, timeout=timeout, lock=mininode_lock)
+        wait_until(test_function, timeout=timeout, lock=self.dispatch_lock)
 
     def wait_for_getheaders(self, timeout=60):
         """Waits for a getheaders message.
@@ -395,7 +468,7 @@ class P2PInterface(P2PConnection):
         immediately with success. TODO: change this method to take a hash value and only
         return true if the correct block header has been requested."""
         test_function = lambda: self.last_message.get("getheaders")
-        wait_until(test_function, timeout=timeout, lock=mininode_lock)
+        wait_until(test_function, timeout=timeout, lock=self.dispatch_lock)
 
     def wait_for_inv(self, expected_inv, timeout=60):
         """Waits for an INV message and checks that the first inv object in the message was as expected."""
@@ -404,11 +477,11 @@ class P2PInterface(P2PConnection):
         test_function = lambda: self.last_message.get("inv") and \
                                 self.last_message["inv"].inv[0].type == expected_inv[0].type and \
                                 self.last_message["inv"].inv[0].hash == expected_inv[0].hash
-        wait_until(test_function, timeout=timeout, lock=mininode_lock)
+        wait_until(test_function, timeout=timeout, lock=self.dispatch_lock)
 
     def wait_for_verack(self, timeout=60):
         test_function = lambda: self.message_count["verack"]
-        wait_until(test_function, timeout=timeout, lock=mininode_lock)
+        wait_until(test_function, timeout=timeout, lock=self.dispatch_lock)
 
     # Message sending helper functions
 
@@ -419,8 +492,12 @@ class P2PInterface(P2PConnection):
     # Sync up with the node
     def sync_with_ping(self, timeout=60):
         self.send_message(msg_ping(nonce=self.ping_counter))
+        if self.queue_messages:
+            self.wait_for_message("pong", lambda m: m.nonce == self.ping_counter, timeout=timeout)
+            self.ping_counter += 1
+            return
         test_function = lambda: self.last_message.get("pong") and self.last_message["pong"].nonce == self.ping_counter
-        wait_until(test_function, timeout=timeout, lock=mininode_lock)
+        wait_until(test_function, timeout=timeout, lock=self.dispatch_lock)
         self.ping_counter += 1
 
 
@@ -457,16 +534,40 @@ class NetworkThread(threading.Thread):
 class P2PDataStore(P2PInterface):
     """A P2P data store class.
 
-    Keeps a block and transaction store and responds correctly to getdata and getheaders requests."""
+    Keeps a block and transaction store and responds correctly to getdata and getheaders requests.
+    After request_compact_blocks() it also rebuilds the compact blocks the node relays from its
+    transaction store, fetching the missing transactions with getblocktxn."""
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
         # store of blocks. key is block hash, value is a CBlock object
         self.block_store = {}
         self.last_block_hash = ''
         # store of txs. key is txid, value is a CTransaction object
         self.tx_store = {}
         self.getdata_requests = []
+        # block messages serialized in advance by send_blocks_bulk, until they
+        # are served. key is block hash, value is the payload of the block message
+        self.block_bytes = {}
+        # The chain of stored blocks that ends at last_block_hash, going back
+        # as far as the block store does, for answering getheaders. Heights
+        # count from the first block of this chain.
+        self.header_chain = []  # block hashes by height
+        self.header_chain_heights = {}  # height by block hash
+        self.header_chain_headers = []  # CBlockHeader objects by height
+        self.header_chain_bytes = []  # serialized headers messages entries by height
+        # compact block version we asked the node to use, None if we didn't
+        self.compact_block_version = None
+        # blocks announced with cmpctblock that still miss transactions. key is
+        # block hash, value is (PartiallyDownloadedBlock, time of the cmpctblock,
+        # bytes received so far)
+        self.partial_blocks = {}
+        # blocks announced with cmpctblock, once complete. key is block hash,
+        # value is a CBlock object
+        self.reconstructed_blocks = {}
+        self.compact_block_stats = defaultdict(int)
+        # seconds from receiving a cmpctblock to having the whole block
+        self.compact_block_latencies = []
 
     def on_getdata(self, message):
         """Check for the tx/block in our stores and if found, reply with an inv message."""
@@ -475,41 +576,169 @@ class P2PDataStore(P2PInterface):
             if (inv.type & MSG_TYPE_MASK) == MSG_TX and inv.hash in self.tx_store.keys():
                 self.send_message(msg_tx(self.tx_store[inv.hash]))
             elif (inv.type & MSG_TYPE_MASK) == MSG_BLOCK and inv.hash in self.block_store.keys():
-                self.send_message(msg_block(self.block_store[inv.hash]))
+                self.send_message(msg_block(self.block_store[inv.hash]), self.block_bytes.pop(inv.hash, None))
             else:
                 logger.debug('getdata message type {} received.'.format(hex(inv.type)))
 
+    def on_cmpctblock(self, message):
+        """Rebuild the block from our tx store and request the transactions we don't have."""
+        if self.compact_block_version is None:
+            return
+        use_witness = self.compact_block_version == 2
+        header_and_shortids = HeaderAndShortIDs(message.header_and_shortids)
+        header_and_shortids.use_witness = use_witness
+        blockhash = header_and_shortids.header.rehash()
+        if blockhash in self.block_store or blockhash in self.reconstructed_blocks or blockhash in self.partial_blocks:
+            return
+
+        stats = self.compact_block_stats
+        start = time.time()
+        try:
+            partial = PartiallyDownloadedBlock(header_and_shortids, self.tx_store.values())
+        except ValueError as e:
+            logger.debug('invalid cmpctblock {}: {}'.format(hex(blockhash), e))
+            stats["failed"] += 1
+            self.partial_blocks[blockhash] = (None, start, 0)
+            self.request_full_block(blockhash)
+            return
+        stats["blocks"] += 1
+        stats["prefilled"] += partial.prefilled
+        stats["from_store"] += partial.from_store
+        stats["collisions"] += partial.collisions
+        compact_size = len(message.header_and_shortids.serialize(with_witness=use_witness))
+        self.partial_blocks[blockhash] = (partial, start, compact_size)
+
+        missing, amissing = partial.missing_indexes(), partial.missing_aindexes()
+        if missing or amissing:
+            stats["missing"] += len(missing) + len(amissing)
+            request = msg_getblocktxn()
+            request.block_txn_request = BlockTransactionsRequest(blockhash)
+            request.block_txn_request.from_absolute(missing, amissing)
+            self.send_message(request)
+        else:
+            self.complete_block(blockhash)
+
+    def on_blocktxn(self, message):
+        """Complete a block we requested transactions for with getblocktxn."""
+        block_transactions = message.block_transactions
+        partial = self.partial_blocks.get(block_transactions.blockhash, (None,))[0]
+        if partial is None:
+            return
+        message_size = len(block_transactions.serialize(with_witness=self.compact_block_version == 2))
+        self.complete_block(block_transactions.blockhash, block_transactions.transactions,
+                            block_transactions.atransactions, message_size)
+
+    def on_block(self, message):
+        """Store a full block we fell back to requesting after failing to reconstruct it."""
+        block = message.block
+        block.rehash()
+        if block.sha256 in self.partial_blocks:
+            self.finish_block(block, self.partial_blocks.pop(block.sha256)[1])
+
+    def complete_block(self, blockhash, transactions=(), atransactions=(), message_size=0):
+        partial, start, compact_size = self.partial_blocks[blockhash]
+        stats = self.compact_block_stats
+        try:
+            block = partial.fill_block(transactions, atransactions)
+        except ValueError as e:
+            logger.debug('bad blocktxn for block {}: {}'.format(hex(blockhash), e))
+            block = None
+        # A shortid may have matched the wrong tx of ours, in vtx or in vatx
+        if (block is None or block.calc_merkle_root() != block.hashMerkleRoot
+                or block.calc_alert_merkle_root() != block.get_coinbase_alert_merkle_root()):
+            stats["failed"] += 1
+            self.partial_blocks[blockhash] = (None, start, 0)
+            self.request_full_block(blockhash)
+            return
+
+        del self.partial_blocks[blockhash]
+        block.rehash()
+        stats["reconstructed"] += 1
+        stats["compact_bytes"] += compact_size + message_size
+        stats["full_bytes"] += block.serialized_size(with_witness=self.compact_block_version == 2)
+        self.finish_block(block, start)
+
+    def finish_block(self, block, start):
+        self.reconstructed_blocks[block.sha256] = block
+        self.compact_block_latencies.append(time.time() - start)
+
+    def request_full_block(self, blockhash):
+        inv_type = MSG_BLOCK | MSG_WITNESS_FLAG if self.compact_block_version == 2 else MSG_BLOCK
+        self.send_message(msg_getdata([CInv(inv_type, blockhash)]))
+
+    def request_compact_blocks(self, version=2, announce=True):
+        """Ask the node to relay blocks as compact blocks, which this peer then reconstructs.
+
+        With announce set the node sends cmpctblock messages for new blocks
+        unsolicited (high bandwidth mode)."""
+        with self.dispatch_lock:
+            self.compact_block_version = version
+        message = msg_sendcmpct()
+        message.announce = announce
+        message.version = version
+        self.send_message(message)
+
+    def wait_for_reconstructed_block(self, blockhash, timeout=60):
+        test_function = lambda: blockhash in self.reconstructed_blocks
+        wait_until(test_function, timeout=timeout, lock=self.dispatch_lock)
+        return self.reconstructed_blocks[blockhash]
+
+    def update_header_chain(self):
+        """Make the indexed header chain end at last_block_hash.
+
+        Only the blocks added since the last call are hashed and serialized. If
+        last_block_hash is on a fork, the chain is cut back to the fork point
+        first."""
+        new_hashes = []
+        blockhash = self.last_block_hash
+        while blockhash not in self.header_chain_heights and blockhash in self.block_store:
+            new_hashes.append(blockhash)
+            blockhash = self.block_store[blockhash].hashPrevBlock
+
+        if blockhash in self.header_chain_heights:
+            # blockhash is the fork point
+            fork_height = self.header_chain_heights[blockhash]
+        else:
+            logger.debug('block hash {} not found in block store'.format(hex(blockhash)))
+            fork_height = -1
+        for stale_hash in self.header_chain[fork_height + 1:]:
+            del self.header_chain_heights[stale_hash]
+        del self.header_chain[fork_height + 1:]
+        del self.header_chain_headers[fork_height + 1:]
+        del self.header_chain_bytes[fork_height + 1:]
+
+        for blockhash in reversed(new_hashes):
+            header = CBlockHeader(self.block_store[blockhash])
+            self.header_chain_heights[blockhash] = len(self.header_chain)
+            self.header_chain.append(blockhash)
+            self.header_chain_headers.append(header)
+            # headers are serialized as blocks without transactions
+            self.header_chain_bytes.append(CBlock(header).serialize())
+
     def on_getheaders(self, message):
-        """Search back through our block store for the locator, and reply with a headers message if found."""
+        """Find the locator in our chain of stored blocks, and reply with a headers message of the blocks following it."""
 
         locator, hash_stop = message.locator, message.hashstop
 
         # Assume that the most recent block added is the tip
         if not self.block_store:
             return
+        self.update_header_chain()
+        tip_height = len(self.header_chain) - 1
 
-        headers_list = [self.block_store[self.last_block_hash]]
-        maxheaders = 2000
-        while headers_list[-1].sha256 not in locator.vHave:
-            # Walk back through the block store, adding headers to headers_list
-            # as we go.
-            prev_block_hash = headers_list[-1].hashPrevBlock
-            if prev_block_hash in self.block_store:
-                prev_block_header = CBlockHeader(self.block_store[prev_block_hash])
-                headers_list.append(prev_block_header)
-                if prev_block_header.sha256 == hash_stop:
-                    # if this is the hashstop header, stop here
-                    break
-            else:
-                logger.debug('block hash {} not found in block store'.format(hex(prev_block_hash)))
-                break
-
-        # Truncate the list if there are too many headers
-        headers_list = headers_list[:-maxheaders - 1:-1]
-        response = msg_headers(headers_list)
+        # Start from the last block of ours in the locator, or from hash_stop if
+        # it comes after that (and isn't the tip), or from the start of the
+        # chain. The starting block itself is sent too.
+        start = max([self.header_chain_heights.get(h, 0) for h in set(locator.vHave)] or [0])
+        stop_height = self.header_chain_heights.get(hash_stop, -1)
+        if stop_height < tip_height:
+            start = max(start, stop_height)
 
-        if response is not None:
-            self.send_message(response)
+        maxheaders = 2000
+        end = min(start + maxheaders, tip_height + 1)
+        response = msg_headers(self.header_chain_headers[start:end])
+        payload = ser_compact_size(end - start) + b"".join(self.header_chain_bytes[start:end])
+        self.send_message(response, payload)
 
     def send_blocks_and_test(self, blocks, node, *, success=True, force_send=False, reject_reason=None, expect_disconnect=False, timeout=60):
         """Send blocks to test node and test whether the tip advances.
@@ -523,7 +752,7 @@ class P2PDataStore(P2PInterface):
          - if success is False: assert that the node's tip doesn't advance
          - if reject_reason is set: assert that the correct reject message is logged"""
 
-        with mininode_lock:
+        with self.dispatch_lock:
             for block in blocks:
                 self.block_store[block.sha256] = block
                 self.last_block_hash = block.sha256
@@ -535,7 +764,7 @@ class P2PDataStore(P2PInterface):
                     self.send_message(msg_block(block=b))
             else:
                 self.send_message(msg_headers([CBlockHeader(blocks[-1])]))
-                wait_until(lambda: blocks[-1].sha256 in self.getdata_requests, timeout=timeout, lock=mininode_lock)
+                wait_until(lambda: blocks[-1].sha256 in self.getdata_requests, timeout=timeout, lock=self.dispatch_lock)
 
             if expect_disconnect:
                 self.wait_for_disconnect(timeout=timeout)
@@ -547,6 +776,49 @@ class P2PDataStore(P2PInterface):
             else:
                 assert node.getbestblockhash() != blocks[-1].hash
 
+    def send_blocks_bulk(self, blocks, node, *, timeout=60):
+        """Send a chain of blocks to the test node as fast as it takes them, and assert that its tip advances to the last one.
+
+        Unlike send_blocks_and_test, the headers of all blocks are announced up
+        front, in headers messages of up to 2000, getdata requests are served
+        from block messages serialized in advance, and only the node's tip is
+        waited for. Blocks the node already has are not requested again.
+        Returns how long the node took and its throughput, in blocks/s and MB/s
+        of block data."""
+
+        with self.dispatch_lock:
+            for block in blocks:
+                self.block_store[block.sha256] = block
+                self.block_bytes[block.sha256] = msg_block(block).serialize()
+            self.last_block_hash = blocks[-1].sha256
+            self.update_header_chain()
+            first = self.header_chain_heights[blocks[0].sha256]
+            assert self.header_chain[first:] == [block.sha256 for block in blocks], "blocks must form a chain"
+            headers = self.header_chain_headers[first:]
+            headers_bytes = self.header_chain_bytes[first:]
+        size = sum(len(self.block_bytes[block.sha256]) for block in blocks)
+
+        start = time.time()
+        try:
+            maxheaders = 2000
+            for i in range(0, len(headers), maxheaders):
+                batch_bytes = headers_bytes[i:i + maxheaders]
+                self.send_message(msg_headers(headers[i:i + maxheaders]), ser_compact_size(len(batch_bytes)) + b"".join(batch_bytes))
+            wait_until(lambda: node.getbestblockhash() == blocks[-1].hash, timeout=timeout)
+            elapsed = time.time() - start
+        finally:
+            # Drop the payloads of blocks that weren't requested
+            with self.dispatch_lock:
+                for block in blocks:
+                    self.block_bytes.pop(block.sha256, None)
+
+        return {
+            "blocks": len(blocks),
+            "seconds": elapsed,
+            "blocks_per_second": len(blocks) / elapsed,
+            "mb_per_second": size / elapsed / 1e6,
+        }
+
     def send_txs_and_test(self, txs, node, *, success=True, expect_disconnect=False, reject_reason=None):
         """Send txs to test node and test whether they're accepted to the mempool.
 
@@ -556,7 +828,7 @@ class P2PDataStore(P2PInterface):
          - if expect_disconnect is True: Skip the sync with ping
          - if reject_reason is set: assert that the correct reject message is logged."""
 
-        with mininode_lock:
+        with self.dispatch_lock:
             for tx in txs:
                 self.tx_store[tx.sha256] = tx
 
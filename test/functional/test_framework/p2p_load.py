@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019 The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Generate P2P load on a node from many peers.
+
+P2PLoadGenerator opens many LoadPeer connections to one node, all served by
+the NetworkThread's event loop, and sends a mix of messages to the node at
+target rates:
+
+    load = P2PLoadGenerator(node, txs=txs, atxs=alert_txs, invs=announced_txs)
+    load.connect(200)
+    report = load.run(60, {"tx": 50, "atx": 10, "inv": 100, "getheaders": 20})
+    for line in load.summary(report):
+        self.log.info(line)
+
+The node accepts 125 connections by default, start it with a higher
+-maxconnections for more peers.
+
+Each message is followed by a ping. The node processes the messages of a peer
+in order, so the round-trip latency of a message is the time until the pong
+comes back. While the load runs the node's CPU time and RSS are sampled."""
+from collections import defaultdict
+import concurrent.futures
+import time
+
+from .messages import (
+    CBlockLocator,
+    CInv,
+    MSG_BLOCK,
+    MSG_TX,
+    MSG_WITNESS_FLAG,
+    msg_getdata,
+    msg_getheaders,
+    msg_inv,
+    msg_ping,
+    msg_tx,
+)
+from .mininode import (
+    NetworkThread,
+    P2PDataStore,
+)
+from .util import wait_until
+
+# Ping nonces for timing messages start here, so that they don't collide with
+# the ones sync_with_ping() uses
+TIMED_PING_NONCE_START = 1 << 32
+
+
+class LoadPeer(P2PDataStore):
+    """A P2PDataStore that times the messages it sends with send_timed()."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # key is ping nonce, value is (message kind, send time)
+        self.pending = {}
+        self.next_nonce = TIMED_PING_NONCE_START
+        # key is message kind, value is the round-trip latencies in seconds
+        self.latencies = defaultdict(list)
+
+    def send_timed(self, kind, message):
+        """Send a message and a ping after it. Call with dispatch_lock held."""
+        self.next_nonce += 1
+        self.pending[self.next_nonce] = (kind, time.time())
+        self.send_message(message)
+        self.send_message(msg_ping(self.next_nonce))
+
+    def on_pong(self, message):
+        sent = self.pending.pop(message.nonce, None)
+        if sent is not None:
+            kind, start = sent
+            self.latencies[kind].append(time.time() - start)
+
+
+class P2PLoadGenerator:
+    """Sends a mix of P2P messages to a node from many peers at target rates.
+
+    The message kinds are the keys of self.factories. A factory takes the peer
+    the message is sent from and returns the message, or None once it has
+    nothing left to send. The built-in kinds are:
+
+     - tx, atx: relay the next of txs or atxs (alert transactions)
+     - inv: announce the next of invs, and serve it when the node asks for it
+
+    Every transaction should be in only one of txs, atxs and invs: once the
+    node has a transaction it doesn't request it again, so announcing it would
+    time a no-op.
+     - getdata: request one of the node's recent blocks
+     - getheaders: request the headers following one of the recent blocks
+
+    Other kinds can be added to factories before run()."""
+
+    def __init__(self, node, *, txs=(), atxs=(), invs=(), recent_blocks=100):
+        self.node = node
+        self.peers = []
+        self.txs = list(txs)
+        self.atxs = list(atxs)
+        self.invs = list(invs)
+        height = node.getblockcount()
+        self.block_hashes = [int(node.getblockhash(h), 16) for h in range(max(0, height - recent_blocks + 1), height + 1)]
+        self.next_index = defaultdict(int)
+        self.factories = {
+            "tx": lambda peer: self.next_tx("tx", self.txs, peer),
+            "atx": lambda peer: self.next_tx("atx", self.atxs, peer),
+            "inv": self.next_inv,
+            "getdata": self.next_getdata,
+            "getheaders": self.next_getheaders,
+        }
+
+    def connect(self, num_peers, peer_class=LoadPeer, **kwargs):
+        """Open num_peers more connections to the node.
+
+        kwargs go to peer_class, e.g. queue_messages=True lets each peer deliver
+        its messages under its own lock instead of mininode_lock."""
+        for _ in range(num_peers):
+            self.peers.append(self.node.add_p2p_connection(peer_class(**kwargs)))
+
+    def next_item(self, kind, items):
+        index = self.next_index[kind]
+        if index >= len(items):
+            return None
+        self.next_index[kind] += 1
+        return items[index]
+
+    def next_tx(self, kind, txs, peer):
+        tx = self.next_item(kind, txs)
+        return msg_tx(tx) if tx is not None else None
+
+    def next_inv(self, peer):
+        tx = self.next_item("inv", self.invs)
+        if tx is None:
+            return None
+        tx.calc_sha256()
+        peer.tx_store[tx.sha256] = tx
+        return msg_inv([CInv(MSG_TX, tx.sha256)])
+
+    def next_getdata(self, peer):
+        blockhash = self.block_hashes[self.next_index["getdata"] % len(self.block_hashes)]
+        self.next_index["getdata"] += 1
+        return msg_getdata([CInv(MSG_BLOCK | MSG_WITNESS_FLAG, blockhash)])
+
+    def next_getheaders(self, peer):
+        message = msg_getheaders()
+        message.locator = CBlockLocator()
+        message.locator.vHave = [self.block_hashes[self.next_index["getheaders"] % len(self.block_hashes)]]
+        self.next_index["getheaders"] += 1
+        return message
+
+    def send_at_rate(self, kind, rate, end):
+        """Send rate messages of kind per second, round-robin over the peers, until end (event loop time).
+
+        The messages are sent from the network thread. Returns a future that is
+        done once they all are."""
+        loop = NetworkThread.network_event_loop
+        factory = self.factories[kind]
+        done = concurrent.futures.Future()
+
+        def send(i, send_time):
+            try:
+                if send_time >= end:
+                    done.set_result(i)
+                    return
+                peer = self.peers[i % len(self.peers)]
+                with peer.dispatch_lock:
+                    message = factory(peer)
+                    if message is None:
+                        done.set_result(i)
+                        return
+                    peer.send_timed(kind, message)
+                # When behind schedule, call_at() runs the next send as soon
+                # as the loop has handled the pending I/O
+                loop.call_at(send_time + 1.0 / rate, send, i + 1, send_time + 1.0 / rate)
+            except Exception as e:
+                done.set_exception(e)
+
+        loop.call_soon_threadsafe(lambda: send(0, loop.time()))
+        return done
+
+    def run(self, duration, rates, *, sample_interval=1, timeout=60):
+        """Send messages for duration seconds, at rates[kind] messages per second of each kind.
+
+        Returns a report of the latencies per message kind and of the node's
+        resource usage, see summary()."""
+        assert self.peers, "connect() some peers first"
+        loop = NetworkThread.network_event_loop
+        for peer in self.peers:
+            with peer.dispatch_lock:
+                peer.latencies.clear()
+        rss = [self.node.get_mem_rss_kilobytes()]
+        cpu_start = self.node.get_cpu_seconds()
+        start = time.time()
+        # the default event loop's time() is time.monotonic(), which can be read from this thread
+        end = loop.time() + duration
+        futures = [self.send_at_rate(kind, rate, end) for kind, rate in rates.items()]
+        while concurrent.futures.wait(futures, timeout=sample_interval).not_done:
+            rss.append(self.node.get_mem_rss_kilobytes())
+        for f in futures:
+            f.result()
+        elapsed = time.time() - start
+
+        # Wait for the pongs of the last messages
+        for peer in self.peers:
+            wait_until(lambda: not peer.pending, timeout=timeout, lock=peer.dispatch_lock)
+        cpu_end = self.node.get_cpu_seconds()
+
+        latencies = defaultdict(list)
+        for peer in self.peers:
+            with peer.dispatch_lock:
+                for kind, values in peer.latencies.items():
+                    latencies[kind].extend(values)
+        rss = [r for r in rss if r is not None]
+        return {
+            "peers": len(self.peers),
+            "duration": elapsed,
+            "latencies": {kind: sorted(values) for kind, values in latencies.items()},
+            "cpu_seconds": cpu_end - cpu_start if cpu_start is not None and cpu_end is not None else None,
+            "rss_kilobytes": rss,
+        }
+
+    @staticmethod
+    def summary(report):
+        """Format a run() report as lines of text."""
+        lines = ["%d peers for %.1f s" % (report["peers"], report["duration"])]
+        for kind, values in sorted(report["latencies"].items()):
+            if not values:
+                continue
+            lines.append("%-10s %6d msgs %8.1f/s  latency median %7.2f ms  p99 %7.2f ms  max %7.2f ms" % (
+                kind, len(values), len(values) / report["duration"], values[len(values) // 2] * 1000,
+                values[min(len(values) - 1, len(values) * 99 // 100)] * 1000, values[-1] * 1000))
+        if report["cpu_seconds"] is not None:
+            lines.append("node CPU %.1f s (%.0f%%)" % (report["cpu_seconds"], 100 * report["cpu_seconds"] / report["duration"]))
+        if report["rss_kilobytes"]:
+            lines.append("node RSS %d kB at start, %d kB peak" % (report["rss_kilobytes"][0], max(report["rss_kilobytes"])))
+        return lines
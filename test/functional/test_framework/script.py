@@ -7,7 +7,7 @@
 This file is modified from python-bitcoinlib.
 """
 
-from .messages import CTransaction, CTxOut, sha256, hash256, uint256_from_str, ser_uint256, ser_string
+from .messages import CTxOut, sha256, hash256, uint256_from_str, ser_uint256, ser_string, ser_compact_size, ser_vector
 
 from binascii import hexlify
 import hashlib
@@ -623,73 +623,108 @@ def SignatureHash(script, txTo, inIdx, hashtype):
 
     if inIdx >= len(txTo.vin):
         return (HASH_ONE, "inIdx %d out of range (%d)" % (inIdx, len(txTo.vin)))
-    txtmp = CTransaction(txTo)
+    if (hashtype & 0x1f) == SIGHASH_SINGLE and inIdx >= len(txTo.vout):
+        return (HASH_ONE, "outIdx %d out of range (%d)" % (inIdx, len(txTo.vout)))
 
-    for txin in txtmp.vin:
-        txin.scriptSig = b''
-    txtmp.vin[inIdx].scriptSig = FindAndDelete(script, CScript([OP_CODESEPARATOR]))
+    # Serialize the modified transaction straight from txTo instead of
+    # modifying a copy, which is quadratic when signing every input.
+    blank_sequences = (hashtype & 0x1f) in (SIGHASH_NONE, SIGHASH_SINGLE)
+    if hashtype & SIGHASH_ANYONECANPAY:
+        vin = [(inIdx, txTo.vin[inIdx])]
+    else:
+        vin = enumerate(txTo.vin)
+
+    s = bytearray(struct.pack("<i", txTo.nVersion))
+    s += ser_compact_size(1 if hashtype & SIGHASH_ANYONECANPAY else len(txTo.vin))
+    for i, txin in vin:
+        s += txin.prevout.serialize()
+        if i == inIdx:
+            s += ser_string(FindAndDelete(script, CScript([OP_CODESEPARATOR])))
+            s += struct.pack("<I", txin.nSequence)
+        else:
+            s += ser_string(b'')
+            s += struct.pack("<I", 0 if blank_sequences else txin.nSequence)
 
     if (hashtype & 0x1f) == SIGHASH_NONE:
-        txtmp.vout = []
-
-        for i in range(len(txtmp.vin)):
-            if i != inIdx:
-                txtmp.vin[i].nSequence = 0
-
+        s += ser_vector([])
     elif (hashtype & 0x1f) == SIGHASH_SINGLE:
-        outIdx = inIdx
-        if outIdx >= len(txtmp.vout):
-            return (HASH_ONE, "outIdx %d out of range (%d)" % (outIdx, len(txtmp.vout)))
-
-        tmp = txtmp.vout[outIdx]
-        txtmp.vout = []
-        for i in range(outIdx):
-            txtmp.vout.append(CTxOut(-1))
-        txtmp.vout.append(tmp)
-
-        for i in range(len(txtmp.vin)):
-            if i != inIdx:
-                txtmp.vin[i].nSequence = 0
-
-    if hashtype & SIGHASH_ANYONECANPAY:
-        tmp = txtmp.vin[inIdx]
-        txtmp.vin = []
-        txtmp.vin.append(tmp)
-
-    s = txtmp.serialize_without_witness()
+        s += ser_compact_size(inIdx + 1)
+        s += CTxOut(-1).serialize() * inIdx
+        s += txTo.vout[inIdx].serialize()
+    else:
+        s += ser_vector(txTo.vout)
+    s += struct.pack("<I", txTo.nLockTime)
     s += struct.pack(b"<I", hashtype)
 
     hash = hash256(s)
 
     return (hash, None)
 
-# TODO: Allow cached hashPrevouts/hashSequence/hashOutputs to be provided.
-# Performance optimization probably not necessary for python tests, however.
+class SegwitVersion1SigHashCache:
+    """Midstates of SegwitVersion1SignatureHash() for one transaction.
+
+    hashPrevouts, hashSequence and hashOutputs are computed on first use and
+    reused for every input and hashtype, so signing all inputs is linear
+    instead of quadratic. They are recomputed when the number of inputs or
+    outputs changes; call invalidate() after editing outpoints, sequences or
+    outputs in place."""
+    __slots__ = ("tx", "_counts", "_prevouts", "_sequence", "_outputs")
+
+    def __init__(self, tx):
+        self.tx = tx
+        self.invalidate()
+
+    def invalidate(self):
+        self._counts = None
+        self._prevouts = None
+        self._sequence = None
+        self._outputs = None
+
+    def _check(self):
+        counts = (len(self.tx.vin), len(self.tx.vout))
+        if counts != self._counts:
+            self.invalidate()
+            self._counts = counts
+
+    def hash_prevouts(self):
+        self._check()
+        if self._prevouts is None:
+            self._prevouts = uint256_from_str(hash256(b"".join(i.prevout.serialize() for i in self.tx.vin)))
+        return self._prevouts
+
+    def hash_sequence(self):
+        self._check()
+        if self._sequence is None:
+            self._sequence = uint256_from_str(hash256(b"".join(struct.pack("<I", i.nSequence) for i in self.tx.vin)))
+        return self._sequence
+
+    def hash_outputs(self):
+        self._check()
+        if self._outputs is None:
+            self._outputs = uint256_from_str(hash256(b"".join(o.serialize() for o in self.tx.vout)))
+        return self._outputs
+
+
 # Note that this corresponds to sigversion == 1 in EvalScript, which is used
-# for version 0 witnesses.
-def SegwitVersion1SignatureHash(script, txTo, inIdx, hashtype, amount):
+# for version 0 witnesses. Pass a SegwitVersion1SigHashCache for txTo when
+# signing several inputs.
+def SegwitVersion1SignatureHash(script, txTo, inIdx, hashtype, amount, cache=None):
+    if cache is None:
+        cache = SegwitVersion1SigHashCache(txTo)
+    assert cache.tx is txTo
 
     hashPrevouts = 0
     hashSequence = 0
     hashOutputs = 0
 
     if not (hashtype & SIGHASH_ANYONECANPAY):
-        serialize_prevouts = bytes()
-        for i in txTo.vin:
-            serialize_prevouts += i.prevout.serialize()
-        hashPrevouts = uint256_from_str(hash256(serialize_prevouts))
+        hashPrevouts = cache.hash_prevouts()
 
     if (not (hashtype & SIGHASH_ANYONECANPAY) and (hashtype & 0x1f) != SIGHASH_SINGLE and (hashtype & 0x1f) != SIGHASH_NONE):
-        serialize_sequence = bytes()
-        for i in txTo.vin:
-            serialize_sequence += struct.pack("<I", i.nSequence)
-        hashSequence = uint256_from_str(hash256(serialize_sequence))
+        hashSequence = cache.hash_sequence()
 
     if ((hashtype & 0x1f) != SIGHASH_SINGLE and (hashtype & 0x1f) != SIGHASH_NONE):
-        serialize_outputs = bytes()
-        for o in txTo.vout:
-            serialize_outputs += o.serialize()
-        hashOutputs = uint256_from_str(hash256(serialize_outputs))
+        hashOutputs = cache.hash_outputs()
     elif ((hashtype & 0x1f) == SIGHASH_SINGLE and inIdx < len(txTo.vout)):
         serialize_outputs = txTo.vout[inIdx].serialize()
         hashOutputs = uint256_from_str(hash256(serialize_outputs))
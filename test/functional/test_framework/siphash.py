@@ -4,8 +4,19 @@
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 """Specialized SipHash-2-4 implementations.
 
-This implements SipHash-2-4 for 256-bit integers.
+This implements SipHash-2-4 for 256-bit integers, one at a time or a whole
+batch under the same key (vectorized with NumPy when it is installed).
 """
+import random
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Below this many hashes the NumPy setup costs more than it saves
+NUMPY_BATCH_MIN = 8
 
 def rotl64(n, b):
     return n >> (64 - b) | (n & ((1 << (64 - b)) - 1)) << b
@@ -61,3 +72,81 @@ def siphash256(k0, k1, h):
     v0, v1, v2, v3 = siphash_round(v0, v1, v2, v3)
     v0, v1, v2, v3 = siphash_round(v0, v1, v2, v3)
     return v0 ^ v1 ^ v2 ^ v3
+
+def siphash256_batch(k0, k1, hashes):
+    """Return [siphash256(k0, k1, h) for h in hashes], vectorized if possible."""
+    if numpy is None or len(hashes) < NUMPY_BATCH_MIN:
+        return [siphash256(k0, k1, h) for h in hashes]
+    return siphash256_numpy(k0, k1, hashes)
+
+def rotl64_numpy(v, b):
+    return (v << numpy.uint64(b)) | (v >> numpy.uint64(64 - b))
+
+def siphash_round_numpy(v0, v1, v2, v3):
+    # uint64 arithmetic wraps around, so no masking is needed
+    v0 += v1
+    v1 = rotl64_numpy(v1, 13)
+    v1 ^= v0
+    v0 = rotl64_numpy(v0, 32)
+    v2 += v3
+    v3 = rotl64_numpy(v3, 16)
+    v3 ^= v2
+    v0 += v3
+    v3 = rotl64_numpy(v3, 21)
+    v3 ^= v0
+    v2 += v1
+    v1 = rotl64_numpy(v1, 17)
+    v1 ^= v2
+    v2 = rotl64_numpy(v2, 32)
+    return (v0, v1, v2, v3)
+
+def siphash256_numpy(k0, k1, hashes):
+    """siphash256() of every hash at once, on uint64 arrays. Requires NumPy."""
+    words = numpy.frombuffer(b"".join(h.to_bytes(32, "little") for h in hashes), dtype="<u8")
+    n0, n1, n2, n3 = words.reshape(-1, 4).T.astype(numpy.uint64)
+    count = len(hashes)
+    v0 = numpy.full(count, 0x736f6d6570736575 ^ k0, dtype=numpy.uint64)
+    v1 = numpy.full(count, 0x646f72616e646f6d ^ k1, dtype=numpy.uint64)
+    v2 = numpy.full(count, 0x6c7967656e657261 ^ k0, dtype=numpy.uint64)
+    v3 = numpy.full(count, 0x7465646279746573 ^ k1, dtype=numpy.uint64) ^ n0
+    v0, v1, v2, v3 = siphash_round_numpy(v0, v1, v2, v3)
+    v0, v1, v2, v3 = siphash_round_numpy(v0, v1, v2, v3)
+    v0 ^= n0
+    v3 ^= n1
+    v0, v1, v2, v3 = siphash_round_numpy(v0, v1, v2, v3)
+    v0, v1, v2, v3 = siphash_round_numpy(v0, v1, v2, v3)
+    v0 ^= n1
+    v3 ^= n2
+    v0, v1, v2, v3 = siphash_round_numpy(v0, v1, v2, v3)
+    v0, v1, v2, v3 = siphash_round_numpy(v0, v1, v2, v3)
+    v0 ^= n2
+    v3 ^= n3
+    v0, v1, v2, v3 = siphash_round_numpy(v0, v1, v2, v3)
+    v0, v1, v2, v3 = siphash_round_numpy(v0, v1, v2, v3)
+    v0 ^= n3
+    v3 ^= numpy.uint64(0x2000000000000000)
+    v0, v1, v2, v3 = siphash_round_numpy(v0, v1, v2, v3)
+    v0, v1, v2, v3 = siphash_round_numpy(v0, v1, v2, v3)
+    v0 ^= numpy.uint64(0x2000000000000000)
+    v2 ^= numpy.uint64(0xFF)
+    v0, v1, v2, v3 = siphash_round_numpy(v0, v1, v2, v3)
+    v0, v1, v2, v3 = siphash_round_numpy(v0, v1, v2, v3)
+    v0, v1, v2, v3 = siphash_round_numpy(v0, v1, v2, v3)
+    v0, v1, v2, v3 = siphash_round_numpy(v0, v1, v2, v3)
+    return (v0 ^ v1 ^ v2 ^ v3).tolist()
+
+
+class TestFrameworkSipHash(unittest.TestCase):
+    def test_batch_matches_scalar(self):
+        """Check the batched (and NumPy, if installed) SipHash against siphash256()."""
+        rnd = random.Random(1)
+        keys = [(0, 0), ((1 << 64) - 1, (1 << 64) - 1)] + [(rnd.getrandbits(64), rnd.getrandbits(64)) for _ in range(8)]
+        for count in (0, 1, 2, NUMPY_BATCH_MIN - 1, NUMPY_BATCH_MIN, 257):
+            for k0, k1 in keys:
+                hashes = [rnd.getrandbits(256) for _ in range(count)]
+                if count >= 2:
+                    hashes[:2] = [0, (1 << 256) - 1]
+                expected = [siphash256(k0, k1, h) for h in hashes]
+                self.assertEqual(siphash256_batch(k0, k1, hashes), expected)
+                if numpy is not None:
+                    self.assertEqual(siphash256_numpy(k0, k1, hashes), expected)
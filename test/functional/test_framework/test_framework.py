@@ -4,6 +4,7 @@
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 """Base class for RPC testing."""
 
+from concurrent.futures import ThreadPoolExecutor
 import configparser
 from enum import Enum
 import logging
@@ -25,12 +26,14 @@ from .util import (
     assert_equal,
     check_json_precision,
     connect_nodes_bi,
+    copy_datadir,
     disconnect_nodes,
     get_datadir_path,
     initialize_datadir,
     p2p_port,
     sync_blocks,
     sync_mempools,
+    zmq_port,
 )
 
 
@@ -97,6 +100,8 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         self.rpc_timeout = 60  # Wait for up to 60 seconds for the RPC server to respond
         self.supports_cli = False
         self.bind_to_localhost_only = True
+        # addresses funded by reset_chain_with_funded_address(), by snapshot name
+        self.funded_addresses = {}
         self.set_test_params()
 
         assert hasattr(self, "num_nodes"), "Test must set self.num_nodes in set_test_params()"
@@ -129,6 +134,8 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
                             help="use bvault-cli instead of RPC for all commands")
         parser.add_argument("--perf", dest="perf", default=False, action="store_true",
                             help="profile running nodes with perf for the duration of the test")
+        parser.add_argument("--zmqsync", dest="zmqsync", default=False, action="store_true",
+                            help="wake up sync_blocks/sync_mempools on ZMQ notifications instead of polling (requires bvaultd and python3 zmq)")
         self.add_options(parser)
         self.options = parser.parse_args()
 
@@ -320,6 +327,7 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         assert_equal(len(extra_confs), num_nodes)
         assert_equal(len(extra_args), num_nodes)
         assert_equal(len(binary), num_nodes)
+        use_zmq = self.options.zmqsync and self._can_use_zmq_notifications()
         for i in range(num_nodes):
             self.nodes.append(TestNode(
                 i,
@@ -334,6 +342,7 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
                 extra_args=extra_args[i],
                 use_cli=self.options.usecli,
                 start_perf=self.options.perf,
+                zmq_notify_address="tcp://127.0.0.1:%d" % zmq_port(i) if use_zmq else None,
             ))
 
     def start_node(self, i, *args, **kwargs):
@@ -354,10 +363,14 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
             extra_args = [None] * self.num_nodes
         assert_equal(len(extra_args), self.num_nodes)
         try:
+            start_time = time.time()
             for i, node in enumerate(self.nodes):
                 node.start(extra_args[i], *args, **kwargs)
-            for node in self.nodes:
-                node.wait_for_rpc_connection()
+            launch_time = time.time()
+            # Wait for all nodes at once, so startup time is that of the slowest node
+            self._run_concurrently(lambda node: node.wait_for_rpc_connection(), self.nodes)
+            self.log.debug("Started {} nodes: launch {:.3f}s, RPC ready {:.3f}s".format(
+                len(self.nodes), launch_time - start_time, time.time() - launch_time))
         except:
             # If one node failed to start, stop the others
             self.stop_nodes()
@@ -374,13 +387,83 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
 
     def stop_nodes(self, wait=0):
         """Stop multiple bvaultd test nodes"""
-        for node in self.nodes:
-            # Issue RPC to stop nodes
-            node.stop_node(wait=wait)
-
-        for node in self.nodes:
-            # Wait for nodes to stop
-            node.wait_until_stopped()
+        start_time = time.time()
+        # Issue RPC to stop nodes
+        self._run_concurrently(lambda node: node.stop_node(wait=wait), self.nodes)
+        stop_time = time.time()
+
+        # Wait for nodes to stop
+        self._run_concurrently(lambda node: node.wait_until_stopped(), self.nodes)
+        self.log.debug("Stopped {} nodes: stop RPC {:.3f}s, shutdown {:.3f}s".format(
+            len(self.nodes), stop_time - start_time, time.time() - stop_time))
+
+    def wipe_datadirs(self):
+        """Remove the contents of every (stopped) node's datadir, concurrently"""
+        def wipe(i):
+            datadir = get_datadir_path(self.options.tmpdir, i)
+            if os.path.exists(datadir):
+                shutil.rmtree(datadir)
+                os.mkdir(datadir)
+
+        start_time = time.time()
+        self._run_concurrently(wipe, range(self.num_nodes))
+        self.log.debug("Wiped {} datadirs: {:.3f}s".format(self.num_nodes, time.time() - start_time))
+
+    def snapshot_datadirs(self, name):
+        """Save every (stopped) node's datadir as snapshot `name`, see restore_datadirs()"""
+        start_time = time.time()
+        self._run_concurrently(
+            lambda i: copy_datadir(get_datadir_path(self.options.tmpdir, i), self._snapshot_path(name, i)),
+            range(self.num_nodes))
+        self.log.debug("Saved snapshot {}: {:.3f}s".format(name, time.time() - start_time))
+
+    def restore_datadirs(self, name):
+        """Replace every (stopped) node's datadir with snapshot `name`.
+
+        Returns False, leaving the datadirs untouched, if the snapshot has not been saved yet."""
+        if not os.path.isdir(self._snapshot_path(name, 0)):
+            return False
+        start_time = time.time()
+        self._run_concurrently(
+            lambda i: copy_datadir(self._snapshot_path(name, i), get_datadir_path(self.options.tmpdir, i)),
+            range(self.num_nodes))
+        self.log.debug("Restored snapshot {}: {:.3f}s".format(name, time.time() - start_time))
+        return True
+
+    def reset_chain_with_funded_address(self, name, new_address, *, node=1, blocks=200):
+        """Reset the nodes to a fresh chain of `blocks` blocks mined by node `node` to a new address.
+
+        new_address(node) creates the address and returns the RPC result with its
+        'address', e.g. lambda node: node.getnewvaultalertaddress(pubkey). The chain
+        is mined once and saved as snapshot `name`, later calls restore the stopped
+        datadirs from it. Returns the address."""
+        self.stop_nodes(wait=1)
+        if not self.restore_datadirs(name):
+            self.wipe_datadirs()
+            self.nodes = []
+            self.setup_chain()
+            self.setup_network()
+            self.sync_all()
+            address = new_address(self.nodes[node])
+            self.nodes[node].generatetoaddress(blocks, address['address'])
+            self.sync_all()
+            self.stop_nodes(wait=1)
+            self.snapshot_datadirs(name)
+            self.funded_addresses[name] = address
+
+        # The datadirs now hold the chainstate and block index of the snapshot.
+        # -reindex would wipe them and replay every block file, so start without it.
+        extra_args = getattr(self, "extra_args", None)
+        if extra_args is not None:
+            self.extra_args = [[arg for arg in args if arg.split("=")[0] != "-reindex"] for args in extra_args]
+        try:
+            self.nodes = []
+            self.setup_network()
+            self.sync_all()
+        finally:
+            if extra_args is not None:
+                self.extra_args = extra_args
+        return self.funded_addresses[name]
 
     def restart_node(self, i, extra_args=None):
         """Stop and start a test node"""
@@ -415,6 +498,20 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
 
     # Private helper methods. These should not be accessed by the subclass test scripts.
 
+    def _run_concurrently(self, fn, items):
+        """Call fn on every item from its own thread and return the results in order.
+
+        Re-raises the first exception once all calls have finished."""
+        items = list(items)
+        if not items:
+            return []
+        with ThreadPoolExecutor(max_workers=len(items)) as executor:
+            futures = [executor.submit(fn, item) for item in items]
+        return [future.result() for future in futures]
+
+    def _snapshot_path(self, name, n):
+        return get_datadir_path(os.path.join(self.options.tmpdir, "snapshots", name), n)
+
     def _start_logging(self):
         # Add logger and logging handlers
         self.log = logging.getLogger('TestFramework')
@@ -443,6 +540,17 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
             rpc_handler.setLevel(logging.DEBUG)
             rpc_logger.addHandler(rpc_handler)
 
+    def _can_use_zmq_notifications(self):
+        try:
+            import zmq  # noqa
+        except ImportError:
+            self.log.warning("--zmqsync: python3-zmq module not available, falling back to polling")
+            return False
+        if not self.is_zmq_compiled():
+            self.log.warning("--zmqsync: bvaultd has not been built with zmq enabled, falling back to polling")
+            return False
+        return True
+
     def _initialize_chain(self):
         """Initialize a pre-mined blockchain for use by the test.
 
@@ -29,6 +29,7 @@ from .util import (
     rpc_url,
     wait_until,
     p2p_port,
+    ZMQNotifier,
 )
 
 # For Python 3.4 compatibility
@@ -61,11 +62,14 @@ class TestNode():
     To make things easier for the test writer, any unrecognised messages will
     be dispatched to the RPC connection."""
 
-    def __init__(self, i, datadir, *, rpchost, timewait, bvaultd, bitcoin_cli, coverage_dir, cwd, extra_conf=None, extra_args=None, use_cli=False, start_perf=False):
+    def __init__(self, i, datadir, *, rpchost, timewait, bvaultd, bitcoin_cli, coverage_dir, cwd, extra_conf=None, extra_args=None, use_cli=False, start_perf=False, zmq_notify_address=None):
         """
         Kwargs:
             start_perf (bool): If True, begin profiling the node with `perf` as soon as
                 the node starts.
+            zmq_notify_address (str): If set, the node publishes hashblock and hashtx
+                notifications on this ZMQ address and sync_blocks()/sync_mempools()
+                wait for them instead of polling.
         """
 
         self.index = i
@@ -92,6 +96,12 @@ class TestNode():
             "-debugexclude=leveldb",
             "-uacomment=testnode%d" % i,
         ]
+        # The ZMQNotifier subscribes while the node runs: start() creates it and
+        # stop_node() closes it
+        self.zmq_notify_address = zmq_notify_address
+        self.notifier = None
+        if zmq_notify_address is not None:
+            self.args += ["-zmqpub%s=%s" % (topic.decode(), zmq_notify_address) for topic in ZMQNotifier.TOPICS]
 
         self.cli = TestNodeCLI(bitcoin_cli, self.datadir)
         self.use_cli = use_cli
@@ -145,6 +155,23 @@ class TestNode():
             self.log.exception("Unable to get memory usage")
             return None
 
+    def get_cpu_seconds(self):
+        """Get the CPU time (user + system) used so far, per /proc.
+
+        Returns None if /proc is unavailable.
+        """
+        assert self.running
+
+        try:
+            with open("/proc/{}/stat".format(self.process.pid), encoding="utf8") as f:
+                # The fields after the executable name, which is in parentheses
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            self.log.exception("Unable to get CPU usage")
+            return None
+        # utime and stime, fields 14 and 15 of proc(5)
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
     def _node_msg(self, msg: str) -> str:
         """Return a modified msg that identifies this node by its index as a debugging aid."""
         return "[node %d] %s" % (self.index, msg)
@@ -198,6 +225,8 @@ class TestNode():
         self.process = subprocess.Popen(self.args + extra_args, env=subp_env, stdout=stdout, stderr=stderr, cwd=cwd, **kwargs)
 
         self.running = True
+        if self.zmq_notify_address is not None and self.notifier is None:
+            self.notifier = ZMQNotifier(self.zmq_notify_address)
         self.log.debug("bvaultd started, waiting for RPC to come up")
 
         if self.start_perf:
@@ -280,6 +309,10 @@ class TestNode():
         for profile_name in tuple(self.perf_subprocesses.keys()):
             self._stop_perf(profile_name)
 
+        if self.notifier is not None:
+            self.notifier.close()
+            self.notifier = None
+
         # Check that stderr is as expected
         self.stderr.seek(0)
         stderr = self.stderr.read().decode('utf-8').strip()
@@ -14,9 +14,15 @@ import logging
 import os
 import random
 import re
+import shutil
 from subprocess import CalledProcessError
 import time
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
 from . import coverage
 from .authproxy import AuthServiceProxy, JSONRPCException
 
@@ -206,6 +212,8 @@ def wait_until(predicate, *, attempts=float('inf'), timeout=float('inf'), lock=N
         timeout = 60
     attempt = 0
     time_end = time.time() + timeout
+    # Back off exponentially so predicates that become true quickly return quickly
+    delay = 0.001
 
     while attempt < attempts and time.time() < time_end:
         if lock:
@@ -216,7 +224,8 @@ def wait_until(predicate, *, attempts=float('inf'), timeout=float('inf'), lock=N
             if predicate():
                 return
         attempt += 1
-        time.sleep(0.05)
+        time.sleep(delay)
+        delay = min(delay * 2, 0.05)
 
     # Print the cause of the timeout
     predicate_source = inspect.getsourcelines(predicate)
@@ -273,6 +282,9 @@ def p2p_port(n):
 def rpc_port(n):
     return PORT_MIN + PORT_RANGE + n + (MAX_NODES * PortSeed.n) % (PORT_RANGE - 1 - MAX_NODES)
 
+def zmq_port(n):
+    return PORT_MIN + 2 * PORT_RANGE + n + (MAX_NODES * PortSeed.n) % (PORT_RANGE - 1 - MAX_NODES)
+
 def rpc_url(datadir, i, rpchost=None):
     rpc_u, rpc_p = get_auth_cookie(datadir)
     host = '127.0.0.1'
@@ -288,6 +300,9 @@ def rpc_url(datadir, i, rpchost=None):
 # Node functions
 ################
 
+# Linux ioctl that makes a file share the extents of another (copy-on-write clone)
+FICLONE = 0x40049409
+
 def initialize_datadir(dirname, n):
     datadir = get_datadir_path(dirname, n)
     if not os.path.isdir(datadir):
@@ -314,6 +329,34 @@ def append_config(datadir, options):
         for option in options:
             f.write(option + "\n")
 
+def copy_datadir(from_dir, to_dir):
+    """Copy a stopped node's datadir as cheaply as the filesystem allows.
+
+    LevelDB table files are never modified once written, so they are hardlinked.
+    Everything else (block files, wallets, logs) is appended to or rewritten in
+    place by bvaultd and gets a copy-on-write clone where supported (btrfs, xfs),
+    falling back to a plain copy."""
+    if os.path.exists(to_dir):
+        shutil.rmtree(to_dir)
+    shutil.copytree(from_dir, to_dir, copy_function=_clone_file)
+
+def _clone_file(src, dst):
+    if src.endswith('.ldb'):
+        try:
+            os.link(src, dst)
+            return dst
+        except OSError:
+            pass
+    if fcntl is not None:
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            shutil.copystat(src, dst)
+            return dst
+        except OSError:
+            pass
+    return shutil.copy2(src, dst)
+
 def get_auth_cookie(datadir):
     user = None
     password = None
@@ -375,6 +418,67 @@ def connect_nodes_bi(nodes, a, b):
     connect_nodes(nodes[a], b)
     connect_nodes(nodes[b], a)
 
+class ZMQNotifier():
+    """Subscriber for a node's hashblock and hashtx ZMQ notifications.
+
+    Used by sync_blocks() and sync_mempools() to wake up as soon as a node
+    connects a block or accepts a transaction instead of sleeping."""
+
+    TOPICS = (b"hashblock", b"hashtx")
+
+    def __init__(self, address):
+        import zmq
+        self.address = address
+        self.socket = zmq.Context.instance().socket(zmq.SUB)
+        for topic in self.TOPICS:
+            self.socket.setsockopt(zmq.SUBSCRIBE, topic)
+        self.socket.connect(address)
+
+    def drain(self):
+        """Discard all queued notifications."""
+        import zmq
+        while True:
+            try:
+                self.socket.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                return
+
+    def close(self):
+        self.socket.close(linger=0)
+
+class SyncWaiter():
+    """Waits between the checks of a sync loop.
+
+    If every node has a ZMQNotifier, wait() blocks until any of them publishes
+    a notification (capped at max_wait, as a notification may be missed while a
+    subscription is being set up). Otherwise it sleeps with exponential back-off
+    from 10ms up to max_wait."""
+
+    def __init__(self, rpc_connections, max_wait):
+        self.max_wait = max_wait
+        self.delay = min(0.01, max_wait)
+        notifiers = [getattr(c, 'notifier', None) for c in rpc_connections]
+        self.notifiers = notifiers if all(isinstance(n, ZMQNotifier) for n in notifiers) else None
+        if self.notifiers:
+            import zmq
+            self.poller = zmq.Poller()
+            for n in self.notifiers:
+                self.poller.register(n.socket, zmq.POLLIN)
+
+    def drain(self):
+        """Forget notifications received so far. Call before checking the nodes' state."""
+        if self.notifiers:
+            for n in self.notifiers:
+                n.drain()
+
+    def wait(self, stop_time):
+        remaining = max(stop_time - time.time(), 0)
+        if self.notifiers:
+            self.poller.poll(1000 * min(self.max_wait, remaining))
+        else:
+            time.sleep(min(self.delay, remaining))
+            self.delay = min(self.delay * 2, self.max_wait)
+
 def sync_blocks(rpc_connections, *, wait=1, timeout=60):
     """
     Wait until everybody has the same tip.
@@ -382,13 +486,18 @@ def sync_blocks(rpc_connections, *, wait=1, timeout=60):
     sync_blocks needs to be called with an rpc_connections set that has least
     one node already synced to the latest, stable tip, otherwise there's a
     chance it might return before all nodes are stably synced.
+
+    Returns as soon as the tips converge, see SyncWaiter for how it waits
+    in between (wait is the longest pause between two checks).
     """
     stop_time = time.time() + timeout
+    waiter = SyncWaiter(rpc_connections, wait)
     while time.time() <= stop_time:
+        waiter.drain()
         best_hash = [x.getbestblockhash() for x in rpc_connections]
         if best_hash.count(best_hash[0]) == len(rpc_connections):
             return
-        time.sleep(wait)
+        waiter.wait(stop_time)
     raise AssertionError("Block sync timed out:{}".format("".join("\n  {!r}".format(b) for b in best_hash)))
 
 def sync_mempools(rpc_connections, *, wait=1, timeout=60, flush_scheduler=True):
@@ -397,14 +506,16 @@ def sync_mempools(rpc_connections, *, wait=1, timeout=60, flush_scheduler=True):
     pools
     """
     stop_time = time.time() + timeout
+    waiter = SyncWaiter(rpc_connections, wait)
     while time.time() <= stop_time:
+        waiter.drain()
         pool = [set(r.getrawmempool()) for r in rpc_connections]
         if pool.count(pool[0]) == len(rpc_connections):
             if flush_scheduler:
                 for r in rpc_connections:
                     r.syncwithvalidationinterfacequeue()
             return
-        time.sleep(wait)
+        waiter.wait(stop_time)
     raise AssertionError("Mempool sync timed out:{}".format("".join("\n  {!r}".format(m) for m in pool)))
 
 # Transaction/Block functions
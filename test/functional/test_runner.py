@@ -25,6 +25,7 @@ import subprocess
 import tempfile
 import re
 import logging
+import unittest
 
 # Formatting. Default colors to empty strings.
 BOLD, GREEN, RED, GREY = ("", ""), ("", ""), ("", ""), ("", "")
@@ -66,6 +67,12 @@ if os.name != 'nt' or sys.getwindowsversion() >= (10, 0, 14393):
 TEST_EXIT_PASSED = 0
 TEST_EXIT_SKIPPED = 77
 
+# Framework modules with unit tests (unittest.TestCase classes), run before
+# the functional tests
+TEST_FRAMEWORK_MODULES = [
+    "siphash",
+]
+
 BASE_SCRIPTS = [
     # Scripts that are run by the travis build process.
     # Longest test should go first, to favor running tests in parallel
@@ -136,6 +143,7 @@ BASE_SCRIPTS = [
     'p2p_mempool.py',
     'mining_prioritisetransaction.py',
     'p2p_invalid_locator.py',
+    'p2p_load.py',
     'p2p_invalid_block.py',
     'p2p_invalid_messages.py',
     'p2p_invalid_tx.py',
@@ -372,6 +380,16 @@ def run_tests(*, test_list, src_dir, build_dir, tmpdir, jobs=1, enable_coverage=
             sys.stdout.buffer.write(e.output)
             raise
 
+    # Test framework unit tests
+    print("Running unit tests for test framework modules")
+    test_framework_tests = unittest.TestSuite()
+    for module in TEST_FRAMEWORK_MODULES:
+        test_framework_tests.addTest(unittest.TestLoader().loadTestsFromName("test_framework.{}".format(module)))
+    result = unittest.TextTestRunner(verbosity=1, failfast=True).run(test_framework_tests)
+    if not result.wasSuccessful():
+        logging.debug("Early exiting after failure in test framework unit tests")
+        sys.exit(False)
+
     #Run Tests
     job_queue = TestHandler(
         num_tests_parallel=jobs,
@@ -38,9 +38,20 @@ try:
 except ImportError:
     import httplib
 import base64
+import collections
+import contextlib
 import decimal
+import itertools
 import json
 import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import simplejson
+
+from jsonstream import JSONStreamReader, iter_array
 
 try:
     import urllib.parse as urlparse
@@ -51,6 +62,11 @@ USER_AGENT = "AuthServiceProxy/0.1"
 
 HTTP_TIMEOUT = 30
 
+DEFAULT_POOL_SIZE = 8
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_BATCH_BYTES = 1 << 20
+
 log = logging.getLogger("BitcoinRPC")
 
 
@@ -79,46 +95,37 @@ def EncodeDecimal(o):
     raise TypeError(repr(o) + " is not JSON serializable")
 
 
-def ApiResponse(v):
-    import simplejson
-
-    class _ApiResponseDict(dict):
-        def __init__(self, *args, **kwargs):
-            super().__init__(*args, **kwargs)
+class _ApiResponseDict(dict):
+    def __str__(self):
+        return simplejson.dumps(self, indent=4)
 
-        def __str__(self):
-            return simplejson.dumps(self, indent=4)
+    def __repr__(self):
+        return str(self)
 
-        def __repr__(self):
-            return str(self)
 
-    class _ApiResponseList(list):
-        def __init__(self, *args, **kwargs):
-            super().__init__(*args, **kwargs)
+class _ApiResponseList(list):
+    def __str__(self):
+        return simplejson.dumps(self, indent=4)
 
-        def __str__(self):
-            return simplejson.dumps(self, indent=4)
+    def __repr__(self):
+        return str(self)
 
-        def __repr__(self):
-            return str(self)
 
-    class _ApiResponseDecimal(decimal.Decimal):
-        def __new__(cls, value):
-            return decimal.Decimal.__new__(cls, value)
+class _ApiResponseDecimal(decimal.Decimal):
+    def __str__(self):
+        return str('{:f}'.format(self.normalize()))
 
-        def __str__(self):
-            return str('{:f}'.format(self.normalize()))
+    def __repr__(self):
+        return str(self)
 
-        def __repr__(self):
-            return str(self)
 
-    class _ApiResponseStr(str):
-        def __new__(cls, value):
-            return super().__new__(cls, value)
+class _ApiResponseStr(str):
+    def __repr__(self):
+        return str(self)
 
-        def __repr__(self):
-            return str(self)
 
+def ApiResponse(v):
+    """Recursively convert a decoded JSON value into pretty-printing dict/list/Decimal/str subclasses."""
     if isinstance(v, dict):
         return _ApiResponseDict({k: ApiResponse(vv) for k, vv in v.items()})
 
@@ -134,10 +141,104 @@ def ApiResponse(v):
     return v
 
 
+def LazyApiResponse(v):
+    """Wrap only the outermost value; nested values stay the objects json produced.
+
+    The whole result still pretty-prints on repr/str, since simplejson formats the nested values
+    at that point, but no per-element copy is made. Floats must be decoded as _ApiResponseDecimal
+    for them to print the same way as with ApiResponse.
+    """
+    if isinstance(v, dict):
+        return _ApiResponseDict(v)
+
+    elif isinstance(v, list):
+        return _ApiResponseList(v)
+
+    elif isinstance(v, decimal.Decimal):
+        return _ApiResponseDecimal(v)
+
+    elif isinstance(v, str):
+        return _ApiResponseStr(v)
+
+    return v
+
+
+RESPONSE_WRAPPED = 'wrapped'  # every nested value converted by ApiResponse (default)
+RESPONSE_LAZY = 'lazy'  # outermost value wrapped by LazyApiResponse
+RESPONSE_RAW = 'raw'  # decoded JSON returned as-is
+
+# response mode -> (parse_float for json.loads, result wrapper)
+RESPONSE_MODES = {
+    RESPONSE_WRAPPED: (decimal.Decimal, ApiResponse),
+    RESPONSE_LAZY: (_ApiResponseDecimal, LazyApiResponse),
+    RESPONSE_RAW: (decimal.Decimal, lambda v: v),
+}
+
+
+class ConnectionPool(object):
+    """Bounded pool of keep-alive HTTP connections to a single server.
+
+    Connections are opened lazily, at most `size` of them exist at a time and callers block
+    in `acquire` until one is free. A connection that failed mid-request is closed and
+    dropped instead of being handed out again.
+    """
+
+    def __init__(self, service_url, size=DEFAULT_POOL_SIZE, timeout=HTTP_TIMEOUT):
+        if size < 1: raise ValueError('pool size must be positive')
+        self.size = size
+        self.timeout = timeout
+        self.__url = urlparse.urlparse(service_url)
+        self.__idle = queue.LifoQueue()
+        self.__slots = threading.BoundedSemaphore(size)
+
+    def __new_conn(self):
+        port = 80 if self.__url.port is None else self.__url.port
+        if self.__url.scheme == 'https':
+            return httplib.HTTPSConnection(self.__url.hostname, port, timeout=self.timeout)
+        return httplib.HTTPConnection(self.__url.hostname, port, timeout=self.timeout)
+
+    def acquire(self):
+        self.__slots.acquire()
+        try:
+            return self.__idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return self.__new_conn()
+        except Exception:
+            self.__slots.release()
+            raise
+
+    def release(self, conn, discard=False):
+        if discard:
+            conn.close()
+        else:
+            self.__idle.put(conn)
+        self.__slots.release()
+
+    @contextlib.contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except BaseException:
+            self.release(conn, discard=True)
+            raise
+        self.release(conn)
+
+    def close(self):
+        while True:
+            try:
+                self.__idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
 class AuthServiceProxy(object):
-    __id_count = 0
+    __id_count = itertools.count(1)
 
-    def __init__(self, service_url, service_name=None, timeout=HTTP_TIMEOUT, connection=None):
+    def __init__(self, service_url, service_name=None, timeout=HTTP_TIMEOUT, connection=None, pool=None, response_mode=RESPONSE_WRAPPED,
+                 metrics=None):
         self.__service_url = service_url
         self.__service_name = service_name
         self.__url = urlparse.urlparse(service_url)
@@ -158,8 +259,17 @@ class AuthServiceProxy(object):
         self.__auth_header = b'Basic ' + base64.b64encode(authpair)
 
         self.__timeout = timeout
-
-        if connection:
+        self.__pool = pool
+        if response_mode not in RESPONSE_MODES: raise ValueError(f'unknown response mode {response_mode!r}')
+        self.__response_mode = response_mode
+        self.__parse_float, self.__wrap = RESPONSE_MODES[response_mode]
+        # optional RPCMetrics collector, shared with child proxies
+        self.__metrics = metrics
+
+        if pool is not None:
+            # Connections are borrowed from the pool for the duration of a single request
+            self.__conn = None
+        elif connection:
             # Callables re-use the connection of the original proxy
             self.__conn = connection
         elif self.__url.scheme == 'https':
@@ -170,6 +280,11 @@ class AuthServiceProxy(object):
                                                  timeout=timeout)
 
     def __reinit_conn(self):
+        if self.__metrics is not None:
+            self.__metrics.record_reconnect()
+        if self.__pool is not None:
+            # Broken pooled connections are already dropped by ConnectionPool.connection()
+            return
         try:
             if self.__url.scheme == 'https':
                 self.__conn = httplib.HTTPSConnection(self.__url.hostname, self.__url.port,
@@ -186,7 +301,8 @@ class AuthServiceProxy(object):
             raise AttributeError
         if self.__service_name is not None:
             name = "%s.%s" % (self.__service_name, name)
-        return AuthServiceProxy(self.__service_url, name, self.__timeout, self.__conn)
+        return AuthServiceProxy(self.__service_url, name, self.__timeout, self.__conn, self.__pool, self.__response_mode,
+                                self.__metrics)
 
     def __call__(self, *args):
         try:
@@ -198,29 +314,24 @@ class AuthServiceProxy(object):
             log.error(f'{type(e).__name__}: {e}')
 
     def __call(self, *args):
-        AuthServiceProxy.__id_count += 1
+        request_id = next(AuthServiceProxy.__id_count)
 
-        log.debug("-%s-> %s %s" % (AuthServiceProxy.__id_count, self.__service_name,
+        log.debug("-%s-> %s %s" % (request_id, self.__service_name,
                                    json.dumps(args, default=EncodeDecimal)))
         postdata = json.dumps({'version': '1.1',
                                'method': self.__service_name,
                                'params': args,
-                               'id': AuthServiceProxy.__id_count}, default=EncodeDecimal)
-        self.__conn.request('POST', self.__url.path, postdata,
-                            {'Host': self.__url.hostname,
-                             'User-Agent': USER_AGENT,
-                             'Authorization': self.__auth_header,
-                             'Content-type': 'application/json'})
-        self.__conn.sock.settimeout(self.__timeout)
-
-        response = self._get_response()
+                               'id': request_id}, default=EncodeDecimal)
+        response = self._request(postdata)
         if response.get('error') is not None:
+            if self.__metrics is not None:
+                self.__metrics.record_error(self.__service_name)
             raise JSONRPCException(response['error'])
         elif 'result' not in response:
             raise JSONRPCException({
                 'code': -343, 'message': 'missing JSON-RPC result'})
 
-        return ApiResponse(response['result'])
+        return self.__wrap(response['result'])
 
     def batch_(self, rpc_calls):
         """Batch RPC call.
@@ -229,19 +340,13 @@ class AuthServiceProxy(object):
         """
         batch_data = []
         for rpc_call in rpc_calls:
-            AuthServiceProxy.__id_count += 1
-            m = rpc_call.pop(0)
-            batch_data.append({"jsonrpc": "2.0", "method": m, "params": rpc_call, "id": AuthServiceProxy.__id_count})
+            m, params = rpc_call[0], list(rpc_call[1:])
+            batch_data.append({"jsonrpc": "2.0", "method": m, "params": params, "id": next(AuthServiceProxy.__id_count)})
 
         postdata = json.dumps(batch_data, default=EncodeDecimal)
         log.debug("--> " + postdata)
-        self.__conn.request('POST', self.__url.path, postdata,
-                            {'Host': self.__url.hostname,
-                             'User-Agent': USER_AGENT,
-                             'Authorization': self.__auth_header,
-                             'Content-type': 'application/json'})
         results = []
-        responses = self._get_response()
+        responses = self._request(postdata, 'batch')
         for response in responses:
             if response['error'] is not None:
                 raise JSONRPCException(response['error'])
@@ -252,8 +357,161 @@ class AuthServiceProxy(object):
                 results.append(response['result'])
         return results
 
-    def _get_response(self):
-        http_response = self.__conn.getresponse()
+    def stream_(self, *args, path=()):
+        """Call the method and decode its response incrementally, straight from the socket.
+           Yields the elements of the array result one at a time, or of the array found under the
+           keys in `path` inside the result (e.g. path=['transactions'] for listsinceblock), so
+           memory use is bounded by the largest element instead of the whole response.
+        """
+        request_id = next(AuthServiceProxy.__id_count)
+
+        log.debug("-%s-> %s %s" % (request_id, self.__service_name,
+                                   json.dumps(args, default=EncodeDecimal)))
+        postdata = json.dumps({'version': '1.1',
+                               'method': self.__service_name,
+                               'params': args,
+                               'id': request_id}, default=EncodeDecimal)
+        if self.__pool is None:
+            yield from self.__stream(self.__conn, postdata, path)
+        else:
+            with self.__pool.connection() as conn:
+                yield from self.__stream(conn, postdata, path)
+
+    def __stream(self, conn, postdata, path):
+        start = time.perf_counter()
+        self.__send(conn, postdata)
+        http_response = self.__get_http_response(conn)
+        members = {}
+        done = False
+        try:
+            reader = JSONStreamReader(http_response, self.__parse_float)
+            for element in iter_array(reader, ['result'] + list(path), members):
+                yield self.__wrap(element)
+            # drain the trailing newline so the connection can be reused
+            http_response.read()
+            done = True
+            if self.__metrics is not None:
+                # decoding is interleaved with the consumer, so it is not timed separately
+                self.__metrics.record_call(self.__service_name, time.perf_counter() - start, len(postdata),
+                                           int(http_response.getheader('Content-Length', 0)))
+        finally:
+            if not done and self.__pool is None:
+                # the response was not read to the end, so the connection can't be reused as is
+                conn.close()
+
+        if members.get('error') is not None:
+            if self.__metrics is not None:
+                self.__metrics.record_error(self.__service_name)
+            raise JSONRPCException(members['error'])
+        elif None in members:
+            raise JSONRPCException({
+                'code': -343, 'message': 'JSON-RPC result is not an array'})
+
+    def batch_iter(self, rpc_calls, chunk_size=DEFAULT_BATCH_SIZE, chunk_bytes=DEFAULT_BATCH_BYTES, in_flight=2):
+        """Chunked, pipelined batch RPC call.
+           Pass an iterable (may be lazy) of (method, params) pairs. It is split into batches of at most
+           `chunk_size` calls and `chunk_bytes` bytes of request body; in pooled mode up to `in_flight`
+           batches are outstanding at once. Yields one result per call, in order; failed calls yield
+           their JSONRPCException instead of raising it.
+        """
+        chunks = self.__batch_chunks(rpc_calls, chunk_size, chunk_bytes)
+        if self.__pool is None or in_flight <= 1:
+            for ids, postdata in chunks:
+                yield from self.__batch_results(ids, self._request(postdata, 'batch'), self.__wrap)
+            return
+
+        with ThreadPoolExecutor(max_workers=min(in_flight, self.__pool.size)) as executor:
+            pending = collections.deque()
+            for ids, postdata in chunks:
+                pending.append((ids, executor.submit(self._request, postdata, 'batch')))
+                if len(pending) >= in_flight:
+                    ids, future = pending.popleft()
+                    yield from self.__batch_results(ids, future.result(), self.__wrap)
+            while pending:
+                ids, future = pending.popleft()
+                yield from self.__batch_results(ids, future.result(), self.__wrap)
+
+    @staticmethod
+    def __batch_chunks(rpc_calls, chunk_size, chunk_bytes):
+        ids, parts, size = [], [], 2
+        for method, params in rpc_calls:
+            request_id = next(AuthServiceProxy.__id_count)
+            part = json.dumps({'jsonrpc': '2.0', 'method': method, 'params': list(params), 'id': request_id}, default=EncodeDecimal)
+            if parts and (len(parts) >= chunk_size or size + len(part) + 1 > chunk_bytes):
+                yield ids, '[' + ','.join(parts) + ']'
+                ids, parts, size = [], [], 2
+            ids.append(request_id)
+            parts.append(part)
+            size += len(part) + 1
+        if parts:
+            yield ids, '[' + ','.join(parts) + ']'
+
+    @staticmethod
+    def __batch_results(ids, responses, wrap):
+        if isinstance(responses, dict):
+            # the server rejected the batch as a whole
+            raise JSONRPCException(responses.get('error') or {
+                'code': -343, 'message': 'missing JSON-RPC batch response'})
+
+        responses = {response.get('id'): response for response in responses}
+        for request_id in ids:
+            response = responses.get(request_id)
+            if response is None:
+                yield JSONRPCException({'code': -343, 'message': 'missing JSON-RPC response'})
+            elif response.get('error') is not None:
+                yield JSONRPCException(response['error'])
+            elif 'result' not in response:
+                yield JSONRPCException({'code': -343, 'message': 'missing JSON-RPC result'})
+            else:
+                yield wrap(response['result'])
+
+    def _request(self, postdata, method=None):
+        """POST `postdata` and return the decoded response.
+
+        In pooled mode a connection is held only for this one round-trip, so proxies sharing
+        a pool can be used from several threads at once. `method` labels the call in metrics
+        (defaults to the service name).
+        """
+        if self.__pool is None:
+            return self.__post(self.__conn, postdata, method)
+        with self.__pool.connection() as conn:
+            return self.__post(conn, postdata, method)
+
+    def __post(self, conn, postdata, method):
+        start = time.perf_counter()
+        self.__send(conn, postdata)
+        responsedata = self.__get_http_response(conn).read()
+        decode_start = time.perf_counter()
+        response = self.__decode(responsedata)
+        if self.__metrics is not None:
+            end = time.perf_counter()
+            self.__metrics.record_call(method or self.__service_name, end - start, len(postdata), len(responsedata),
+                                       end - decode_start)
+        return response
+
+    def __send(self, conn, postdata):
+        conn.request('POST', self.__url.path, postdata,
+                     {'Host': self.__url.hostname,
+                      'User-Agent': USER_AGENT,
+                      'Authorization': self.__auth_header,
+                      'Content-type': 'application/json'})
+        conn.sock.settimeout(self.__timeout)
+
+    def _get_response(self, conn=None):
+        return self.__decode(self.__get_http_response(conn or self.__conn).read())
+
+    def __decode(self, responsedata):
+        responsedata = responsedata.decode('utf8')
+        response = json.loads(responsedata, parse_float=self.__parse_float)
+        if "error" in response and response["error"] is None:
+            log.debug("<-%s- %s" % (response["id"], json.dumps(response["result"], default=EncodeDecimal)))
+        else:
+            log.debug("<-- " + responsedata)
+        return response
+
+    @staticmethod
+    def __get_http_response(conn):
+        http_response = conn.getresponse()
         if http_response is None:
             raise JSONRPCException({
                 'code': -342, 'message': 'missing HTTP response from server'})
@@ -263,10 +521,4 @@ class AuthServiceProxy(object):
             raise JSONRPCException({
                 'code': -342, 'message': 'non-JSON HTTP response with \'%i %s\' from server' % (http_response.status, http_response.reason)})
 
-        responsedata = http_response.read().decode('utf8')
-        response = json.loads(responsedata, parse_float=decimal.Decimal)
-        if "error" in response and response["error"] is None:
-            log.debug("<-%s- %s" % (response["id"], json.dumps(response["result"], default=EncodeDecimal)))
-        else:
-            log.debug("<-- " + responsedata)
-        return response
+        return http_response
@@ -0,0 +1,140 @@
+"""
+  Incremental JSON decoding straight from a byte stream (e.g. an http.client response).
+
+  JSONStreamReader only keeps the undecoded tail of the input in memory, so walking a huge
+  document element by element needs about as much memory as its largest element:
+
+      reader = JSONStreamReader(http_response)
+      for tx in iter_array(reader, ['result', 'transactions']):
+          ...
+"""
+
+import codecs
+import decimal
+import json
+import re
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+# characters a JSON number can continue with
+_NUMBER_CHARS = re.compile(r'[0-9.eE+\-]*')
+
+
+class JSONStreamReader(object):
+    def __init__(self, stream, parse_float=decimal.Decimal, chunk_size=STREAM_CHUNK_SIZE):
+        self.__stream = stream
+        self.__decoder = json.JSONDecoder(parse_float=parse_float)
+        self.__utf8 = codecs.getincrementaldecoder('utf8')()
+        self.__chunk_size = chunk_size
+        self.__buf = ''
+        self.__pos = 0
+        self.__eof = False
+
+    def __fill(self, size):
+        """Read about `size` more bytes into the buffer. Returns False at end of stream."""
+        if self.__eof:
+            return False
+        # drop what has been decoded already, the buffer only holds the value being decoded
+        self.__buf = self.__buf[self.__pos:]
+        self.__pos = 0
+        data = self.__stream.read(size)
+        if not data:
+            self.__eof = True
+            self.__buf += self.__utf8.decode(b'', final=True)
+            return False
+        self.__buf += self.__utf8.decode(data)
+        return True
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it ('' at end of stream)."""
+        while True:
+            self.__pos = _WHITESPACE.match(self.__buf, self.__pos).end()
+            if self.__pos < len(self.__buf):
+                return self.__buf[self.__pos]
+            if not self.__fill(self.__chunk_size):
+                return ''
+
+    def expect(self, ch):
+        found = self.peek()
+        if found != ch:
+            raise ValueError(f'expected {ch!r} in JSON stream, found {found!r}')
+        self.__pos += 1
+
+    def value(self):
+        """Decode and return the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.__decoder.raw_decode(self.__buf, self.__pos)
+            except json.JSONDecodeError:
+                # incomplete value, grow the buffer geometrically so large values are not re-scanned too often
+                if not self.__fill(max(self.__chunk_size, len(self.__buf) - self.__pos)):
+                    raise
+                continue
+            if _NUMBER_CHARS.match(self.__buf, end).end() == len(self.__buf) and self.__fill(self.__chunk_size):
+                # the value reaches the end of the buffer, or is only followed by characters of a
+                # number: a number cut by the chunk boundary (e.g. '1.' | '5') may continue in the next chunk
+                continue
+            self.__pos = end
+            return value
+
+    def items(self):
+        """Yield the elements of the array starting at the current position."""
+        self.expect('[')
+        if self.peek() == ']':
+            self.__pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.peek() == ']':
+                self.__pos += 1
+                return
+            self.expect(',')
+
+    def members(self):
+        """Yield the keys of the object starting at the current position.
+
+        The caller has to consume the value of every key (with value(), items() or members())
+        before asking for the next one.
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self.__pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.peek() == '}':
+                self.__pos += 1
+                return
+            self.expect(',')
+
+
+def iter_array(reader, path, members=None, _outermost=True):
+    """Yield the elements of the array found under the object keys in `path`.
+
+    Every other member of the outermost object is decoded whole and stored in `members`
+    (when given), so e.g. the JSON-RPC 'error' can be checked once the stream is exhausted.
+    If the value under `path` is not an array it is stored in `members` under the key None.
+    """
+    members = {} if members is None else members
+    if not path:
+        if reader.peek() == '[':
+            yield from reader.items()
+        else:
+            members[None] = reader.value()
+        return
+
+    if reader.peek() != '{':
+        members[None] = reader.value()
+        return
+
+    for key in reader.members():
+        if key == path[0]:
+            yield from iter_array(reader, path[1:], members, False)
+        elif _outermost:
+            members[key] = reader.value()
+        else:
+            reader.value()
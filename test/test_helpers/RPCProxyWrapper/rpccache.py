@@ -0,0 +1,76 @@
+"""
+  Size-bounded LRU cache for results of bvaultd RPC calls that do not change once known,
+  e.g. a block by hash or a confirmed transaction by txid.
+
+  Entries are keyed by (method, params). The cache is thread-safe so that it can be shared by
+  a pooled RPCProxyWrapper; it only stores what its caller decides is immutable.
+"""
+
+import collections
+import threading
+
+DEFAULT_CACHE_SIZE = 4096
+
+
+class RPCCache(object):
+    def __init__(self, size=DEFAULT_CACHE_SIZE):
+        if size < 1: raise ValueError('cache size must be positive')
+        self.size = size
+        self.__entries = collections.OrderedDict()
+        # reentrant, so that callers can hold it around several operations that must be atomic
+        self.lock = threading.RLock()
+        # bumped by invalidate(), so that results fetched before an invalidation are not stored after it
+        self.__generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def lookup(self, method, params, fetch, cacheable=lambda result: result is not None, store=None):
+        """Return the cached result of `method(*params)`, or call `fetch()` and cache its result
+           when `cacheable(result)` holds. If given, `store(result)` is cached instead of the result itself.
+        """
+        key = (method, tuple(params))
+        with self.lock:
+            if key in self.__entries:
+                self.__entries.move_to_end(key)
+                self.hits += 1
+                return self.__entries[key]
+            self.misses += 1
+            generation = self.__generation
+
+        result = fetch()
+        if cacheable(result):
+            with self.lock:
+                if self.__generation == generation: self.put(method, params, store(result) if store else result)
+        return result
+
+    def put(self, method, params, result):
+        key = (method, tuple(params))
+        with self.lock:
+            self.__entries[key] = result
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.size:
+                self.__entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, method, params):
+        with self.lock:
+            self.__entries.pop((method, tuple(params)), None)
+
+    def invalidate(self, *methods):
+        """Drop all entries of the given methods, or everything if none are given."""
+        with self.lock:
+            self.__generation += 1
+            if not methods:
+                self.__entries.clear()
+                return
+            for key in [key for key in self.__entries if key[0] in methods]:
+                del self.__entries[key]
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self.__entries), 'size': self.size}
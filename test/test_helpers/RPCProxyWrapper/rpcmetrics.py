@@ -0,0 +1,115 @@
+"""
+  Per-method RPC metrics for AuthServiceProxy: call and error counts, wall-time histograms,
+  request/response sizes, JSON decode time and reconnects.
+
+      metrics = RPCMetrics()
+      conn = RPCProxyWrapper(rpcport=18887, rpcuser='user', rpcpass='pass', metrics=metrics)
+      ...
+      metrics.as_dict()['getblock']['calls']
+      print(metrics.prometheus())
+"""
+
+import bisect
+import threading
+
+# upper bounds in seconds, the last (+Inf) bucket is implicit
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class _MethodMetrics(object):
+    def __init__(self, buckets):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.decode_seconds = 0.0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.bucket_counts = [0] * (len(buckets) + 1)
+
+    def as_dict(self, buckets):
+        cumulative, histogram = 0, {}
+        for le, count in zip(buckets + (float('inf'),), self.bucket_counts):
+            cumulative += count
+            histogram[le] = cumulative
+        return {'calls': self.calls, 'errors': self.errors, 'seconds': self.seconds,
+                'decode_seconds': self.decode_seconds, 'request_bytes': self.request_bytes,
+                'response_bytes': self.response_bytes, 'histogram': histogram}
+
+
+class RPCMetrics(object):
+    """Thread-safe collector; one instance can be shared by several proxies."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.__lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.__lock:
+            self.__methods = {}
+            self.reconnects = 0
+
+    def __method(self, method):
+        if method not in self.__methods:
+            self.__methods[method] = _MethodMetrics(self.buckets)
+        return self.__methods[method]
+
+    def record_call(self, method, seconds, request_bytes=0, response_bytes=0, decode_seconds=0.0):
+        with self.__lock:
+            m = self.__method(method)
+            m.calls += 1
+            m.seconds += seconds
+            m.decode_seconds += decode_seconds
+            m.request_bytes += request_bytes
+            m.response_bytes += response_bytes
+            m.bucket_counts[bisect.bisect_left(self.buckets, seconds)] += 1
+
+    def record_error(self, method):
+        with self.__lock:
+            self.__method(method).errors += 1
+
+    def record_reconnect(self):
+        with self.__lock:
+            self.reconnects += 1
+
+    def as_dict(self):
+        """Return {method: {...}} plus 'reconnects'; histograms are cumulative, keyed by upper bound."""
+        with self.__lock:
+            result = {method: m.as_dict(self.buckets) for method, m in self.__methods.items()}
+            result['reconnects'] = self.reconnects
+        return result
+
+    def prometheus(self, prefix='bvault_rpc'):
+        """Render the metrics in the Prometheus text exposition format."""
+        metrics = self.as_dict()
+        reconnects = metrics.pop('reconnects')
+        lines = []
+
+        def family(name, kind, help, samples):
+            lines.append(f'# HELP {prefix}_{name} {help}')
+            lines.append(f'# TYPE {prefix}_{name} {kind}')
+            lines.extend(f'{prefix}_{name}{suffix} {value}' for suffix, value in samples)
+
+        methods = sorted(metrics)
+        family('calls_total', 'counter', 'RPC calls by method.',
+               [(f'{{method="{m}"}}', metrics[m]['calls']) for m in methods])
+        family('errors_total', 'counter', 'RPC calls that returned a JSON-RPC error, by method.',
+               [(f'{{method="{m}"}}', metrics[m]['errors']) for m in methods])
+
+        samples = []
+        for m in methods:
+            for le, count in metrics[m]['histogram'].items():
+                samples.append((f'_bucket{{method="{m}",le="{"+Inf" if le == float("inf") else repr(le)}"}}', count))
+            samples.append((f'_sum{{method="{m}"}}', repr(metrics[m]['seconds'])))
+            samples.append((f'_count{{method="{m}"}}', metrics[m]['calls']))
+        family('call_duration_seconds', 'histogram', 'RPC wall time by method.', samples)
+
+        family('decode_seconds_total', 'counter', 'Time spent decoding JSON responses, by method.',
+               [(f'{{method="{m}"}}', repr(metrics[m]['decode_seconds'])) for m in methods])
+        family('request_bytes_total', 'counter', 'Bytes of JSON-RPC requests sent, by method.',
+               [(f'{{method="{m}"}}', metrics[m]['request_bytes']) for m in methods])
+        family('response_bytes_total', 'counter', 'Bytes of JSON-RPC responses received, by method.',
+               [(f'{{method="{m}"}}', metrics[m]['response_bytes']) for m in methods])
+        family('reconnects_total', 'counter', 'HTTP connections re-established after a failure.',
+               [('', reconnects)])
+        return '\n'.join(lines) + '\n'